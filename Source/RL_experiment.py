@@ -26,6 +26,8 @@ from simulation import SimulationEnv
 from agent import Agent
 # models used by the RL agent to interact with and learn from environment 
 from model import FeatureTransformer, Model, EnvironmentModel
+# weights-only files the value function models are saved to
+from weights import load_model
 # policy that the RL agent follows when interacting with the environment
 from policy import Policy
 # manager to hide a couple hundreds rows of code and to keep the presentation neat
@@ -167,7 +169,7 @@ env = SimulationEnv(distortions = distortions)
 lr = 0.001
 gamma = 0.5
 eps = 0.5
-model = joblib.load('bookkeeping/' + name + '/episode_' + str(train_episodes) + '/model.pkl')
+model = load_model('bookkeeping/' + name + '/episode_' + str(train_episodes) + '/model.crm', env = env)
 model.set_learning_rate(lr)
 
 # pass adjustments to the current agent
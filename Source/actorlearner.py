@@ -0,0 +1,189 @@
+'''
+ActorLearnerRunner class trains an agent with the simulation and the learning
+decoupled. Actor processes run episodes of their own copy of the environment
+with a snapshot of the value weights and stream the changed (previous state,
+action, state, reward) tuples of every week into a bounded queue, so actors
+that get ahead of the learner block until it catches up. The learner, the
+calling process, stores the tuples in the replay buffer of its agent, updates
+the value function on minibatches of them and publishes the new weights into
+shared memory. Actors refresh their weights every few weeks, or as soon as they
+fall more than max_staleness publications behind. Weeks that still arrive staler
+than that are stored but do not trigger an update, as the tuples of a week
+correct the rewards of tuples already stored. Throughput is reported in
+environment steps per second.
+'''
+
+# import external packages
+import time
+import queue
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+
+# import internal classes
+from cache import spawn_seeds
+from checkpoint import agent_models, copy_weights
+
+# offsets of the weight arrays in the shared memory, which starts with the publication counter
+def weights_layout(weights):
+    layout = {}
+    offset = 8
+    for name, array in weights.items():
+        layout[name] = (offset, array.shape, array.dtype.str)
+        offset += array.nbytes
+    return layout, offset
+
+# views of the publication counter and the weight arrays in the shared memory
+def shared_views(memory, layout):
+    counter = np.ndarray(1, dtype = np.int64, buffer = memory.buf)
+    arrays = {name: np.ndarray(shape, dtype = dtype, buffer = memory.buf, offset = offset) for name, (offset, shape, dtype) in layout.items()}
+    return counter, arrays
+
+# copy the published weights into the models of the agent, the publication they belong to is returned
+def refresh_weights(agent, counter, arrays, lock):
+    with lock:
+        version = int(counter[0])
+        for name, model in agent_models(agent).items():
+            for key, array in model.to_arrays().items():
+                array[...] = arrays[name + '/' + key]
+            model.new_version()
+    return version
+
+# run episodes of an actor, sending the changed tuples of every week with the publication of the weights that chose the action
+def run_actor(index, agent, seed, episodes, sample_action, memory_name, layout, lock, transitions, refresh_every, max_staleness):
+    np.random.seed(seed)
+    memory = shared_memory.SharedMemory(name = memory_name)
+    counter, arrays = shared_views(memory, layout)
+    sample_action = getattr(agent.policy, sample_action)
+    version = refresh_weights(agent, counter, arrays, lock)
+    steps = 0
+    blocked = 0
+    start = time.perf_counter()
+    try:
+        for episode in range(episodes):
+            observation, _ = agent.env.reset()
+            done = False
+            while not done:
+                if steps % refresh_every == 0 or int(counter[0]) - version > max_staleness:
+                    version = refresh_weights(agent, counter, arrays, lock)
+                action = sample_action(agent.model, observation, agent.eps, agent.target_model)
+                observation, reward, done, truncated, info = agent.env.step(action)
+                steps += 1
+                put_start = time.perf_counter()
+                transitions.put(('transitions', index, episode, version, agent.changed_transitions()))
+                blocked += time.perf_counter() - put_start
+        transitions.put(('done', index, steps, blocked, time.perf_counter() - start))
+    finally:
+        del counter, arrays
+        memory.close()
+
+class ActorLearnerRunner:
+    # train the agent with a number of actor processes playing episodes each, the learner publishes its weights every
+    # publish_every received weeks and at most queue_size weeks wait in the queue
+    def __init__(self, agent, actors = 2, episodes = 1, sample_action = 'boltzmann_q_sample_action', queue_size = 8, publish_every = 1,
+                 refresh_every = 4, max_staleness = 32, seed = 0, report_every = 10):
+        self.agent = agent
+        self.actors = actors
+        self.episodes = episodes
+        self.sample_action = sample_action
+        self.queue_size = queue_size
+        self.publish_every = publish_every
+        self.refresh_every = refresh_every
+        self.max_staleness = max_staleness
+        self.seeds = spawn_seeds(seed, actors)      # independent seed of each actor
+        self.report_every = report_every
+        self.version = 0                            # number of weight publications
+        self.replay_ids = {}                        # replay buffer id of the tuple of each (actor, episode, week, action)
+        self.stats = {'steps': 0, 'skipped': 0, 'learner time': 0, 'elapsed': 0, 'actors': {}}
+
+    # copy the weights of the learner into the shared memory
+    def publish(self, counter, arrays, lock):
+        weights = copy_weights(self.agent)
+        with lock:
+            for name, array in weights.items():
+                arrays[name][...] = array
+            self.version += 1
+            counter[0] = self.version
+
+    # store the tuples of a received week and update the value function as a training step of the agent does
+    def learn(self, actor_index, episode, version, transitions):
+        self.agent.steps += 1
+        self.stats['steps'] += 1
+        # the tuples of a week are reward corrections to the tuples already stored, so they are stored whatever their staleness,
+        # Q-learning being off-policy, and only the update is skipped for a week chosen with stale weights
+        if transitions is not None:
+            weeks, actions, prev_observations, observations, rewards, defined = transitions
+            keys = [(actor_index, episode, week, action) for week, action in zip(weeks.tolist(), actions.tolist())]
+            self.agent.store_transitions(keys, prev_observations, actions, observations, rewards, defined, self.replay_ids)
+        if self.version - version > self.max_staleness:
+            self.stats['skipped'] += 1
+            return
+        self.agent.learn_replay()
+        if self.agent.planning_updates > 0 and self.agent.learn_environment():
+            self.agent.plan()
+
+    # run the actors until they finish their episodes, report(runner) is called every report_every received weeks
+    def run(self, report = None):
+        report = self.print_report if report is None else report
+        layout, size = weights_layout(copy_weights(self.agent))
+        memory = shared_memory.SharedMemory(create = True, size = size)
+        context = multiprocessing.get_context()
+        lock = context.Lock()
+        transitions = context.Queue(maxsize = self.queue_size)
+        processes = []
+        start = time.perf_counter()
+        try:
+            counter, arrays = shared_views(memory, layout)
+            self.publish(counter, arrays, lock)
+            for index in range(self.actors):
+                process = context.Process(target = run_actor, args = (index, self.agent, self.seeds[index], self.episodes, self.sample_action, memory.name, layout,
+                                                                      lock, transitions, self.refresh_every, self.max_staleness), daemon = True)
+                process.start()
+                processes.append(process)
+
+            finished = 0
+            received = 0
+            while finished < self.actors:
+                try:
+                    message = transitions.get(timeout = 1)
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        raise RuntimeError('the actors stopped before finishing their episodes')
+                    continue
+                if message[0] == 'done':
+                    index, steps, blocked, elapsed = message[1:]
+                    self.stats['actors'][index] = {'steps': steps, 'blocked': blocked, 'steps per second': steps / elapsed}
+                    finished += 1
+                    continue
+                learner_start = time.perf_counter()
+                self.learn(*message[1:])
+                received += 1
+                if received % self.publish_every == 0:
+                    self.publish(counter, arrays, lock)
+                self.stats['learner time'] += time.perf_counter() - learner_start
+                self.stats['elapsed'] = time.perf_counter() - start
+                if received % self.report_every == 0:
+                    report(self)
+            for process in processes:
+                process.join()
+            self.stats['elapsed'] = time.perf_counter() - start
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            # the shared arrays must not be referenced when the memory is released
+            counter = arrays = None
+            memory.close()
+            memory.unlink()
+        report(self)
+        return self
+
+    # environment steps per second received by the learner
+    def throughput(self):
+        return self.stats['steps'] / self.stats['elapsed'] if self.stats['elapsed'] > 0 else 0
+
+    # print the received steps, the throughput and the share of the time the learner was busy
+    def print_report(self, runner):
+        busy = self.stats['learner time'] / self.stats['elapsed'] if self.stats['elapsed'] > 0 else 0
+        print('steps: {}, {:.1f} steps/s, learner busy {:.0%}, weights published {}, stale updates skipped {}'.format(
+            self.stats['steps'], self.throughput(), busy, self.version, self.stats['skipped']), end = "\r")
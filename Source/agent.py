@@ -10,13 +10,19 @@ import os
 import pandas as pd
 import numpy as np
 import datetime as dt
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d.axes3d import Axes3D
 import joblib
 
+# import internal classes
+from replay import ReplayBuffer, PrioritizedReplayBuffer
+from recorder import ProgressRecorder
+from checkpoint import checkpoint_service
+
 class Agent():
     # initialize agent parameters
-    def __init__(self, env, model, env_model, policy, eps, gamma1, gamma2, target_model = None):
+    # with planning_updates set, every real step is followed by that many value updates on transitions simulated by the environment model
+    # observed transitions are kept in a replay buffer of replay_capacity transitions, every step the value function is updated on
+    # replay_ratio minibatches of batch_size transitions sampled from it, with prioritized set those with the highest TD errors
+    def __init__(self, env, model, env_model, policy, eps, gamma1, gamma2, target_model = None, planning_updates = 0, replay_capacity = 20000, batch_size = 128, replay_ratio = 4, prioritized = False):
         self.env = env
         self.model = model
         self.target_model = target_model
@@ -25,32 +31,85 @@ class Agent():
         self.eps = eps
         self.gamma1 = gamma1
         self.gamma2 = gamma2
+        self.planning_updates = planning_updates
+        self.q_cache = {}                       # q-values on the state grid of each model with the model version they were predicted for
+        self.init_replay(replay_capacity, batch_size, replay_ratio, prioritized)
         
         # timing
         self.start_time = dt.datetime.now()
         self.time = dt.datetime.now()
     
-    # get (previous state-action-state-reward) tuples and update the value function parameters
-    def learn_value(self):
-        # get the environment history
-        iteration = self.env.env.iteration
-        rewards = self.env.env.rewards
-        states = self.env.env.stateFeatures
-        predicted_states = self.env.env.statePrediction
-        action_set = self.env.env.action_set
+    # create an empty replay buffer
+    def init_replay(self, replay_capacity = 20000, batch_size = 128, replay_ratio = 4, prioritized = False):
+        buffer_class = PrioritizedReplayBuffer if prioritized else ReplayBuffer
+        self.replay = buffer_class(replay_capacity, self.env.observation_space.shape[0])
+        self.batch_size = batch_size
+        self.replay_ratio = replay_ratio
+        self.replay_ids = {}                    # replay buffer id of the transition of each (week, action) reward of the current episode
+        self.steps = 0                          # real steps taken in all the episodes
+    
+    # restore a pickled instance, instances saved before the q-values cache, planning or the replay buffer get them
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('q_cache', {})
+        self.__dict__.setdefault('planning_updates', 0)
+        if 'replay' not in state:
+            self.init_replay()
+    
+    # (previous state, action, predicted state, reward) tuples of every action of the weeks whose rewards were defined or changed since
+    # the last call, as arrays of weeks, actions, previous states, predicted states, rewards and whether the tuple is defined
+    def changed_transitions(self):
+        env = self.env.env
+        weeks = [week for week in env.reward_table.pop_changed() if week >= 1]
+        if not weeks:
+            return None
         
-        # update model for each iteration
-        for i in range(1, iteration + 1):
-            # for each action
-            for a in action_set:
-                # if the reward is defined
-                if not rewards.empty and not np.isnan(rewards.loc[i, a]):
-                    prev_observation = states.loc[i-1, :].values
-                    action = a
-                    observation = predicted_states.loc[i, action] #self.env_model.predict(action) #states.loc[i, :].as_matrix()
-                    reward = rewards.loc[i, a]
-                    
-                    self.update_model(prev_observation, action, observation, reward)
+        reward_values = np.array([env.reward_table.row(week) for week in weeks])
+        predictions = env.state_prediction_table
+        predicted_states = np.array([predictions.row(week) if week in predictions.positions else np.full(len(predictions.actions), np.nan) for week in weeks])
+        prev_observations = env.stateFeatures.reindex([week - 1 for week in weeks]).values
+        defined = ~np.isnan(reward_values) & ~np.isnan(predicted_states) & ~np.isnan(prev_observations).any(axis = 1)[:, None]
+        rows, actions = np.nonzero(np.ones(reward_values.shape, dtype = bool))
+        return (np.array(weeks)[rows], actions, prev_observations[rows], predicted_states[rows, actions].reshape(-1, 1), reward_values[rows, actions],
+                defined[rows, actions])
+    
+    # store changed tuples in the replay buffer, replay_ids maps the key of each tuple to its id in the buffer: a changed reward is
+    # updated in place and a tuple that is no longer defined is removed
+    def store_transitions(self, keys, prev_observations, actions, observations, rewards, defined, replay_ids):
+        # tuples stored before, those no longer defined are removed and the others get the current reward
+        ids = np.array([replay_ids.get(key, -1) for key in keys], dtype = np.int64)
+        stored = self.replay.contains(ids)
+        self.replay.remove(ids[stored & ~defined])
+        self.replay.update_rewards(ids[stored & defined], rewards[stored & defined])
+        
+        # new tuples
+        new = np.flatnonzero(~stored & defined)
+        new_ids = self.replay.push(prev_observations[new], actions[new], observations[new], rewards[new], time = self.steps)
+        for row, transition_id in zip(new, new_ids):
+            replay_ids[keys[row]] = transition_id
+    
+    # store the tuples of the rewards defined or changed since the last call
+    def collect_transitions(self):
+        transitions = self.changed_transitions()
+        if transitions is None:
+            return
+        weeks, actions, prev_observations, observations, rewards, defined = transitions
+        keys = list(zip(weeks.tolist(), actions.tolist()))
+        self.store_transitions(keys, prev_observations, actions, observations, rewards, defined, self.replay_ids)
+    
+    # store new (previous state-action-state-reward) tuples and update the value function parameters on minibatches of the stored ones
+    def learn_value(self):
+        self.collect_transitions()
+        self.learn_replay()
+    
+    # update the value function parameters on replay_ratio minibatches of the stored tuples
+    def learn_replay(self):
+        if len(self.replay) == 0:
+            return
+        for minibatch in range(self.replay_ratio):
+            ids = self.replay.sample_ids(self.batch_size)
+            errors = self.update_model_batch(*self.replay.get(ids))
+            self.replay.set_priorities(ids, np.abs(errors))
     
     # perform value function update based on (previous state-action-state-reward) tuples
     def update_model(self, prev_observation, action, observation, reward):
@@ -69,17 +128,58 @@ class Agent():
                 G = reward + self.gamma1 * np.max(predicted_q)
                 self.model.update(prev_observation, action, G)
     
-    # update the environment model based on (action, state) tuple            
-    def learn_environment(self, a, s):
-        self.env_model.update(a, s)
+    # perform value function updates for a batch of (previous state-action-state-reward) tuples at once, the TD errors before the
+    # updates are returned
+    def update_model_batch(self, prev_observations, actions, observations, rewards):
+        rows = np.arange(len(actions))
+        if self.target_model is None:
+            # Q-learning update
+            G = rewards + self.gamma1 * np.max(self.model.predict_batch(observations), axis = 1)
+            errors = G - self.model.predict_batch(prev_observations)[rows, actions]
+            self.model.update_batch(prev_observations, actions, G)
+        else:
+            # double-Q-learning update, each tuple updates one of the models chosen at random
+            update_target = np.random.binomial(1, 0.5, size = len(actions)) == 1
+            G_target = rewards + self.gamma1 * np.max(self.model.predict_batch(observations), axis = 1)
+            G_model = rewards + self.gamma1 * np.max(self.target_model.predict_batch(observations), axis = 1)
+            errors = np.where(update_target, G_target - self.target_model.predict_batch(prev_observations)[rows, actions],
+                              G_model - self.model.predict_batch(prev_observations)[rows, actions])
+            self.target_model.update_batch(prev_observations[update_target], actions[update_target], G_target[update_target])
+            self.model.update_batch(prev_observations[~update_target], actions[~update_target], G_model[~update_target])
+        return errors
+    
+    # fit the environment model to the stored (previous state-action-state-reward) tuples, recent ones weigh more
+    def learn_environment(self):
+        prev_observations, actions, observations, rewards, times = self.replay.contents()
+        if len(actions) == 0:
+            return False
+        self.env_model.fit(prev_observations, actions, observations, rewards, ages = self.steps - times)
+        return True
+    
+    # update the value function on transitions simulated by the environment model from stored states and random actions
+    def plan(self, updates = None):
+        updates = self.planning_updates if updates is None else updates
+        actions = np.flatnonzero(self.env_model.fitted)
+        if updates <= 0 or len(actions) == 0 or len(self.replay) == 0:
+            return
+        prev_observations = self.replay.get(self.replay.sample_uniform(updates))[0]
+        actions = actions[np.random.randint(len(actions), size = updates)]
+        observations, rewards = self.env_model.predict_batch(prev_observations, actions)
+        self.update_model_batch(prev_observations, actions, observations, rewards)
     
     # run one episode
-    def play_one(self, sample_action, train = True, visualize_learning = 0, save = False, path = 'E:/bookkeeping/baseline_final/episode_0/'):
+    # with save set, the weights are checkpointed to path every week and snapshotted with the settings of the agent at the start and
+    # the end of the episode by a background writer keeping the last checkpoint_retention weekly checkpoints
+    def play_one(self, sample_action, train = True, visualize_learning = 0, save = False, path = 'E:/bookkeeping/baseline_final/episode_0/', checkpoint_retention = 5):
         observation, _ = self.env.reset()
+        self.replay_ids = {}
+        checkpoints = checkpoint_service(path, checkpoint_retention) if save else None
+        if save:
+            checkpoints.snapshot(self, 'start')
         done = False
         totalreward = 0
         iters = 0
-        progress = pd.DataFrame(data = [])
+        progress = ProgressRecorder(self.env.episode.agent_weeks)
         
         # timing
         self.start_time = dt.datetime.now()
@@ -89,12 +189,14 @@ class Agent():
         while not done:
             action = sample_action(self.model, observation, self.eps, self.target_model)
             observation, reward, done, truncated, info = self.env.step(action)
+            self.steps += 1
             
             # update the value function model
             if train:
                 self.learn_value()
-            # update the environment model
-            #self.learn_environment(action, observation)
+            # update the environment model and the value function on the transitions it simulates
+            if train and self.planning_updates > 0 and self.learn_environment():
+                self.plan()
             
             # timing
             current_time = dt.datetime.now()
@@ -105,9 +207,10 @@ class Agent():
             # extract iteration info
             max_action = self.env.env.convert_to_real_action(np.argmax(self.env.env.true_rewards.loc[self.env.env.iteration, :]))
             max_reward = self.env.env.true_rewards.loc[self.env.env.iteration, :].max()
-            optimized_action = np.argmax(self.get_q_table().max(axis = 1))
-            optimized_state = np.argmax(self.get_q_table().max(axis = 0))
-            optimized_value = self.get_q_table().max().max()
+            q_values = self.get_q_values()
+            optimized_action = np.argmax(q_values.max(axis = 1))
+            optimized_state = np.argmax(q_values.max(axis = 0))
+            optimized_value = q_values.max()
             
             actual_action = self.env.env.convert_to_real_action(action)
             val = self.env.env.true_rewards.loc[self.env.env.iteration, action]
@@ -118,21 +221,21 @@ class Agent():
             true_optimal_reward = round(val_opt) if not np.isnan(val_opt) else np.nan
             
             # store iteration info
-            progress.loc[iters, 'Week'] = int(iters)
-            progress.loc[iters, 'Optimized action'] = optimized_action
-            progress.loc[iters, 'Optimized state'] = optimized_state
-            progress.loc[iters, 'Optimized value'] = optimized_value
-            progress.loc[iters, 'Actual action'] = actual_action
-            progress.loc[iters, 'Actual reward'] = actual_reward
-            progress.loc[iters, 'True optimal action'] = true_optimal_action
-            progress.loc[iters, 'True optimal reward'] = true_optimal_reward
-            progress.loc[iters, 'Optimized action difference'] = optimized_action - true_optimal_action
-            progress.loc[iters, 'Action difference'] = actual_action - true_optimal_action
-            progress.loc[iters, 'Reward difference'] = actual_reward - true_optimal_reward
-            progress.loc[iters, 'Max action'] = max_action
-            progress.loc[iters, 'Max reward'] = max_reward
-            progress.loc[iters, 'Step time'] = step_time_delta
-            progress.loc[iters, 'Episode time'] = episode_time_delta
+            progress.record(**{'Week': iters,
+                               'Optimized action': optimized_action,
+                               'Optimized state': optimized_state,
+                               'Optimized value': optimized_value,
+                               'Actual action': actual_action,
+                               'Actual reward': actual_reward,
+                               'True optimal action': true_optimal_action,
+                               'True optimal reward': true_optimal_reward,
+                               'Optimized action difference': optimized_action - true_optimal_action,
+                               'Action difference': actual_action - true_optimal_action,
+                               'Reward difference': actual_reward - true_optimal_reward,
+                               'Max action': max_action,
+                               'Max reward': max_reward,
+                               'Step time': step_time_delta,
+                               'Episode time': episode_time_delta})
             
             # visualize iteration
             if visualize_learning > 0:
@@ -144,43 +247,42 @@ class Agent():
                 if visualize_learning > 1:
 
                     if not np.isnan(actual_reward):
-                        print(progress.loc[iters, ['Week', 'Optimized action difference', 'Action difference', 'Reward difference']].to_string())
+                        print(progress.row(iters, ['Week', 'Optimized action difference', 'Action difference', 'Reward difference']).to_string())
                     else:
-                        print(progress.loc[iters, ['Week', 'Optimized action difference', 'Action difference']].to_string())
+                        print(progress.row(iters, ['Week', 'Optimized action difference', 'Action difference']).to_string())
                         print('learning delayed rewards...')
                 print('---------------------------------------------------------------------')
             
             # bookkeeping
             if save:
-                if not os.path.exists(path):
-                    os.makedirs(path)
-                joblib.dump(self, path + 'agent_' + str(iters) + '.pkl')
+                checkpoints.save(self, iters)
             
             totalreward += reward
             iters += 1
         
-        return progress
+        if save:
+            checkpoints.snapshot(self, 'end')
+        return progress.to_frame()
+    
+    # get Q-values of the state grid, a row for each action and a column for each state, predicted once for each model version
+    def get_q_values(self, model = None):
+        model = self.model if model is None else model
+        cached = self.q_cache.get(id(model))
+        if cached is not None and cached[0] is model and cached[1] == model.version:
+            return cached[2]
+        observations = np.arange(0, 21).reshape(-1, 1) * 0.05
+        q_values = model.predict_batch(observations).T
+        q_values.flags.writeable = False
+        self.q_cache[id(model)] = (model, model.version, q_values)
+        return q_values
     
     # get value function in the form of a table of Q-values
     def get_q_table(self, model = None):
-        model = self.model if model is None else model
-        q_values_df = pd.DataFrame(data = [], index = range(5, 105, 5))
-        for obs in range(0, 21):
-            observation = [obs * 0.05]
-            q_values = model.predict(np.array(observation))
-            q_values_df.loc[:, observation[0]] = pd.Series(data = q_values, index = range(5, 105, 5))
-            
-        return q_values_df
+        return pd.DataFrame(data = self.get_q_values(model).copy(), index = range(5, 105, 5), columns = [obs * 0.05 for obs in range(0, 21)])
     
     # visualize value function
     def plot_q_values(self, model = None):
-        model = self.model if model is None else model
-        q_values_df = pd.DataFrame(data = [], index = range(5, 105, 5))
-        for obs in range(0, 21):
-            observation = [obs * 0.05]
-            q_values = model.predict(np.array(observation))
-            q_values_df.loc[:, observation[0]] = pd.Series(data = q_values, index = range(5, 105, 5))
-        #q_values_df
+        q_values_df = self.get_q_table(model)
         
         x = q_values_df.columns
         y = q_values_df.index
@@ -189,6 +291,9 @@ class Agent():
         
         zs = q_values_df.values
         
+        # plotting packages are imported when a plot is requested, so that headless runs do not load them
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d.axes3d import Axes3D
         fig = plt.figure(figsize = (8, 5))
         ax = Axes3D(fig)
         ax.plot_surface(xs, ys, zs, rstride=1, cstride=1, cmap='hot')
@@ -230,6 +335,7 @@ class Agent():
         running_avg = np.empty(N)
         for t in range(N):
             running_avg[t] = totalrewards[max(0, t-100):(t+1)].mean()
+        import matplotlib.pyplot as plt
         plt.plot(running_avg)
         plt.title("Running Average")
         plt.show()  
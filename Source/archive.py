@@ -0,0 +1,129 @@
+'''
+LoanArchiveWriter class streams the weekly loan applications generated by the
+environment into an on-disk archive, one structured .npy file per episode and
+week, so that the full loan-level history of many episodes does not have to be
+kept in memory. LoanArchive class memory-maps the archive for zero-copy
+analytical queries over episodes and weeks.
+'''
+
+# import external packages
+import os
+import re
+import json
+import numpy as np
+import pandas as pd
+
+# archive format version and record layout of a loan application
+ARCHIVE_VERSION = 2
+LOAN_DTYPE = np.dtype([('id', 'S32'), ('iteration', 'f8'), ('maturation_at', 'f8'), ('repeat', '?'), ('sum', 'f8'), ('duration', 'f8'),
+                       ('debt', 'f8'), ('score', 'f8'), ('dca', '?'), ('dca_at', 'f8'), ('late_payment', 'f8'), ('late_payment_at', 'f8'),
+                       ('profit', 'f8'), ('accept', '?'), ('segment', 'i2')])
+
+# convert a weekly dataframe of loan applications to an array of loan records
+def to_records(batch):
+    records = np.zeros(batch.shape[0], dtype = LOAN_DTYPE)
+    if batch.empty:
+        return records
+    records['id'] = batch.index.astype(str).values
+    for name in LOAN_DTYPE.names[1:]:
+        if name not in batch.columns:
+            continue
+        if LOAN_DTYPE[name] == np.dtype('?'):
+            records[name] = (batch[name] == True).values
+        else:
+            records[name] = pd.to_numeric(batch[name], errors = 'coerce').values     # 'NA' event weeks become nan
+    return records
+
+class LoanArchiveWriter:
+    # create or open an archive directory, new episodes are numbered after the existing ones
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        with open(os.path.join(self.path, 'schema.json'), 'w') as schema_file:
+            json.dump({'version': ARCHIVE_VERSION, 'dtype': LOAN_DTYPE.descr}, schema_file)
+        existing = LoanArchive(self.path).episodes()
+        self.episode = existing[-1] if existing else -1
+
+    # start a new episode partition
+    def begin_episode(self):
+        self.episode += 1
+        os.makedirs(self.episode_path(self.episode), exist_ok = True)
+        return self.episode
+
+    # directory of an episode partition
+    def episode_path(self, episode):
+        return os.path.join(self.path, 'episode_{:05d}'.format(episode))
+
+    # write the loan applications of a week to the current episode partition
+    def write_week(self, week, batch):
+        if self.episode < 0:
+            self.begin_episode()
+        file_name = os.path.join(self.episode_path(self.episode), 'week_{:05d}.npy'.format(int(week)))
+        # write to a temporary file first so that readers never see a partially written week
+        with open(file_name + '.tmp', 'wb') as week_file:
+            np.save(week_file, to_records(batch))
+        os.replace(file_name + '.tmp', file_name)
+
+class LoanArchive:
+    # open an archive directory for reading
+    def __init__(self, path):
+        self.path = path
+
+    # list episode numbers in the archive
+    def episodes(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(int(match.group(1)) for match in (re.match(r'episode_(\d+)$', name) for name in os.listdir(self.path)) if match)
+
+    # list week numbers of an episode
+    def weeks(self, episode):
+        episode_path = os.path.join(self.path, 'episode_{:05d}'.format(episode))
+        if not os.path.isdir(episode_path):
+            return []
+        return sorted(int(match.group(1)) for match in (re.match(r'week_(\d+)\.npy$', name) for name in os.listdir(episode_path)) if match)
+
+    # memory-map the loan records of a week
+    def read(self, episode, week):
+        file_name = os.path.join(self.path, 'episode_{:05d}'.format(episode), 'week_{:05d}.npy'.format(week))
+        return np.load(file_name, mmap_mode = 'r')
+
+    # iterate over memory-mapped week partitions, yielding (episode, week, records)
+    def scan(self, episodes = None, weeks = None):
+        episodes = self.episodes() if episodes is None else episodes
+        for episode in episodes:
+            for week in self.weeks(episode):
+                if weeks is not None and week not in weeks:
+                    continue
+                records = self.read(episode, week)
+                if records.shape[0] > 0:
+                    yield episode, week, records
+
+    # sum a value over the partitions: func(records) returns an array or a scalar for each week
+    def aggregate(self, func, episodes = None, weeks = None):
+        total = 0
+        for episode, week, records in self.scan(episodes, weeks):
+            total = total + func(records)
+        return total
+
+    # realized profit of each episode if the given thresholds had been applied
+    def threshold_profits(self, thresholds, episodes = None, weeks = None):
+        thresholds = np.asarray(thresholds, dtype = float)
+        episodes = self.episodes() if episodes is None else episodes
+
+        def profit(records):
+            lost = records['dca'] & (records['late_payment'] == 0)
+            value = np.where(lost, -records['sum'], records['profit'])
+            return value @ (records['score'][:, None] >= thresholds[None, :])
+
+        data = [self.aggregate(profit, [episode], weeks) * np.ones(len(thresholds)) for episode in episodes]
+        return pd.DataFrame(data = data, index = episodes, columns = thresholds)
+
+    # load the loan records of an episode as a dataframe, copying them into memory
+    def to_frame(self, episode, weeks = None):
+        partitions = [records for _, _, records in self.scan([episode], weeks)]
+        if not partitions:
+            return pd.DataFrame(data = [])
+        frame = pd.DataFrame(data = np.concatenate(partitions))
+        frame['id'] = frame['id'].str.decode('utf-8')
+        return frame.set_index('id')
@@ -0,0 +1,432 @@
+'''
+Benchmark functions measure the performance of the simulation and the RL agent
+components, so that changes to them can be checked against latency and
+scalability expectations. Run the script to print the results of all benchmarks.
+'''
+
+# import external packages
+import os
+import sys
+import time
+import subprocess
+import datetime as dt
+import numpy as np
+import pandas as pd
+import joblib
+
+# import internal classes
+from environment import Environment
+from episode import EpisodeConfig
+from grid import ThresholdGrid
+from simulation import SimulationEnv
+from model import FeatureTransformer, Model
+from policy import Policy
+from manager import Manager
+from weights import save_weights, load_weights
+from recorder import PROGRESS_COLUMNS, ProgressRecorder, ProgressStore
+from checkpoint import CheckpointService
+from actorlearner import ActorLearnerRunner
+from population import PopulationRunner
+from scenarios import ScenarioGridRunner, latin_hypercube_design
+
+# measure the median latency of environment steps around the given weeks of a long episode
+def benchmark_step_latency(weeks = (100, 1000), samples = 10, seed = 0):
+    episode = EpisodeConfig.with_reward_weeks(max(weeks))
+    env = Environment(episode = episode)
+    np.random.seed(seed)
+    env.reset()
+
+    latencies = {}
+    for week in sorted(weeks):
+        # run the default policy up to the measured weeks
+        while env.iteration < week - samples:
+            env.take_action()
+        step_times = []
+        for sample in range(samples):
+            start = time.perf_counter()
+            env.take_action()
+            step_times.append(time.perf_counter() - start)
+        latencies[week] = float(np.median(step_times))
+
+    return latencies
+
+# check that the step latency late in a long episode stays within a factor of the latency early in the episode
+def check_step_latency(early_week = 100, late_week = 1000, max_factor = 3, samples = 10):
+    latencies = benchmark_step_latency(weeks = (early_week, late_week), samples = samples)
+    factor = latencies[late_week] / latencies[early_week]
+    print('step latency: week {} {:.1f} ms, week {} {:.1f} ms, factor {:.2f} (max {})'.format(early_week, latencies[early_week] * 1000, late_week, latencies[late_week] * 1000, factor, max_factor))
+    return factor <= max_factor
+
+# measure the loans kept row by row and their memory with each ledger retention policy
+def benchmark_ledger_memory(weeks = 300, seed = 0):
+    episode = EpisodeConfig.with_reward_weeks(weeks)
+    memory = {}
+    for retention in ['full', 'compact']:
+        env = Environment(episode = episode, retention = retention)
+        np.random.seed(seed)
+        env.run_iterations(weeks, output = False)
+        rows = env.result.shape[0] + env.sim.all_accepted.shape[0]
+        size = env.result.memory_usage(deep = True).sum() + env.sim.all_accepted.memory_usage(deep = True).sum()
+        memory[retention] = {'rows': rows, 'megabytes': size / 2**20, 'settled': env.ledger.settled}
+        print('ledger retention {}: {} rows, {:.1f} MB kept after {} weeks'.format(retention, rows, size / 2**20, weeks))
+    return memory
+
+# measure the median step latency with the default 20-threshold grid and with a 1-point 100 x 100 grid of separate thresholds
+def benchmark_grid_step(weeks = 60, samples = 20, seed = 0):
+    grids = {20: ('discrete_action', None), 10000: ('discrete_action_separate', ThresholdGrid(low = 1, high = 100, step = 1, separate = True))}
+    latencies = {}
+    for actions, (action_type, action_grid) in grids.items():
+        env = Environment(action_type = action_type, action_grid = action_grid)
+        np.random.seed(seed)
+        env.reset()
+        for week in range(weeks):
+            env.take_action()
+        step_times = []
+        for sample in range(samples):
+            start = time.perf_counter()
+            env.take_action()
+            step_times.append(time.perf_counter() - start)
+        latencies[actions] = float(np.median(step_times))
+        print('threshold grid of {} actions: {:.1f} ms per step'.format(actions, latencies[actions] * 1000))
+    return latencies
+
+# measure the mean latency of value model predictions and updates of a single state
+def benchmark_model_latency(calls = 1000, seed = 0):
+    env = SimulationEnv()
+    np.random.seed(seed)
+    model = Model(env, FeatureTransformer(env), 0.01)
+    observation = np.array([0.3])
+    latencies = {}
+    start = time.perf_counter()
+    for call in range(calls):
+        model.predict(observation)
+    latencies['predict'] = (time.perf_counter() - start) / calls
+    start = time.perf_counter()
+    for call in range(calls):
+        model.update(observation, call % env.action_space.n, 100.0)
+    latencies['update'] = (time.perf_counter() - start) / calls
+    print('value model: predict {:.1f} us, update {:.1f} us'.format(latencies['predict'] * 1e6, latencies['update'] * 1e6))
+    return latencies
+
+# measure the mean latency of featurizing a state: computed, from the LRU cache and from the lookup table
+def benchmark_featurization(calls = 1000, seed = 0):
+    env = SimulationEnv()
+    np.random.seed(seed)
+    ft = FeatureTransformer(env)
+    observations = np.random.choice(np.random.rand(20), calls)
+    latencies = {}
+    start = time.perf_counter()
+    for observation in observations:
+        ft.compute(observation.reshape(1, -1))
+    latencies['computed'] = (time.perf_counter() - start) / calls
+    start = time.perf_counter()
+    for observation in observations:
+        ft.transform([observation])
+    latencies['cached'] = (time.perf_counter() - start) / calls
+    ft.precompute(0.05)
+    grid = np.round(np.random.choice(np.arange(21) * 0.05, calls), 2)
+    start = time.perf_counter()
+    for observation in grid:
+        ft.transform([observation])
+    latencies['table'] = (time.perf_counter() - start) / calls
+    print('featurization: computed {:.1f} us, cached {:.1f} us, table {:.1f} us'.format(latencies['computed'] * 1e6, latencies['cached'] * 1e6, latencies['table'] * 1e6), ft.cache_info())
+    return latencies
+
+# compare the learning curves and step latency of the value function backends over a number of training episodes
+def benchmark_value_backends(episodes = 3, featurizers = ('rbf', 'tile'), calls = 1000, seed = 0):
+    results = {}
+    for featurizer in featurizers:
+        np.random.seed(seed)
+        agent = Manager(None, featurizer = featurizer).agent
+        # learning curve as the mean shortfall of the reward of the taken action to the reward of the best action
+        curve = []
+        step_times = []
+        for episode in range(episodes):
+            progress = agent.play_one(sample_action = agent.policy.boltzmann_q_sample_action)
+            curve.append(float((progress['Max reward'] - progress['Actual reward']).mean()))
+            step_times.append(float(progress['Step time'].dt.total_seconds().median()))
+        # latency of the value model alone, on states the featurizer has not seen
+        observations = np.random.rand(calls, 1)
+        start = time.perf_counter()
+        for observation in observations:
+            agent.model.predict(observation)
+            agent.model.update(observation, 0, 0.0)
+        model_time = (time.perf_counter() - start) / calls
+        results[featurizer] = {'curve': curve, 'step': float(np.median(step_times)), 'model': model_time}
+        print('{} backend: step {:.1f} ms, predict and update {:.1f} us, mean reward shortfall by episode {}'.format(featurizer, results[featurizer]['step'] * 1000, model_time * 1e6, ', '.join('{:.0f}'.format(shortfall) for shortfall in curve)))
+    return results
+
+# measure the time to import the main entry points in a fresh interpreter, and whether they load matplotlib
+def benchmark_import_time(modules = ('simulation', 'model', 'policy', 'agent', 'manager'), repeats = 3):
+    script = 'import sys, time; start = time.perf_counter(); import {}; print(time.perf_counter() - start, "matplotlib" in sys.modules)'
+    directory = os.path.dirname(os.path.abspath(__file__))
+    latencies = {}
+    for module in modules:
+        times = []
+        for repeat in range(repeats):
+            output = subprocess.run([sys.executable, '-W', 'ignore', '-c', script.format(module)], cwd = directory, capture_output = True, text = True, check = True).stdout.split()
+            times.append(float(output[0]))
+        latencies[module] = float(np.median(times))
+        print('import {}: {:.0f} ms{}'.format(module, latencies[module] * 1000, ', loads matplotlib' if output[1] == 'True' else ''))
+    return latencies
+
+# compare the time to load a value model pickled with joblib and saved in the weights format, read into memory and memory-mapped
+def benchmark_model_loading(directory = 'benchmark_models', repeats = 10, seed = 0):
+    env = SimulationEnv()
+    np.random.seed(seed)
+    model = Model(env, FeatureTransformer(env), 0.01)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    joblib.dump(model, os.path.join(directory, 'model.pkl'))
+    save_weights(model, os.path.join(directory, 'model.weights'))
+    loaders = {'joblib': lambda: joblib.load(os.path.join(directory, 'model.pkl')),
+               'weights': lambda: load_weights(os.path.join(directory, 'model.weights')),
+               'weights mapped': lambda: load_weights(os.path.join(directory, 'model.weights'), mmap_mode = 'r')}
+    latencies = {}
+    for name, loader in loaders.items():
+        start = time.perf_counter()
+        for repeat in range(repeats):
+            loader()
+        latencies[name] = (time.perf_counter() - start) / repeats
+    print('model loading: ' + ', '.join('{} {:.2f} ms'.format(name, latency * 1000) for name, latency in latencies.items()))
+    return latencies
+
+# compare the real environment steps needed to converge with and without planning on the environment model: the number of real steps
+# each setting takes to bring the mean weekly reward shortfall of an episode (best reward of the week less the reward of the taken
+# action) down to the level the first setting ends the run with
+def benchmark_planning(episodes = 5, planning_updates = (0, 200), seed = 0):
+    curves = {}
+    steps = {}
+    times = {}
+    for updates in planning_updates:
+        np.random.seed(seed)
+        agent = Manager(None).agent
+        agent.planning_updates = updates
+        curves[updates] = []
+        steps[updates] = []
+        start = time.perf_counter()
+        for episode in range(episodes):
+            progress = agent.play_one(sample_action = agent.policy.boltzmann_q_sample_action)
+            curves[updates].append(float((progress['Max reward'] - progress['Actual reward']).mean()))
+            steps[updates].append(len(progress))
+        times[updates] = time.perf_counter() - start
+
+    target = curves[planning_updates[0]][-1]
+    results = {}
+    for updates in planning_updates:
+        converged = [episode for episode in range(episodes) if curves[updates][episode] <= target]
+        real_steps = int(np.sum(steps[updates][:converged[0] + 1])) if converged else None
+        results[updates] = {'steps': real_steps, 'curve': curves[updates], 'time': times[updates]}
+        print('planning updates {}: shortfall {:.0f} reached after {} real steps, {:.1f} s, mean shortfall by episode {}'.format(
+            updates, target, real_steps if real_steps is not None else 'more than ' + str(int(np.sum(steps[updates]))), times[updates],
+            ', '.join('{:.0f}'.format(shortfall) for shortfall in curves[updates])))
+    return results
+
+# compare the time to record the weekly progress of an episode cell by cell into a growing DataFrame and into a preallocated recorder,
+# and to collect the episodes by concatenating after every episode and in a chunked store, against the time of a training step
+def benchmark_progress_recording(weeks = 82, episodes = 100, seed = 0):
+    np.random.seed(seed)
+    names = [name for name, dtype in PROGRESS_COLUMNS]
+    values = [{name: (dt.timedelta(milliseconds = week) if name.endswith('time') else week if name == 'Week' else float(np.random.rand()))
+               for name in names} for week in range(weeks)]
+    latencies = {}
+    start = time.perf_counter()
+    frame = pd.DataFrame(data = [])
+    for week in range(weeks):
+        for name in names:
+            frame.loc[week, name] = values[week][name]
+    latencies['frame'] = (time.perf_counter() - start) / weeks
+    start = time.perf_counter()
+    recorder = ProgressRecorder(weeks)
+    for week in range(weeks):
+        recorder.record(**values[week])
+    recorded = recorder.to_frame()
+    latencies['recorder'] = (time.perf_counter() - start) / weeks
+
+    start = time.perf_counter()
+    combined = pd.DataFrame(data = [])
+    for episode in range(episodes):
+        combined = pd.concat([combined, recorded.assign(episode = episode)], axis = 0)
+    latencies['concat'] = (time.perf_counter() - start) / episodes
+    start = time.perf_counter()
+    store = ProgressStore()
+    for episode in range(episodes):
+        store.append(recorded.assign(episode = episode))
+    store.to_frame()
+    latencies['store'] = (time.perf_counter() - start) / episodes
+
+    agent = Manager(None).agent
+    start = time.perf_counter()
+    progress = agent.play_one(sample_action = agent.policy.boltzmann_q_sample_action)
+    latencies['step'] = (time.perf_counter() - start) / len(progress)
+    print('progress recording: DataFrame {:.0f} us, recorder {:.0f} us per week ({:.2%} of a {:.0f} ms step), collecting {} episodes: concat {:.1f} ms, store {:.1f} ms per episode'.format(
+        latencies['frame'] * 1e6, latencies['recorder'] * 1e6, latencies['recorder'] / latencies['step'], latencies['step'] * 1e3, episodes, latencies['concat'] * 1e3, latencies['store'] * 1e3))
+    return latencies
+
+# compare the time the training loop spends saving the agent every week by pickling it and by the checkpoint service, with the size
+# of the files left on disk
+def benchmark_checkpointing(directory = 'benchmark_checkpoints', weeks = 10, seed = 0):
+    np.random.seed(seed)
+    agent = Manager(None).agent
+    agent.play_one(sample_action = agent.policy.boltzmann_q_sample_action)
+    latencies = {}
+    sizes = {}
+    pickled = os.path.join(directory, 'pickled')
+    if not os.path.exists(pickled):
+        os.makedirs(pickled)
+    start = time.perf_counter()
+    for week in range(weeks):
+        joblib.dump(agent, os.path.join(pickled, 'agent_' + str(week) + '.pkl'))
+    latencies['pickled'] = (time.perf_counter() - start) / weeks
+    service = CheckpointService(os.path.join(directory, 'service'))
+    service.snapshot(agent, 'start')
+    start = time.perf_counter()
+    for week in range(weeks):
+        service.save(agent, week)
+    latencies['service'] = (time.perf_counter() - start) / weeks
+    service.close()
+    for name in ['pickled', 'service']:
+        sizes[name] = sum(os.path.getsize(os.path.join(directory, name, file_name)) for file_name in os.listdir(os.path.join(directory, name)))
+    print('checkpointing: pickled agent {:.1f} ms per week ({:.1f} MB on disk), service {:.2f} ms per week ({:.1f} MB on disk)'.format(
+        latencies['pickled'] * 1e3, sizes['pickled'] / 2**20, latencies['service'] * 1e3, sizes['service'] / 2**20), service.stats())
+    return latencies, sizes
+
+# compare the training throughput in environment steps per second of sequential episodes and of the actor/learner mode, the actors
+# only run in parallel to the learner and to each other on as many cores
+def benchmark_actor_learner(actors = 2, episodes = 1, seed = 0):
+    np.random.seed(seed)
+    agent = Manager(None).agent
+    throughput = {}
+    start = time.perf_counter()
+    steps = 0
+    for episode in range(actors * episodes):
+        steps += len(agent.play_one(sample_action = agent.policy.boltzmann_q_sample_action))
+    throughput['sequential'] = steps / (time.perf_counter() - start)
+    np.random.seed(seed)
+    runner = ActorLearnerRunner(Manager(None).agent, actors = actors, episodes = episodes, seed = seed).run(report = lambda runner: None)
+    throughput['actor/learner'] = runner.throughput()
+    print('training throughput on {} cores: sequential {:.1f} steps/s, {} actors and a learner {:.1f} steps/s, learner busy {:.0%}, actors blocked {:.1f} s, stale updates skipped {}'.format(
+        os.cpu_count(), throughput['sequential'], actors, throughput['actor/learner'], runner.stats['learner time'] / runner.stats['elapsed'],
+        sum(stats['blocked'] for stats in runner.stats['actors'].values()), runner.stats['skipped']))
+    return throughput
+
+# measure the wall time of a population-based search against the time its members train for, which is the time of one run with a
+# single set of hyperparameters when there is a core for every member, with the best fitness of every generation
+def benchmark_population(directory = 'benchmark_population', population = 2, generations = 2, episodes = 1, seed = 0):
+    np.random.seed(seed)
+    agent = Manager(None).agent
+    start = time.perf_counter()
+    runner = PopulationRunner(agent, population = population, generations = generations, episodes = episodes, directory = directory, seed = seed).run(report = lambda runner: None)
+    elapsed = time.perf_counter() - start
+    best = runner.history.groupby('generation')['fitness'].max()
+    print('population of {} over {} generations on {} cores: {:.1f} s, {:.1f} s per member, best fitness by generation {} (lr {:.2e}, gamma {:.3f}, eps {:.3f})'.format(
+        population, generations, os.cpu_count(), elapsed, elapsed / population * min(population, os.cpu_count()), ', '.join('{:.0f}'.format(fitness) for fitness in best),
+        runner.best['lr'], runner.best['gamma'], runner.best['eps']))
+    return runner
+
+# measure the time per scenario episode of a Latin hypercube stress test run in a single process and over all the cores, and the
+# time to resume the finished study
+def benchmark_scenario_grid(directory = 'benchmark_scenarios', scenarios = 4, seed = 0):
+    np.random.seed(seed)
+    agent = Manager(None).agent
+    agent.play_one(sample_action = agent.policy.boltzmann_q_sample_action)
+    save_weights(agent.model, os.path.join(directory, 'agent.crm'))
+    design = latin_hypercube_design({'news_default_rate_bias': (-0.5, 0.5), 'repeats_default_rate_bias': (-0.5, 0.5), 'ar_effect': (0, 1)}, scenarios, seed = seed)
+    latencies = {}
+    for processes in [1, None]:
+        study = os.path.join(directory, 'serial' if processes == 1 else 'parallel')
+        for file_name in ['design.json', 'results.npy', 'finished.npy']:
+            if os.path.exists(os.path.join(study, file_name)):
+                os.remove(os.path.join(study, file_name))
+        start = time.perf_counter()
+        ScenarioGridRunner(os.path.join(directory, 'agent.crm'), design, directory = study, seed = seed, processes = processes).run(report = lambda runner: None)
+        latencies['serial' if processes == 1 else 'parallel'] = (time.perf_counter() - start) / scenarios
+    start = time.perf_counter()
+    ScenarioGridRunner(os.path.join(directory, 'agent.crm'), design, directory = os.path.join(directory, 'serial'), seed = seed, processes = 1).run(report = lambda runner: None)
+    latencies['resume'] = time.perf_counter() - start
+    print('scenario grid of {} scenarios on {} cores: {:.1f} s per episode in one process, {:.1f} s over all cores, resuming the finished study {:.2f} s'.format(
+        scenarios, os.cpu_count(), latencies['serial'], latencies['parallel'], latencies['resume']))
+    return latencies
+
+# measure the mean latency of a decision of the samplers for single states, with and without a target model, and per state when the
+# policy engine samples a batch of states from their Q-value matrix
+def benchmark_policy(calls = 1000, seed = 0):
+    env = SimulationEnv()
+    np.random.seed(seed)
+    ft = FeatureTransformer(env)
+    model = Model(env, ft, 0.0001)
+    target_model = Model(env, ft, 0.0001)
+    model.weights[:] = np.random.randn(*model.weights.shape)
+    target_model.weights[:] = np.random.randn(*target_model.weights.shape)
+    policy = Policy(env)
+    env.reset()
+    observations = np.random.choice(np.random.rand(20), calls).reshape(-1, 1)
+    latencies = {}
+    for name in ['greedy', 'boltzmann_q', 'lower_boltzmann_q']:
+        for target in [None, target_model]:
+            sample_action = getattr(policy, name + '_sample_action')
+            start = time.perf_counter()
+            for observation in observations:
+                sample_action(model, observation, 1, target)
+            latencies[name + (' with target' if target is not None else '')] = (time.perf_counter() - start) / calls
+    start = time.perf_counter()
+    q_values = policy.q_matrix(model, observations, target_model)
+    latencies['batch q-values'] = (time.perf_counter() - start) / calls
+    for name in ['greedy', 'boltzmann', 'lower_boltzmann']:
+        start = time.perf_counter()
+        if name == 'greedy':
+            policy.greedy_actions(q_values)
+        else:
+            getattr(policy, name + '_actions')(q_values, 1)
+        latencies['batch ' + name] = (time.perf_counter() - start) / calls
+    print('policy decisions: ' + ', '.join('{} {:.1f} us'.format(name, latency * 1e6) for name, latency in latencies.items()))
+    return latencies
+
+# compare the wall-clock time prioritized and uniform replay take to converge: the training time after which each brings the mean weekly
+# reward shortfall of an episode down to the level uniform replay ends the run with
+def benchmark_prioritized_replay(episodes = 5, seed = 0):
+    curves = {}
+    times = {}
+    for prioritized in (False, True):
+        np.random.seed(seed)
+        agent = Manager(None).agent
+        agent.init_replay(agent.replay.capacity, agent.batch_size, agent.replay_ratio, prioritized = prioritized)
+        curves[prioritized] = []
+        times[prioritized] = []
+        elapsed = 0
+        for episode in range(episodes):
+            start = time.perf_counter()
+            progress = agent.play_one(sample_action = agent.policy.boltzmann_q_sample_action)
+            elapsed += time.perf_counter() - start
+            curves[prioritized].append(float((progress['Max reward'] - progress['Actual reward']).mean()))
+            times[prioritized].append(elapsed)
+
+    target = curves[False][-1]
+    results = {}
+    for prioritized in (False, True):
+        converged = [episode for episode in range(episodes) if curves[prioritized][episode] <= target]
+        seconds = times[prioritized][converged[0]] if converged else None
+        results['prioritized' if prioritized else 'uniform'] = {'time': seconds, 'curve': curves[prioritized], 'total': times[prioritized][-1]}
+        print('{} replay: shortfall {:.0f} reached after {}, {:.1f} s in total, mean shortfall by episode {}'.format(
+            'prioritized' if prioritized else 'uniform', target, '{:.1f} s'.format(seconds) if seconds is not None else 'more than the run',
+            times[prioritized][-1], ', '.join('{:.0f}'.format(shortfall) for shortfall in curves[prioritized])))
+    return results
+
+if __name__ == '__main__':
+    benchmark_import_time()
+    benchmark_model_latency()
+    benchmark_featurization()
+    benchmark_policy()
+    benchmark_model_loading()
+    benchmark_value_backends()
+    benchmark_planning()
+    benchmark_prioritized_replay()
+    benchmark_progress_recording()
+    benchmark_checkpointing()
+    benchmark_actor_learner()
+    benchmark_population()
+    benchmark_scenario_grid()
+    benchmark_ledger_memory()
+    benchmark_grid_step()
+    passed = check_step_latency()
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,196 @@
+'''
+ResultCache class stores the results of expensive simulation runs, such as the
+descriptive statistics of the state space and the average reward curves, as
+compact .npz files addressed by a hash of everything the results depend on:
+the simulator configuration, the feature list and the random seed. RunningStats
+class accumulates descriptive statistics of streamed samples (Welford's moments
+and a compressed quantile sketch) and merges the statistics computed by
+parallel workers.
+'''
+
+# import external packages
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+# cache format version, part of every key so that format changes invalidate old entries
+CACHE_VERSION = 1
+
+# convert an object to a json-compatible structure, objects are described by their class and attributes
+def canonical(value):
+    if isinstance(value, dict):
+        return {str(key): canonical(value[key]) for key in sorted(value, key = str)}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return canonical(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return {'class': type(value).__name__, 'attributes': canonical(vars(value))}
+
+# content hash of a configuration
+def cache_key(config):
+    text = json.dumps(canonical({'version': CACHE_VERSION, 'config': config}), sort_keys = True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:20]
+
+# independent integer seeds for a number of tasks derived from one seed
+def spawn_seeds(seed, tasks):
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(tasks)]
+
+class RunningStats:
+    # empty statistics of the given columns, quantiles are kept in a sketch of at most max_centroids per column
+    def __init__(self, columns, max_centroids = 1000):
+        self.columns = list(columns)
+        self.max_centroids = max_centroids
+        width = len(self.columns)
+        self.count = np.zeros(width)
+        self.mean = np.zeros(width)
+        self.m2 = np.zeros(width)                           # sum of squared differences from the mean
+        self.min = np.full(width, np.inf)
+        self.max = np.full(width, -np.inf)
+        self.centroids = [np.zeros(0) for column in self.columns]   # means of the sketch centroids
+        self.weights = [np.zeros(0) for column in self.columns]     # number of samples in the sketch centroids
+
+    # add samples, a row for each sample and a column for each statistic column, missing values are skipped
+    def update(self, samples):
+        samples = np.asarray(samples, dtype = float).reshape(-1, len(self.columns))
+        for column in range(len(self.columns)):
+            values = samples[:, column]
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                continue
+            self.combine(column, len(values), values.mean(), ((values - values.mean())**2).sum(), values.min(), values.max(), values, np.ones(len(values)))
+
+    # merge statistics of the same columns computed on other samples
+    def merge(self, other):
+        for column in range(len(self.columns)):
+            if other.count[column] > 0:
+                self.combine(column, other.count[column], other.mean[column], other.m2[column], other.min[column], other.max[column], other.centroids[column], other.weights[column])
+        return self
+
+    # combine moments with Chan's parallel update of Welford's algorithm and concatenate sketches
+    def combine(self, column, count, mean, m2, minimum, maximum, centroids, weights):
+        total = self.count[column] + count
+        delta = mean - self.mean[column]
+        self.mean[column] += delta * count / total
+        self.m2[column] += m2 + delta**2 * self.count[column] * count / total
+        self.count[column] = total
+        self.min[column] = min(self.min[column], minimum)
+        self.max[column] = max(self.max[column], maximum)
+        self.centroids[column] = np.concatenate([self.centroids[column], centroids])
+        self.weights[column] = np.concatenate([self.weights[column], weights])
+        if len(self.centroids[column]) > 2 * self.max_centroids:
+            self.compress(column)
+
+    # merge neighbouring centroids into at most max_centroids of equal weight
+    def compress(self, column):
+        order = np.argsort(self.centroids[column], kind = 'stable')
+        centroids, weights = self.centroids[column][order], self.weights[column][order]
+        before = np.cumsum(weights) - weights
+        group = np.floor(before / weights.sum() * self.max_centroids).astype(int)
+        group_weights = np.bincount(group, weights = weights)
+        keep = group_weights > 0
+        self.centroids[column] = (np.bincount(group, weights = centroids * weights)[keep] / group_weights[keep])
+        self.weights[column] = group_weights[keep]
+
+    # quantile of a column, exact until the sketch is compressed
+    def quantile(self, column, q):
+        if self.count[column] == 0:
+            return np.nan
+        order = np.argsort(self.centroids[column], kind = 'stable')
+        centroids, weights = self.centroids[column][order], self.weights[column][order]
+        positions = np.cumsum(weights) - weights / 2 - 0.5
+        return float(np.interp(q * (self.count[column] - 1), positions, centroids))
+
+    # standard deviation of each column
+    @property
+    def std(self):
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return np.sqrt(self.m2 / (self.count - 1))
+
+    # descriptive statistics in the layout of pandas describe
+    def describe(self):
+        rows = {'count': self.count, 'mean': np.where(self.count > 0, self.mean, np.nan), 'std': self.std,
+                'min': np.where(self.count > 0, self.min, np.nan)}
+        for q in [0.25, 0.5, 0.75]:
+            rows['{:g}%'.format(q * 100)] = [self.quantile(column, q) for column in range(len(self.columns))]
+        rows['max'] = np.where(self.count > 0, self.max, np.nan)
+        return pd.DataFrame(data = rows, index = self.columns).T
+
+    # statistics as arrays for storage, the sketches are padded to the same length
+    def to_arrays(self):
+        length = max([len(centroids) for centroids in self.centroids] + [0])
+        centroids = np.zeros((len(self.columns), length))
+        weights = np.zeros((len(self.columns), length))
+        for column in range(len(self.columns)):
+            centroids[column, :len(self.centroids[column])] = self.centroids[column]
+            weights[column, :len(self.weights[column])] = self.weights[column]
+        return {'columns': np.array(self.columns, dtype = str), 'count': self.count, 'mean': self.mean, 'm2': self.m2,
+                'min': self.min, 'max': self.max, 'centroids': centroids, 'weights': weights}
+
+    # restore statistics stored with to_arrays
+    @classmethod
+    def from_arrays(cls, arrays, max_centroids = 1000):
+        stats = cls(arrays['columns'].tolist(), max_centroids)
+        for name in ['count', 'mean', 'm2', 'min', 'max']:
+            setattr(stats, name, np.array(arrays[name], dtype = float))
+        stats.centroids = [centroids[weights > 0] for centroids, weights in zip(arrays['centroids'], arrays['weights'])]
+        stats.weights = [weights[weights > 0] for weights in arrays['weights']]
+        return stats
+
+class ResultCache:
+    # open a cache directory
+    def __init__(self, path = 'cache'):
+        self.path = path
+
+    # file of a cache entry
+    def file_name(self, kind, key):
+        return os.path.join(self.path, '{}_{}.npz'.format(kind, key))
+
+    # load the arrays of a cache entry, None if it is missing
+    def load(self, kind, key):
+        file_name = self.file_name(kind, key)
+        if not os.path.isfile(file_name):
+            return None
+        with np.load(file_name, allow_pickle = False) as entry:
+            return {name: entry[name] for name in entry.files}
+
+    # store the arrays of a cache entry
+    def store(self, kind, key, arrays):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        file_name = self.file_name(kind, key)
+        # write to a temporary file first so that concurrent readers never see a partially written entry
+        with open(file_name + '.tmp', 'wb') as entry_file:
+            np.savez_compressed(entry_file, **arrays)
+        os.replace(file_name + '.tmp', file_name)
+
+# add a sample to elementwise running moments (count, mean, sum of squared differences), missing values are skipped
+def update_moments(moments, sample):
+    sample = np.asarray(sample, dtype = float)
+    if moments is None:
+        moments = {'count': np.zeros(sample.shape), 'mean': np.zeros(sample.shape), 'm2': np.zeros(sample.shape)}
+    present = ~np.isnan(sample)
+    count = moments['count'] + present
+    delta = np.where(present, sample - moments['mean'], 0)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = moments['mean'] + np.where(count > 0, delta / count, 0)
+    m2 = moments['m2'] + np.where(present, delta * (sample - mean), 0)
+    return {'count': count, 'mean': mean, 'm2': m2}
+
+# merge elementwise running moments computed on different samples
+def merge_moments(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    count = first['count'] + second['count']
+    delta = second['mean'] - first['mean']
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = np.where(count > 0, first['mean'] + delta * second['count'] / count, 0)
+        m2 = first['m2'] + second['m2'] + np.where(count > 0, delta**2 * first['count'] * second['count'] / count, 0)
+    return {'count': count, 'mean': mean, 'm2': m2}
@@ -0,0 +1,128 @@
+'''
+StepChannel class publishes the state and the action of every environment step
+to a ring buffer in shared memory, so that an external agent process can follow
+the environment without any file I/O. StepChannelReader class attaches to the
+channel by its name and returns the records published since its last read,
+optionally as a view of the shared buffer. Each slot carries the sequence number of its record,
+written after the record itself, so that a reader never returns a slot being
+overwritten.
+'''
+
+# import external packages
+import json
+import weakref
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory, resource_tracker
+
+# channel format version and layout: header fields, column names block, then the ring of records
+CHANNEL_VERSION = 1
+HEADER_FIELDS = ['version', 'capacity', 'width', 'published']
+NAMES_BYTES = 4096
+
+# names of the channels created by this process
+created_channels = set()
+
+# header, column names and ring array views of a channel buffer
+def channel_views(buffer, capacity = None, width = None):
+    header = np.ndarray((len(HEADER_FIELDS),), dtype = np.int64, buffer = buffer)
+    capacity = int(header[1]) if capacity is None else capacity
+    width = int(header[2]) if width is None else width
+    offset = header.nbytes
+    names = np.ndarray((NAMES_BYTES,), dtype = np.uint8, buffer = buffer, offset = offset)
+    # the first column of each slot is the sequence number of the record in it
+    ring = np.ndarray((capacity, width + 1), dtype = np.float64, buffer = buffer, offset = offset + NAMES_BYTES)
+    return header, names, ring
+
+# release a shared memory block created by a channel
+def release(memory):
+    memory.unlink()
+    try:
+        memory.close()
+    except BufferError:
+        pass        # views still referenced are released with the process
+
+class StepChannel:
+    # create a channel with a record of the given columns for each step, keeping the last capacity records
+    def __init__(self, columns, capacity = 4096, name = None):
+        self.columns = list(columns)
+        self.capacity = capacity
+        width = len(self.columns)
+        self.memory = shared_memory.SharedMemory(name = name, create = True, size = 8 * len(HEADER_FIELDS) + NAMES_BYTES + capacity * (width + 1) * 8)
+        self.name = self.memory.name
+        created_channels.add(self.name)
+        self.header, names, self.ring = channel_views(self.memory.buf, capacity, width)
+        encoded = json.dumps(self.columns).encode('utf-8')
+        if len(encoded) > NAMES_BYTES:
+            raise ValueError('column names of the channel do not fit into ' + str(NAMES_BYTES) + ' bytes')
+        names[:len(encoded)] = np.frombuffer(encoded, dtype = np.uint8)
+        self.ring[:, 0] = -1
+        self.header[:] = [CHANNEL_VERSION, capacity, width, 0]
+        # the shared memory is released when the channel is closed or garbage collected
+        self.finalizer = weakref.finalize(self, release, self.memory)
+
+    # publish the record of a step, values in the order of the columns
+    def publish(self, values):
+        sequence = int(self.header[3])
+        slot = self.ring[sequence % self.capacity]
+        slot[0] = -1                # mark the slot as being written
+        slot[1:] = values
+        slot[0] = sequence
+        self.header[3] = sequence + 1
+        return sequence
+
+    # number of records published so far
+    @property
+    def published(self):
+        return int(self.header[3])
+
+    # stop publishing and release the shared memory
+    def close(self):
+        self.header = self.ring = None
+        self.finalizer()
+
+class StepChannelReader:
+    # attach to a channel by its name, reading starts at the oldest record still in the ring
+    def __init__(self, name):
+        self.memory = shared_memory.SharedMemory(name = name)
+        # the channel is owned by the publishing process, a reader in another process must not release it on exit
+        if name not in created_channels:
+            resource_tracker.unregister(self.memory._name, 'shared_memory')
+        self.header, names, self.ring = channel_views(self.memory.buf)
+        if int(self.header[0]) != CHANNEL_VERSION:
+            raise ValueError('unsupported channel version ' + str(int(self.header[0])))
+        self.columns = json.loads(bytes(names).rstrip(b'\x00').decode('utf-8'))
+        self.capacity = int(self.header[1])
+        self.position = max(0, int(self.header[3]) - self.capacity)     # sequence number of the next record to read
+        self.lost = 0                                                    # records overwritten before they were read
+
+    # records published since the last read, a row for each record and a column for each channel column
+    def read(self, copy = True):
+        published = int(self.header[3])
+        if published - self.position > self.capacity:
+            self.lost += published - self.capacity - self.position
+            self.position = published - self.capacity
+        if published == self.position:
+            return np.zeros((0, len(self.columns)))
+        slots = np.arange(self.position, published) % self.capacity
+        # a contiguous range of slots is returned as a view of the shared buffer unless a copy is requested
+        if slots[0] <= slots[-1] and not copy:
+            records = self.ring[slots[0]:slots[-1] + 1]
+        else:
+            records = self.ring[slots].copy()
+        # keep only the records that were not overwritten while reading
+        valid = records[:, 0] == np.arange(self.position, published)
+        if not valid.all():
+            self.lost += int((~valid).sum())
+            records = records[valid]
+        self.position = published
+        return records[:, 1:]
+
+    # the records published since the last read as a dataframe
+    def read_frame(self):
+        return pd.DataFrame(data = self.read(), columns = self.columns)
+
+    # detach from the channel
+    def close(self):
+        self.header = self.ring = None
+        self.memory.close()
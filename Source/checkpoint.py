@@ -0,0 +1,289 @@
+'''
+CheckpointService class saves the agent during training without blocking the
+training loop on disk. On the training thread a checkpoint only copies the
+weight arrays of the value models in memory, the featurizers, which do not
+change during training, are shared. A background thread serializes them.
+Checkpoints are weights-only: a base holds a weights file of each model and the
+settings of the agent, and a weekly checkpoint holds the flat positions of the
+weights that changed since the last base and their values. The snapshots taken
+at episode boundaries are bases, and a weekly checkpoint is written as a new
+base when most of the weights changed since the last base or after rebase
+weekly checkpoints against it, so that deltas stay small. If the writer falls
+behind, a newer checkpoint replaces the one still waiting, so rapid saves are
+coalesced. Only the most recent checkpoints are kept on disk.
+Function load_checkpoint restores an agent from a checkpoint directory.
+'''
+
+# import external packages
+import os
+import json
+import atexit
+import threading
+import collections
+import numpy as np
+
+# import internal classes
+from replay import PrioritizedReplayBuffer
+from weights import save_weights, load_weights
+
+# services writing to each checkpoint directory
+services = {}
+
+# models of the agent whose weights are checkpointed
+def agent_models(agent):
+    models = {'model': agent.model}
+    if agent.target_model is not None:
+        models['target_model'] = agent.target_model
+    return models
+
+# copies of the weight arrays of the agent models, keyed by model and array name
+def copy_weights(agent):
+    return {name + '/' + key: np.array(array) for name, model in agent_models(agent).items() for key, array in model.to_arrays().items()}
+
+# copies of the agent models detached from the agent, their weight arrays are copied and their featurizers shared
+def copy_models(agent):
+    return {name: type(model).from_arrays({key: np.array(array) for key, array in model.to_arrays().items()}, model.feature_transformer,
+                                          model.learning_rate, model.schedule, model.power_t)
+            for name, model in agent_models(agent).items()}
+
+# weight arrays of models, keyed by model and array name
+def model_weights(models):
+    return {name + '/' + key: array for name, model in models.items() for key, array in model.to_arrays().items()}
+
+# settings the agent is built again with around its models
+def agent_settings(agent):
+    return {'eps': float(agent.eps), 'gamma1': float(agent.gamma1), 'gamma2': float(agent.gamma2), 'planning_updates': int(agent.planning_updates),
+            'replay_capacity': int(agent.replay.capacity), 'batch_size': int(agent.batch_size), 'replay_ratio': int(agent.replay_ratio),
+            'prioritized': isinstance(agent.replay, PrioritizedReplayBuffer)}
+
+# write a file through a temporary file, so that readers never see it partially written
+def write_atomic(path, write):
+    with open(path + '.tmp', 'wb') as checkpoint_file:
+        write(checkpoint_file)
+    os.replace(path + '.tmp', path)
+
+class CheckpointService:
+    # service writing to a directory, keeping the last retention weekly checkpoints and the last snapshots episode snapshots, weekly
+    # checkpoints are written against a base until more than threshold of the weights changed or rebase of them were written
+    def __init__(self, path, retention = 5, snapshots = 2, threshold = 0.5, rebase = 10):
+        self.path = path
+        self.retention = retention
+        self.snapshots = snapshots
+        self.threshold = threshold                      # share of changed positions above which a new base is written
+        self.rebase = rebase                            # weekly checkpoints written against a base before a new base is written
+        self.jobs = collections.deque()                 # checkpoints waiting to be written, oldest first
+        self.condition = threading.Condition()
+        self.thread = None
+        self.busy = False
+        self.closed = False
+        self.error = None                               # error of the writer thread, raised on the next call
+        self.base = None                                # label and weights of the last base written
+        self.since_base = 0                             # weekly checkpoints written against the last base
+        self.written_deltas = []                        # (label, base label) of the weekly checkpoints on disk, oldest first
+        self.written_snapshots = []                     # labels of the episode snapshots on disk, oldest first
+        self.written_bases = []                         # labels of the bases written for weekly checkpoints on disk
+        self.requested = 0
+        self.coalesced = 0
+        self.written = 0
+        if not os.path.exists(path):
+            os.makedirs(path)
+        atexit.register(self.close)
+
+    # queue the weights of the agent as a weekly checkpoint, replacing a weekly checkpoint still waiting
+    def save(self, agent, label):
+        self.submit(('delta', str(label), copy_models(agent), agent_settings(agent)))
+
+    # queue a snapshot of the agent at an episode boundary, weekly checkpoints still waiting are superseded by it
+    def snapshot(self, agent, label):
+        self.submit(('snapshot', str(label), copy_models(agent), agent_settings(agent)))
+
+    def submit(self, job):
+        self.check()
+        with self.condition:
+            self.requested += 1
+            while self.jobs and self.jobs[-1][0] == 'delta':
+                self.jobs.pop()
+                self.coalesced += 1
+            self.jobs.append(job)
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.run, daemon = True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    # raise the error of the writer thread
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    # write the queued checkpoints until the service is closed
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.jobs and not self.closed:
+                    self.condition.wait()
+                if not self.jobs:
+                    return
+                job = self.jobs.popleft()
+                self.busy = True
+            try:
+                if job[0] == 'delta':
+                    self.write_delta(*job[1:])
+                else:
+                    self.write_snapshot(*job[1:])
+                self.written += 1
+            except Exception as error:
+                self.error = error
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    # write a base: the weights file of each model and the settings of the agent, weekly checkpoints taken against an earlier base
+    # of the same label are removed with it
+    def write_base(self, label, models, settings):
+        for delta_label, base_label in [delta for delta in self.written_deltas if delta[1] == label]:
+            self.written_deltas.remove((delta_label, base_label))
+            os.remove(os.path.join(self.path, 'delta_' + delta_label + '.npz'))
+        self.remove_base(label)
+        for name, model in models.items():
+            save_weights(model, os.path.join(self.path, 'snapshot_' + label + '.' + name + '.crm'))
+        write_atomic(os.path.join(self.path, 'snapshot_' + label + '.json'), lambda checkpoint_file: checkpoint_file.write(json.dumps(settings).encode('utf-8')))
+        self.base = (label, model_weights(models))
+        self.since_base = 0
+
+    # write a snapshot at an episode boundary
+    def write_snapshot(self, label, models, settings):
+        self.write_base(label, models, settings)
+        self.written_snapshots.append(label)
+        self.prune()
+
+    # changed positions of each array and their values against the last base, None when a new base is due: there is no base of the
+    # same arrays, rebase weekly checkpoints were written against it or more than threshold of the positions changed
+    def diff(self, weights):
+        if self.base is None or self.since_base >= self.rebase:
+            return None
+        base = self.base[1]
+        arrays = {}
+        for name, array in weights.items():
+            if name not in base or base[name].shape != array.shape:
+                return None
+            changed = np.flatnonzero(array.ravel() != base[name].ravel())
+            arrays[name + '/index'] = changed
+            arrays[name + '/values'] = array.ravel()[changed]
+        if sum(len(arrays[name + '/index']) for name in weights) > self.threshold * sum(array.size for array in weights.values()):
+            return None
+        return arrays
+
+    # write a weekly checkpoint as a delta against the last base, or as a new base and an empty delta against it
+    def write_delta(self, label, models, settings):
+        arrays = self.diff(model_weights(models))
+        if arrays is None:
+            self.write_base(label, models, settings)
+            self.written_bases.append(label)
+            arrays = {}
+        base_label = self.base[0]
+        arrays['base'] = np.array(base_label)
+        write_atomic(os.path.join(self.path, 'delta_' + label + '.npz'), lambda checkpoint_file: np.savez(checkpoint_file, **arrays))
+        self.written_deltas = [(written, written_base) for written, written_base in self.written_deltas if written != label]
+        self.written_deltas.append((label, base_label))
+        self.since_base += 1
+        self.prune()
+
+    # remove the files of a base
+    def remove_base(self, label):
+        for written in [self.written_snapshots, self.written_bases]:
+            if label in written:
+                written.remove(label)
+        for file_name in os.listdir(self.path):
+            if file_name.startswith('snapshot_' + label + '.') and not file_name.endswith('.tmp'):
+                os.remove(os.path.join(self.path, file_name))
+
+    # remove the weekly checkpoints outside the retention window, the episode snapshots outside the last snapshots and the bases no
+    # retained checkpoint refers to
+    def prune(self):
+        while len(self.written_deltas) > self.retention:
+            label, base_label = self.written_deltas.pop(0)
+            os.remove(os.path.join(self.path, 'delta_' + label + '.npz'))
+        referenced = set(base_label for label, base_label in self.written_deltas)
+        old_snapshots = self.written_snapshots[:-self.snapshots] if self.snapshots > 0 else list(self.written_snapshots)
+        for label in old_snapshots + list(self.written_bases):
+            if label not in referenced:
+                self.remove_base(label)
+
+    # wait until the queued checkpoints are written
+    def flush(self):
+        with self.condition:
+            while self.jobs or self.busy:
+                self.condition.wait()
+        self.check()
+
+    # write the queued checkpoints and stop the writer thread
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.check()
+
+    # number of checkpoints requested, dropped in favour of newer ones and written
+    def stats(self):
+        return {'requested': self.requested, 'coalesced': self.coalesced, 'written': self.written}
+
+# the service writing to a checkpoint directory, created on first use
+def checkpoint_service(path, retention = 5):
+    path = os.path.abspath(path)
+    if path not in services or services[path].closed:
+        services[path] = CheckpointService(path, retention)
+    services[path].retention = retention
+    return services[path]
+
+# agent built around models restored from a base, with the settings of the agent the base was taken from
+def build_agent(models, settings):
+    # imported here as the agent module imports the checkpoint service
+    from agent import Agent
+    from model import EnvironmentModel
+    from policy import Policy
+    from simulation import SimulationEnv
+    env = SimulationEnv()
+    for model in models.values():
+        model.env = env
+    return Agent(env, models['model'], EnvironmentModel(env, models['model'].learning_rate), Policy(env), settings['eps'], settings['gamma1'],
+                 settings['gamma2'], target_model = models.get('target_model'), planning_updates = settings['planning_updates'],
+                 replay_capacity = settings['replay_capacity'], batch_size = settings['batch_size'], replay_ratio = settings['replay_ratio'],
+                 prioritized = settings['prioritized'])
+
+# restore an agent from a checkpoint directory: the weekly checkpoint of the label, the latest one if no label is given, or the episode
+# snapshot of the label, applied to the agent or to an agent built from the base it was taken against
+def load_checkpoint(path, label = None, agent = None):
+    if label is None:
+        deltas = [name for name in os.listdir(path) if name.startswith('delta_') and name.endswith('.npz')]
+        if not deltas:
+            raise ValueError('no checkpoints in ' + path)
+        label = max(deltas, key = lambda name: os.path.getmtime(os.path.join(path, name)))[len('delta_'):-len('.npz')]
+    label = str(label)
+    if os.path.exists(os.path.join(path, 'delta_' + label + '.npz')):
+        with np.load(os.path.join(path, 'delta_' + label + '.npz')) as delta:
+            arrays = {name: delta[name] for name in delta.files}
+        base_label = str(arrays.pop('base'))
+    elif os.path.exists(os.path.join(path, 'snapshot_' + label + '.json')):
+        base_label, arrays = label, {}
+    else:
+        raise ValueError('no checkpoint ' + label + ' in ' + path)
+
+    prefix = 'snapshot_' + base_label + '.'
+    models = {file_name[len(prefix):-len('.crm')]: load_weights(os.path.join(path, file_name)) for file_name in os.listdir(path)
+              if file_name.startswith(prefix) and file_name.endswith('.crm')}
+    if agent is None:
+        with open(os.path.join(path, prefix + 'json'), 'rb') as settings_file:
+            agent = build_agent(models, json.loads(settings_file.read().decode('utf-8')))
+
+    for name, model in agent_models(agent).items():
+        for key, base_array in models[name].to_arrays().items():
+            array = np.array(base_array)
+            if name + '/' + key + '/index' in arrays:
+                array.ravel()[arrays[name + '/' + key + '/index']] = arrays[name + '/' + key + '/values']
+            setattr(model, key, array)
+        model.new_version()
+    return agent
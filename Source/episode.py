@@ -0,0 +1,49 @@
+'''
+EpisodeConfig class defines the structure of a simulated episode: the length of
+the warming-up phase, the window of weeks the agent is rewarded for, the week
+the episode finishes and the week after which the application volume trend of
+the simulation is held constant, allowing long multi-year episodes.
+'''
+
+class EpisodeConfig:
+    # define episode boundaries, the defaults reproduce the original 135-week episode
+    def __init__(self, warmup_weeks = 53, reward_start = 53, reward_end = 113, done_week = 135, total_reward_start = 62, trend_horizon = 135):
+        self.warmup_weeks = warmup_weeks                    # weeks simulated with the default policy before the agent takes over
+        self.reward_start = reward_start                    # first week the rewards are calculated for
+        self.reward_end = reward_end                        # last week the rewards are calculated for
+        self.done_week = done_week                          # week the episode finishes, when all the delayed rewards are learned
+        self.total_reward_start = total_reward_start        # first week the total profit is observed with the 'total' reward type
+        self.trend_horizon = trend_horizon                  # week after which the application volume trend is held constant
+
+        if not warmup_weeks <= reward_start <= reward_end < done_week:
+            raise ValueError('episode boundaries must satisfy warmup_weeks <= reward_start <= reward_end < done_week')
+
+    # build a configuration of the same structure with a reward window of the given number of weeks
+    @classmethod
+    def with_reward_weeks(cls, weeks, **kwargs):
+        default = cls()
+        reward_end = default.reward_start + weeks - 1
+        return cls(reward_end = reward_end, done_week = reward_end + default.done_week - default.reward_end, **kwargs)
+
+    # first week after the reward window, rewards are not calculated for later cohorts
+    @property
+    def reward_cap(self):
+        return self.reward_end + 1
+
+    # first week of the window used to evaluate episode results
+    @property
+    def evaluation_start(self):
+        return self.reward_start + 1
+
+    # last week of the window used to evaluate episode results
+    @property
+    def evaluation_end(self):
+        return self.reward_end + 1
+
+    # number of weeks the agent acts in
+    @property
+    def agent_weeks(self):
+        return self.done_week - self.warmup_weeks
+
+    def __repr__(self):
+        return 'EpisodeConfig(warmup_weeks={}, reward_start={}, reward_end={}, done_week={}, total_reward_start={}, trend_horizon={})'.format(self.warmup_weeks, self.reward_start, self.reward_end, self.done_week, self.total_reward_start, self.trend_horizon)
@@ -0,0 +1,157 @@
+'''
+ThresholdGrid class generates the discrete action space of acceptance thresholds
+(or threshold changes) from a specification: range and step of the thresholds
+and optionally separate axes for new and repeat clients. It evaluates sums over
+loan applications for every action of the grid at once, using suffix sums over
+score-sorted new and repeat clients, so the cost does not grow with the grid size.
+Policies with a threshold for each customer segment are evaluated the same way,
+segment by segment.
+ActionTable class stores values for each action of the grid in each week, such as
+rewards and state predictions, in a preallocated array exposed as a dataframe.
+'''
+
+# import external packages
+import numpy as np
+import pandas as pd
+
+class ThresholdGrid:
+    # define the grid by the threshold range and step, optionally with a separate axis for repeat clients
+    def __init__(self, low = 5, high = 100, step = 5, separate = False, repeat_low = None, repeat_high = None, repeat_step = None):
+        self.low = low
+        self.high = high
+        self.step = step
+        self.separate = separate
+        self.repeat_low = low if repeat_low is None else repeat_low
+        self.repeat_high = high if repeat_high is None else repeat_high
+        self.repeat_step = step if repeat_step is None else repeat_step
+
+        self.axis_new = np.arange(self.low, self.high + self.step / 2, self.step)
+        self.axis_repeat = np.arange(self.repeat_low, self.repeat_high + self.repeat_step / 2, self.repeat_step) if separate else self.axis_new
+
+        # thresholds of each action, repeat thresholds vary fastest on a separate grid
+        if separate:
+            self.thresholds_repeat = np.tile(self.axis_repeat, len(self.axis_new))
+            self.thresholds_new = np.repeat(self.axis_new, len(self.axis_repeat))
+        else:
+            self.thresholds_repeat = self.thresholds_new = self.axis_new
+
+    # number of actions
+    def __len__(self):
+        return len(self.thresholds_new)
+
+    # action dictionary: threshold for a single grid, [repeat threshold, new threshold] for a separate grid
+    def action_dict(self):
+        if self.separate:
+            return {action: [self.to_number(self.thresholds_repeat[action]), self.to_number(self.thresholds_new[action])] for action in range(len(self))}
+        return {action: self.to_number(self.thresholds_new[action]) for action in range(len(self))}
+
+    # keep integer thresholds as python integers
+    def to_number(self, value):
+        return int(value) if float(value).is_integer() else float(value)
+
+    # convert action index to threshold (or [repeat, new] thresholds for a separate grid)
+    def real_action(self, action):
+        if self.separate:
+            action = int(action)
+            return [self.to_number(self.thresholds_repeat[action]), self.to_number(self.thresholds_new[action])]
+        return self.low + action * self.step
+
+    # convert threshold (or [repeat, new] thresholds for a separate grid) to action index
+    def simple_action(self, threshold):
+        if self.separate:
+            repeat_index = int(np.clip(np.round((threshold[0] - self.repeat_low) / self.repeat_step), 0, len(self.axis_repeat) - 1))
+            new_index = int(np.clip(np.round((threshold[1] - self.low) / self.step), 0, len(self.axis_new) - 1))
+            return new_index * len(self.axis_repeat) + repeat_index
+        return (threshold - self.low) / self.step
+
+    # actions with any threshold lower than the actual one
+    def below(self, threshold):
+        if self.separate:
+            return (self.thresholds_repeat < threshold[0]) | (self.thresholds_new < threshold[1])
+        return self.thresholds_new < threshold
+
+    # sum of values of the applications with score at or above each action threshold
+    def evaluate(self, scores, values, repeat = None):
+        scores = np.asarray(scores, dtype = float)
+        values = np.asarray(values, dtype = float)
+        if not self.separate:
+            return value_above(scores, values, self.axis_new)
+        repeat = np.asarray(repeat, dtype = bool)
+        above_new = value_above(scores[~repeat], values[~repeat], self.axis_new)
+        above_repeat = value_above(scores[repeat], values[repeat], self.axis_repeat)
+        return (above_new[:, None] + above_repeat[None, :]).ravel()
+
+# sum of values with score at or above each threshold, using suffix sums over sorted scores
+def value_above(scores, values, thresholds):
+    order = np.argsort(scores, kind = 'stable')
+    suffix = np.concatenate([np.cumsum(values[order][::-1])[::-1], [0]])
+    return suffix[np.searchsorted(scores[order], thresholds, side = 'left')]
+
+class ActionTable:
+    # empty table of values for each action in each week, rows are preallocated in chunks
+    def __init__(self, actions, chunk = 64):
+        self.actions = list(actions)
+        self.chunk = chunk
+        self.data = np.zeros((chunk, len(self.actions)))
+        self.index = []                         # week of each row, in the order the rows are added
+        self.positions = {}                     # row position of each week
+        self.cached_frame = None                # dataframe view of the rows, rebuilt after changes
+        self.changed = set()                    # weeks changed since the last call of pop_changed
+
+    # row position of a week, a row is added if the week is new
+    def position(self, week):
+        if week not in self.positions:
+            if len(self.index) == self.data.shape[0]:
+                self.data = np.concatenate([self.data, np.zeros((self.chunk, len(self.actions)))])
+            self.positions[week] = len(self.index)
+            self.index.append(week)
+        return self.positions[week]
+
+    # set values of a week for all the actions or the selected ones, None stands for missing values
+    def set(self, week, values, columns = None):
+        position = self.position(week)
+        values = np.nan if values is None else values
+        if columns is None:
+            self.data[position] = values
+        else:
+            self.data[position, columns] = values
+        self.cached_frame = None
+        self.changed.add(week)
+
+    # add values to a week for all the actions or the selected ones
+    def add(self, week, values, columns = None):
+        position = self.position(week)
+        if columns is None:
+            self.data[position] += values
+        else:
+            self.data[position, columns] += values
+        self.cached_frame = None
+        self.changed.add(week)
+
+    # weeks with values changed since the last call, in the order of the weeks
+    def pop_changed(self):
+        weeks = sorted(self.changed)
+        self.changed = set()
+        return weeks
+
+    # values of a week for all the actions
+    def row(self, week):
+        return self.data[self.positions[week]]
+
+    # table as a dataframe indexed by week with a column for each action
+    def frame(self):
+        if self.cached_frame is None:
+            self.cached_frame = pd.DataFrame(data = self.data[:len(self.index)], index = self.index, columns = self.actions)
+        return self.cached_frame
+
+# sum of values of the applications accepted by each per-segment policy, a row of thresholds for segments numbered from 1
+def segment_values(scores, values, segments, thresholds):
+    scores = np.asarray(scores, dtype = float)
+    values = np.asarray(values, dtype = float)
+    segments = np.asarray(segments, dtype = int)
+    thresholds = np.atleast_2d(np.asarray(thresholds, dtype = float))
+    total = np.zeros(thresholds.shape[0])
+    for segment in np.unique(segments):
+        mask = segments == segment
+        total += value_above(scores[mask], values[mask], thresholds[:, segment - 1])
+    return total
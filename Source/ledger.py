@@ -0,0 +1,118 @@
+'''
+Ledger class stores the loan applications generated by the simulation. Loans
+with pending events (maturation, overdue, late payment) are kept row by row,
+while settled loans and rejected applications are folded into compact
+aggregates per cohort (week of application), client type and score bucket as
+soon as their last event is over. With the default 'compact' retention policy
+the settled loans are then evicted, so memory is bounded by the loans still
+open, not by the whole episode history. With the 'full' retention policy all
+the loans are also kept row by row. The rewards are calculated from the loans
+due each week, which are open loans, and the statistics of the settled loans
+from the aggregates, so neither depends on the retention policy.
+'''
+
+# import external packages
+import numpy as np
+import pandas as pd
+
+class Ledger:
+    # aggregated values for each cohort, client type and score bucket
+    fields = ['applications', 'accepted', 'value', 'accepted value']
+
+    # initialize an empty ledger
+    def __init__(self, retention = 'compact', max_score = 100):
+        if retention not in ('compact', 'full'):
+            raise ValueError('unknown retention policy ' + str(retention))
+        self.retention = retention
+        self.max_score = max_score                  # score buckets are 0, 1, ..., max_score, exact for integer thresholds
+        self.pending = {}                           # open loans by the week of their last event
+        self.history_frame = pd.DataFrame(data = []) # all the loans merged so far, kept with 'full' retention only
+        self.history_batches = []                   # weekly loans not merged yet, kept with 'full' retention only
+        self.cohorts = {}                           # aggregates of settled loans for each cohort: client type x score bucket x field
+        self.settled = 0                            # number of settled loans folded into the aggregates
+
+    # add weekly loan applications, folding the ones already settled
+    def add(self, batch, week):
+        if batch.empty:
+            return
+        if self.retention == 'full':
+            self.history_batches.append(batch)
+
+        settlement = self.settlement_weeks(batch)
+        self.fold(batch[settlement <= week])
+        open_loans = batch[settlement > week]
+        for settlement_week, loans in open_loans.groupby(settlement[settlement > week]):
+            self.pending.setdefault(int(settlement_week), []).append(loans)
+
+    # fold the loans whose last event happened by the given week
+    def settle(self, week):
+        for settlement_week in [w for w in self.pending if w <= week]:
+            self.fold(pd.concat(self.pending.pop(settlement_week)))
+
+    # week of the last event of each loan, rejected applications settle in the week they are received
+    def settlement_weeks(self, batch):
+        event_weeks = pd.concat([pd.to_numeric(batch[column], errors = 'coerce') for column in ['maturation_at', 'dca_at', 'late_payment_at']], axis = 1).max(axis = 1)
+        accepted = batch['accept'] == True if 'accept' in batch.columns else pd.Series(data = False, index = batch.index)
+        return event_weeks.where(accepted, batch['iteration'])
+
+    # add settled loans to the cohort aggregates, the value of a loan is its profit, or minus its sum if it was lost
+    def fold(self, loans):
+        if loans.empty:
+            return
+        client_type = (loans['repeat'] == True).values.astype(int)
+        bucket = np.clip(np.floor(loans['score'].values), 0, self.max_score).astype(int)
+        accepted = (loans['accept'] == True).values if 'accept' in loans.columns else np.zeros(loans.shape[0], dtype = bool)
+        lost = ((loans['dca'] == True) & (loans['late_payment'] == 0)).values
+        value = np.where(lost, -loans['sum'].values, loans['profit'].values)
+        cohort_weeks = loans['iteration'].values.astype(int)
+
+        for cohort in np.unique(cohort_weeks):
+            aggregate = self.cohorts.setdefault(int(cohort), np.zeros((2, self.max_score + 1, len(self.fields))))
+            mask = cohort_weeks == cohort
+            index = (client_type[mask], bucket[mask])
+            np.add.at(aggregate[:, :, 0], index, 1)
+            np.add.at(aggregate[:, :, 1], index, accepted[mask])
+            np.add.at(aggregate[:, :, 2], index, value[mask])
+            np.add.at(aggregate[:, :, 3], index, value[mask] * accepted[mask])
+        self.settled += loans.shape[0]
+
+    # loans kept row by row: all of them with 'full' retention, only the open ones with 'compact' retention
+    @property
+    def rows(self):
+        if self.retention == 'full':
+            if self.history_batches:
+                self.history_frame = pd.concat([self.history_frame] + self.history_batches)
+                self.history_batches = []
+            return self.history_frame
+        frames = [loans for week in sorted(self.pending) for loans in self.pending[week]]
+        if not frames:
+            return pd.DataFrame(data = [])
+        return pd.concat(frames).sort_values('iteration', kind = 'stable')
+
+    # number of open loans kept row by row
+    @property
+    def open_loans(self):
+        return sum(loans.shape[0] for frames in self.pending.values() for loans in frames)
+
+    # settled value of each cohort for each threshold of new and repeat clients
+    def cohort_rewards(self, thresholds_new, thresholds_repeat = None, accepted_only = False):
+        thresholds_new = np.asarray(thresholds_new, dtype = int)
+        thresholds_repeat = thresholds_new if thresholds_repeat is None else np.asarray(thresholds_repeat, dtype = int)
+        field = self.fields.index('accepted value' if accepted_only else 'value')
+        cohorts = sorted(self.cohorts)
+        rewards = np.zeros((len(cohorts), len(thresholds_new)))
+        for row, cohort in enumerate(cohorts):
+            # value of the loans with score at or above each bucket
+            above = np.cumsum(self.cohorts[cohort][:, ::-1, field], axis = 1)[:, ::-1]
+            above = np.concatenate([above, np.zeros((2, 1))], axis = 1)
+            rewards[row] = above[0, np.clip(thresholds_new, 0, self.max_score + 1)] + above[1, np.clip(thresholds_repeat, 0, self.max_score + 1)]
+        return pd.DataFrame(data = rewards, index = cohorts)
+
+    # cohort aggregates as a dataframe indexed by cohort, client type and score bucket
+    def frame(self):
+        cohorts = sorted(self.cohorts)
+        if not cohorts:
+            return pd.DataFrame(data = [], columns = self.fields)
+        data = np.concatenate([self.cohorts[cohort].reshape(-1, len(self.fields)) for cohort in cohorts])
+        index = pd.MultiIndex.from_product([cohorts, ['new', 'repeat'], range(self.max_score + 1)], names = ['cohort', 'client type', 'score bucket'])
+        return pd.DataFrame(data = data, index = index, columns = self.fields)
@@ -11,28 +11,63 @@ import numpy as np
 import pandas as pd
 import datetime as dt
 import joblib
-import matplotlib.pyplot as plt
 
 # import internal classes
 from simulation import SimulationEnv
 from agent import Agent
-from model import FeatureTransformer, Model, EnvironmentModel
+from model import FeatureTransformer, Model, TileCoder, TileModel, EnvironmentModel
 from policy import Policy
+from archive import LoanArchiveWriter
+from recorder import ProgressStore
+from weights import save_weights, load_model
+from scenarios import ScenarioGridRunner
 
 class Manager():
     # initialize the Manager instance
-    def __init__(self, agent):
-        self.agent = self.initAgent() if agent is None else agent
+    def __init__(self, agent, featurizer = 'rbf', featurizer_path = None):
+        self.agent = self.initAgent(featurizer, featurizer_path) if agent is None else agent
         
-    # initialize the agent instance
-    def initAgent(self):
+    # weekly progress of the train episodes, kept as chunks and combined when requested
+    @property
+    def weekly_progress(self):
+        return self.weekly_store.to_frame()
+    
+    @weekly_progress.setter
+    def weekly_progress(self, frame):
+        self.weekly_store = ProgressStore(frame)
+    
+    # weekly progress of the distorted episodes, kept as chunks and combined when requested
+    @property
+    def distorted_progress(self):
+        return self.distorted_store.to_frame()
+    
+    @distorted_progress.setter
+    def distorted_progress(self, frame):
+        self.distorted_store = ProgressStore(frame)
+    
+    # unpickle managers saved with the combined progress frames
+    def __setstate__(self, state):
+        frames = {name: state.pop(name) for name in ('weekly_progress', 'distorted_progress') if name in state}
+        self.__dict__.update(state)
+        for name, frame in frames.items():
+            setattr(self, name, frame)
+        
+    # initialize the agent instance, with the 'rbf' featurizer or the sparse 'tile' coding featurizer,
+    # the 'rbf' featurizer is loaded from featurizer_path if it was saved there, or fitted and saved there
+    def initAgent(self, featurizer = 'rbf', featurizer_path = None):
         # micro-loan business simulation environment instance
         env = SimulationEnv()
-        # feature transformer instance to convert numerous outputs of environment into simple numeric variables understood by the RL agent
-        ft = FeatureTransformer(env)
         # value function model instance - the brain of the RL agent. Approximates value of each action in every state of environment
         lr = 0.0001                                                   # learning rate defines how adaptive the value function is to new input
-        model = Model(env, ft, lr) 
+        # feature transformer instance to convert numerous outputs of environment into simple numeric variables understood by the RL agent
+        if featurizer == 'rbf':
+            ft = FeatureTransformer(env, path = featurizer_path)
+            model = Model(env, ft, lr) 
+        elif featurizer == 'tile':
+            ft = TileCoder(env)
+            model = TileModel(env, ft, lr)
+        else:
+            raise ValueError('unknown featurizer ' + str(featurizer) + ', expected \'rbf\' or \'tile\'')
         # environment model instance - the planning center of the agent. Predicts future environment states based on the current one
         env_model = EnvironmentModel(env, lr)
         # policy instance - includes different kinds of behaviors the agent can use to interact with the environment
@@ -45,7 +80,7 @@ class Manager():
         return agent
     
     # initialize experiment variables
-    def initExperiment(self, train_episodes = 100, test_episodes = 5, test_frequency = 2, distorted_episodes = 100, experiment_name = 'baseline', bookkeeping_directory = os.getcwd(), bookkeeping_frequency = 1):
+    def initExperiment(self, train_episodes = 100, test_episodes = 5, test_frequency = 2, distorted_episodes = 100, experiment_name = 'baseline', bookkeeping_directory = os.getcwd(), bookkeeping_frequency = 1, archive_loans = False):
         # define train and test episode numbers
         self.train_episodes = train_episodes + 1                      # number of train episodes, where agent learns the environment and value function
         self.test_episodes = test_episodes                            # number of test episodes in a row to evaluate the current agent
@@ -58,6 +93,11 @@ class Manager():
         self.bookkeeping_frequency = bookkeeping_frequency            # frequency of storing
         self.path = ''
         
+        # stream loan-level history of every episode to an on-disk archive instead of keeping it in memory
+        self.archive = LoanArchiveWriter(self.bookkeeping_directory + '/bookkeeping/' + self.experiment_name + '/loans') if archive_loans else None
+        if self.archive is not None:
+            self.agent.env.env.attach_archive(self.archive)
+        
         self.progress = pd.DataFrame(data = [])          
         self.weekly_progress = pd.DataFrame(data = [])
         self.distorted_progress = pd.DataFrame(data = [])
@@ -84,8 +124,8 @@ class Manager():
             self.time = current_time
             
             # extract episode info
-            max_reward = self.agent.env.env.true_rewards.loc[54:114, :].sum().max()
-            max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.true_rewards.loc[54:114, :].sum()))
+            max_reward = self.agent.env.env.get_evaluation_rewards().max()
+            max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.get_evaluation_rewards()))
             true_optimal_reward = test_episode_progress['True optimal reward'].sum()
             true_optimal_action = test_episode_progress.loc[0, 'True optimal action']
             optimized_action_avg = test_episode_progress['Optimized action'].mean()
@@ -134,7 +174,7 @@ class Manager():
         episode_progress['episode'] = self.train_episode
         self.run_agents.append(self.agent)
         self.run_progress.append(episode_progress)
-        self.weekly_progress = pd.concat([self.weekly_progress, episode_progress], axis = 0)
+        self.weekly_store.append(episode_progress)
         
         # timing
         current_time = dt.datetime.now()
@@ -143,8 +183,8 @@ class Manager():
         self.time = current_time
         
         # extract episode info
-        max_reward = self.agent.env.env.true_rewards.loc[54:114, :].sum().max()
-        max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.true_rewards.loc[54:114, :].sum()))
+        max_reward = self.agent.env.env.get_evaluation_rewards().max()
+        max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.get_evaluation_rewards()))
         true_optimal_reward = episode_progress['True optimal reward'].sum()
         true_optimal_action = episode_progress.loc[0, 'True optimal action']
         optimized_action_avg = episode_progress['Optimized action'].mean()
@@ -183,7 +223,7 @@ class Manager():
         if not os.path.exists(self.path):
             os.makedirs(self.path)
         joblib.dump(self.agent, self.path + 'agent.pkl')
-        joblib.dump(self.agent.model, self.path + 'model.pkl')
+        save_weights(self.agent.model, self.path + 'model.crm')
         joblib.dump(self.progress, self.path + 'progress.pkl')
         joblib.dump(episode_progress, self.path + 'episode_progress.pkl')
         joblib.dump(self.weekly_progress, self.path + 'weekly_progress.pkl')
@@ -198,7 +238,7 @@ class Manager():
         distorted_episode_progress = self.agent.play_one(sample_action = self.agent.policy.boltzmann_q_greedy_sample_action, visualize_learning = 2)#, save = True, path = 'E:/bookkeeping/baseline_final/episode_distorted/')
         
         distorted_episode_progress['episode'] = distorted_episode
-        self.distorted_progress = pd.concat([self.distorted_progress, distorted_episode_progress])
+        self.distorted_store.append(distorted_episode_progress)
         
         # timing
         current_time = dt.datetime.now()
@@ -207,8 +247,8 @@ class Manager():
         self.time = current_time
         
         # extract episode info
-        max_reward = self.agent.env.env.true_rewards.loc[54:114, :].sum().max()
-        max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.true_rewards.loc[54:114, :].sum()))
+        max_reward = self.agent.env.env.get_evaluation_rewards().max()
+        max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.get_evaluation_rewards()))
         true_optimal_reward = distorted_episode_progress['True optimal reward'].sum()
         true_optimal_action = distorted_episode_progress.loc[0, 'True optimal action']
         optimized_action_avg = distorted_episode_progress['Optimized action'].mean()
@@ -248,7 +288,7 @@ class Manager():
         if not os.path.exists(self.path):
             os.makedirs(self.path)
         joblib.dump(self.agent, self.path + 'agent.pkl')
-        joblib.dump(self.agent.model, self.path + 'model.pkl')
+        save_weights(self.agent.model, self.path + 'model.crm')
         joblib.dump(distorted_episode_progress, self.path + 'episode_progress.pkl')
         
         return distorted_episode_progress
@@ -261,7 +301,7 @@ class Manager():
         distorted_episode_progress = self.agent.play_one(sample_action = self.agent.policy.boltzmann_q_greedy_sample_action, visualize_learning = 2, save = True, path = path)
         
         distorted_episode_progress['episode'] = distorted_episode
-        self.distorted_progress = pd.concat([self.distorted_progress, distorted_episode_progress])
+        self.distorted_store.append(distorted_episode_progress)
         
         # timing
         current_time = dt.datetime.now()
@@ -270,8 +310,8 @@ class Manager():
         self.time = current_time
         
         # extract episode info
-        max_reward = self.agent.env.env.true_rewards.loc[54:114, :].sum().max()
-        max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.true_rewards.loc[54:114, :].sum()))
+        max_reward = self.agent.env.env.get_evaluation_rewards().max()
+        max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.get_evaluation_rewards()))
         true_optimal_reward = distorted_episode_progress['True optimal reward'].sum()
         true_optimal_action = distorted_episode_progress.loc[0, 'True optimal action']
         optimized_action_avg = distorted_episode_progress['Optimized action'].mean()
@@ -311,13 +351,13 @@ class Manager():
         if not os.path.exists(self.path):
             os.makedirs(self.path)
         joblib.dump(self.agent, self.path + 'agent.pkl')
-        joblib.dump(self.agent.model, self.path + 'model.pkl')
+        save_weights(self.agent.model, self.path + 'model.crm')
         joblib.dump(distorted_episode_progress, self.path + 'episode_progress.pkl')
         
         return distorted_episode_progress
     
-    # run training experiment
-    def train(self):
+    # run training experiment, with visualize unset the value function is not plotted and the results are not printed
+    def train(self, visualize = True):
         # run a train episode
         for train_episode in range(1, self.train_episodes):
             self.train_episode = train_episode  
@@ -325,7 +365,7 @@ class Manager():
             episode_progress['episode'] = self.train_episode
             self.run_agents.append(self.agent)
             self.run_progress.append(episode_progress)
-            self.weekly_progress = pd.concat([self.weekly_progress, episode_progress], axis = 0)
+            self.weekly_store.append(episode_progress)
             
             # timing
             current_time = dt.datetime.now()
@@ -334,8 +374,8 @@ class Manager():
             self.time = current_time
             
             # extract episode info
-            max_reward = self.agent.env.env.true_rewards.loc[54:114, :].sum().max()
-            max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.true_rewards.loc[54:114, :].sum()))
+            max_reward = self.agent.env.env.get_evaluation_rewards().max()
+            max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.get_evaluation_rewards()))
             true_optimal_reward = episode_progress['True optimal reward'].sum()
             true_optimal_action = episode_progress.loc[0, 'True optimal action']
             optimized_action_avg = episode_progress['Optimized action'].mean()
@@ -371,9 +411,10 @@ class Manager():
             self.episode += 1
             
             # visualize value function and print out episode results
-            self.agent.plot_q_values()
-            print(self.progress[self.progress['episode'] == self.train_episode][['episode', 'optimized_action_dif', 'optimal_action_dif', 'optimal_reward_dif']].rename(columns = {'optimized_action_dif' : 'Optimized action difference', 'optimal_action_dif' : 'Action difference', 'optimal_reward_dif' : 'Reward difference'}).round(0).to_string(index = False))
-            print('------------------------------------------------------------------------')
+            if visualize:
+                self.agent.plot_q_values()
+                print(self.progress[self.progress['episode'] == self.train_episode][['episode', 'optimized_action_dif', 'optimal_action_dif', 'optimal_reward_dif']].rename(columns = {'optimized_action_dif' : 'Optimized action difference', 'optimal_action_dif' : 'Action difference', 'optimal_reward_dif' : 'Reward difference'}).round(0).to_string(index = False))
+                print('------------------------------------------------------------------------')
             
             if self.train_episode in range(0, self.train_episodes, self.test_frequency):
                 # run set of test episodes
@@ -388,8 +429,8 @@ class Manager():
                     self.time = current_time
                     
                     # extract episode info
-                    max_reward = self.agent.env.env.true_rewards.loc[54:114, :].sum().max()
-                    max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.true_rewards.loc[54:114, :].sum()))
+                    max_reward = self.agent.env.env.get_evaluation_rewards().max()
+                    max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.get_evaluation_rewards()))
                     true_optimal_reward = test_episode_progress['True optimal reward'].sum()
                     true_optimal_action = test_episode_progress.loc[0, 'True optimal action']
                     optimized_action_avg = test_episode_progress['Optimized action'].mean()
@@ -425,9 +466,10 @@ class Manager():
                     self.episode += 1
                 
                 # print out test results
-                print('..............................Testing...................................')
-                print(self.progress[(self.progress['episode'] == self.train_episode) & (self.progress['test'] == 1)][['episode', 'optimized_action_dif', 'optimal_action_dif', 'optimal_reward_dif']].mean().rename({'optimized_action_dif' : 'Optimized action difference', 'optimal_action_dif' : 'Action difference', 'optimal_reward_dif' : 'Reward difference'}).round(0).to_string())
-                print('------------------------------------------------------------------------')
+                if visualize:
+                    print('..............................Testing...................................')
+                    print(self.progress[(self.progress['episode'] == self.train_episode) & (self.progress['test'] == 1)][['episode', 'optimized_action_dif', 'optimal_action_dif', 'optimal_reward_dif']].mean().rename({'optimized_action_dif' : 'Optimized action difference', 'optimal_action_dif' : 'Action difference', 'optimal_reward_dif' : 'Reward difference'}).round(0).to_string())
+                    print('------------------------------------------------------------------------')
                     
             # bookkeeping
             if self.train_episode in range(0, self.train_episodes, self.bookkeeping_frequency):
@@ -435,7 +477,7 @@ class Manager():
                 if not os.path.exists(self.path):
                     os.makedirs(self.path)
                 joblib.dump(self.agent, self.path + 'agent.pkl')
-                joblib.dump(self.agent.model, self.path + 'model.pkl')
+                save_weights(self.agent.model, self.path + 'model.crm')
                 joblib.dump(self.progress, self.path + 'progress.pkl')
                 joblib.dump(episode_progress, self.path + 'episode_progress.pkl')
                 joblib.dump(self.weekly_progress, self.path + 'weekly_progress.pkl')
@@ -473,7 +515,9 @@ class Manager():
             
             # pass distortions to the environment instance and adjust agent's parameters
             env = SimulationEnv(distortions = distortions)
-            model = joblib.load(self.bookkeeping_directory + '/bookkeeping/' + self.experiment_name + '/episode_100/model.pkl')
+            if self.archive is not None:
+                env.env.attach_archive(self.archive)
+            model = load_model(self.bookkeeping_directory + '/bookkeeping/' + self.experiment_name + '/episode_100/model.crm', env = env)
             model.set_learning_rate(lr)
             self.agent.env = env
             self.agent.model = model
@@ -482,7 +526,7 @@ class Manager():
             # run distorted episode
             distorted_episode_progress = self.agent.play_one(sample_action = self.agent.policy.boltzmann_q_greedy_sample_action)
             distorted_episode_progress['episode'] = distorted_episode
-            self.distorted_progress = pd.concat([self.distorted_progress, distorted_episode_progress])
+            self.distorted_store.append(distorted_episode_progress)
             
             # timing
             current_time = dt.datetime.now()
@@ -491,8 +535,8 @@ class Manager():
             self.time = current_time
             
             # extract episode info
-            max_reward = self.agent.env.env.true_rewards.loc[54:114, :].sum().max()
-            max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.true_rewards.loc[54:114, :].sum()))
+            max_reward = self.agent.env.env.get_evaluation_rewards().max()
+            max_action = self.agent.env.env.convert_to_real_action(np.argmax(self.agent.env.env.get_evaluation_rewards()))
             true_optimal_reward = distorted_episode_progress['True optimal reward'].sum()
             true_optimal_action = distorted_episode_progress.loc[0, 'True optimal action']
             optimized_action_avg = distorted_episode_progress['Optimized action'].mean()
@@ -537,7 +581,7 @@ class Manager():
         if not os.path.exists(self.path):
             os.makedirs(self.path)
         joblib.dump(self.agent, self.path + 'agent.pkl')
-        joblib.dump(self.agent.model, self.path + 'model.pkl')
+        save_weights(self.agent.model, self.path + 'model.crm')
         joblib.dump(self.progress, self.path + 'progress.pkl')
         joblib.dump(self.distorted_progress, self.path + 'distorted_progress.pkl')
         joblib.dump(distorted_episode_progress, self.path + 'episode_progress.pkl')
@@ -546,6 +590,9 @@ class Manager():
     
     # visualize episode results
     def plotEpisode(self, episode_progress):
+        # plotting packages are imported when a plot is requested, so that headless runs do not load them
+        import matplotlib.pyplot as plt
+        
         # plot difference between the optimized action and the true optimal action
         plt.figure(figsize = (12, 5))
         plt.plot(episode_progress['Optimized action'] - episode_progress['True optimal action'], label = 'optimized')
@@ -594,6 +641,7 @@ class Manager():
     def plotRun(self, weekly_progress = None, progress = None):
         weekly_progress = self.weekly_progress if weekly_progress is None else weekly_progress
         progress = self.progress if progress is None else progress
+        import matplotlib.pyplot as plt
         
         # plot difference between the optimized action and true optimal action
         plt.figure(figsize = (12, 5))
@@ -651,10 +699,20 @@ class Manager():
         
         plt.show()
     
+    # stress test the frozen agent over a design of distortion scenarios, from grid_design or latin_hypercube_design of the
+    # Scenarios script, a study interrupted before is continued if the agent weights did not change since it started
+    def runScenarioGrid(self, design, episodes = 1, processes = None, seed = 0):
+        directory = self.bookkeeping_directory + '/bookkeeping/' + self.experiment_name + '/scenarios'
+        weights_path = directory + '/agent.crm'
+        save_weights(self.agent.model, weights_path)
+        runner = ScenarioGridRunner(weights_path, design, episodes = episodes, directory = directory, eps = self.agent.eps, seed = seed, processes = processes).run()
+        return runner.summary()
+    
     # visualize distorted test experiment results
     def plotDistortedEpisodes(self, distorted_progress = None, progress = None):
         distorted_progress = self.distorted_progress if distorted_progress is None else distorted_progress
         progress = self.progress if progress is None else progress
+        import matplotlib.pyplot as plt
         
         # plot difference between actual weekly reward and true optimal weekly reward in distorted evnvironment
         plt.figure(figsize = (12, 5))
@@ -694,6 +752,6 @@ class Manager():
     
     # visualize value function
     def plot_q_values(self, episode = 0):
-        path = self.bookkeeping_directory + '/bookkeeping/' + self.experiment_name + '/episode_' + str(episode) + '/model.pkl'
-        model_to_plot = joblib.load(path)
+        path = self.bookkeeping_directory + '/bookkeeping/' + self.experiment_name + '/episode_' + str(episode) + '/model.crm'
+        model_to_plot = load_model(path)
         self.agent.plot_q_values(model_to_plot)
\ No newline at end of file
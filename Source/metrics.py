@@ -0,0 +1,180 @@
+'''
+MetricRegistry class keeps the state variables of the environment as a set of
+declared metrics. Every metric names the metrics it is calculated from, so only
+the metrics reachable from the requested ones (agent features, reward, loggers)
+are calculated each week, while the rest are calculated lazily on access.
+'''
+
+# import external packages
+import pandas as pd
+
+class Metric:
+    # define a metric by its name, input metrics and calculation function
+    def __init__(self, name, inputs = (), func = None):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.func = func                            # func(get, t) returns the metric value at iteration t
+
+class MetricRegistry:
+    # initialize an empty registry, factory is the (function, arguments) pair declaring its metrics if it has one
+    def __init__(self, factory = None):
+        self.factory = factory
+        self.metrics = {}                           # declared metrics in the declaration order
+        self.base = []                              # metrics recorded directly by the environment
+        self.required = []                          # metrics requested to be calculated every week
+        self.plan = []                              # required metrics and their inputs in calculation order
+        self.rows = []                              # metric values for each iteration starting from 1
+        self.frame_cache = None
+
+    # pickle the registry without the calculation functions of the metrics, they are declared again by the factory
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.factory is not None:
+            del state['metrics']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'metrics' not in state:
+            function, arguments = self.factory
+            self.metrics = function(*arguments).metrics
+
+    # declare a metric recorded directly by the environment
+    def register_base(self, name):
+        self.metrics[name] = Metric(name)
+        self.base.append(name)
+
+    # declare a metric calculated from other metrics
+    def register(self, name, inputs, func):
+        for input_name in inputs:
+            if input_name not in self.metrics:
+                raise KeyError('unknown input metric ' + input_name + ' for ' + name)
+        self.metrics[name] = Metric(name, inputs, func)
+
+    # request metrics to be calculated every week
+    def require(self, names):
+        for name in names:
+            if name not in self.metrics:
+                raise KeyError('unknown metric ' + name)
+            if name not in self.required:
+                self.required.append(name)
+        self.plan = self.resolve(self.required)
+
+    # get the metrics needed to calculate the given ones in the calculation order
+    def resolve(self, names):
+        plan = []
+        visited = set()
+
+        def visit(name):
+            if name in visited:
+                return
+            visited.add(name)
+            for input_name in self.metrics[name].inputs:
+                visit(input_name)
+            if name not in self.base:
+                plan.append(name)
+
+        for name in names:
+            visit(name)
+        return plan
+
+    # number of recorded iterations
+    @property
+    def iteration(self):
+        return len(self.rows)
+
+    # store base values of a new iteration and calculate required metrics
+    def record(self, values):
+        self.rows.append(dict(values))
+        self.frame_cache = None
+        t = self.iteration
+        row = self.rows[-1]
+        for name in self.plan:
+            row[name] = self.metrics[name].func(self.get, t)
+
+    # get metric value at iteration t, calculating it lazily if needed
+    def get(self, name, t):
+        row = self.rows[t - 1]
+        if name not in row:
+            # fill previous iterations first so that cumulative metrics do not recurse through the whole history
+            metric = self.metrics[name]
+            for i in range(1, t + 1):
+                if name not in self.rows[i - 1]:
+                    self.rows[i - 1][name] = metric.func(self.get, i)
+        return row[name]
+
+    # get a set of metric values at iteration t as a series
+    def get_row(self, t, names):
+        return pd.Series(data = [self.get(name, t) for name in names], index = names, dtype = float)
+
+    # materialize all the metrics for all the iterations as a dataframe
+    def frame(self):
+        if self.frame_cache is None:
+            names = list(self.metrics.keys())
+            data = [[self.get(name, t) for name in names] for t in range(1, self.iteration + 1)]
+            self.frame_cache = pd.DataFrame(data = data, index = range(1, self.iteration + 1), columns = names, dtype = float)
+        return self.frame_cache
+
+# divide two values returning 0 when the guard value is 0
+def ratio(numerator, denominator, guard = None):
+    guard = denominator if guard is None else guard
+    return numerator / denominator if guard != 0 else 0
+
+# build the registry of the environment state variables
+def state_metrics(window = 4):
+    registry = MetricRegistry(factory = (state_metrics, (window,)))
+
+    # weekly values recorded by the environment
+    moving_variables = ['State profit', 'State applications', 'State new applications', 'State repeat applications', 'State accepted', 'State new accepted', 'State repeat accepted', 'State defaulted', 'State paid', 'State defaulted paid']
+    for name in moving_variables:
+        registry.register_base(name)
+
+    # cumulative values
+    def total(state_name):
+        total_name = state_name.replace('State', 'Total')
+        return lambda get, t: get(state_name, t) + (get(total_name, t - 1) if t > 1 else 0)
+
+    for name in moving_variables:
+        registry.register(name.replace('State', 'Total'), [name], total(name))
+
+    # shares and rates
+    registry.register('Total repeat applications share', ['Total repeat applications', 'Total applications'], lambda get, t: ratio(get('Total repeat applications', t), get('Total applications', t)))
+    registry.register('State repeat applications share', ['State repeat applications', 'State applications'], lambda get, t: ratio(get('State repeat applications', t), get('State applications', t)))
+    registry.register('State acceptance rate', ['State accepted', 'State applications'], lambda get, t: ratio(get('State accepted', t), get('State applications', t), get('State accepted', t)))
+    registry.register('Total acceptance rate', ['Total accepted', 'Total applications'], lambda get, t: ratio(get('Total accepted', t), get('Total applications', t), get('Total accepted', t)))
+    registry.register('State profit per loan', ['State profit', 'State accepted'], lambda get, t: ratio(get('State profit', t), get('State accepted', t)))
+    registry.register('Total profit per loan', ['Total profit', 'Total accepted'], lambda get, t: ratio(get('Total profit', t), get('Total accepted', t)))
+    registry.register('State new acceptance rate', ['State new accepted', 'State new applications'], lambda get, t: ratio(get('State new accepted', t), get('State new applications', t)))
+    registry.register('Total new acceptance rate', ['Total new accepted', 'Total new applications'], lambda get, t: ratio(get('Total new accepted', t), get('Total new applications', t)))
+    registry.register('State repeat acceptance rate', ['State repeat accepted', 'State repeat applications'], lambda get, t: ratio(get('State repeat accepted', t), get('State repeat applications', t)))
+    registry.register('Total repeat acceptance rate', ['Total repeat accepted', 'Total repeat applications'], lambda get, t: ratio(get('Total repeat accepted', t), get('Total repeat applications', t)))
+    registry.register('Total repeat loans share', ['Total repeat accepted', 'Total accepted'], lambda get, t: ratio(get('Total repeat accepted', t), get('Total accepted', t)))
+    registry.register('State repeat loans share', ['State repeat accepted', 'State accepted'], lambda get, t: ratio(get('State repeat accepted', t), get('State accepted', t)))
+    registry.register('State default rate', ['State defaulted', 'State accepted'], lambda get, t: ratio(get('State defaulted', t), get('State accepted', t)))
+    registry.register('Total default rate', ['Total defaulted', 'Total accepted'], lambda get, t: ratio(get('Total defaulted', t), get('Total accepted', t)))
+    registry.register('State paid rate', ['State paid', 'State accepted'], lambda get, t: ratio(get('State paid', t), get('State accepted', t)))
+    registry.register('total paid rate', ['Total paid', 'Total accepted'], lambda get, t: ratio(get('Total paid', t), get('Total accepted', t)))
+    registry.register('State defaulted paid rate', ['State defaulted paid', 'State accepted'], lambda get, t: ratio(get('State defaulted paid', t), get('State accepted', t)))
+    registry.register('total defaulted paid rate', ['Total defaulted paid', 'Total accepted'], lambda get, t: ratio(get('Total defaulted paid', t), get('Total accepted', t)))
+    registry.register('State defaulted to paid ratio', ['State defaulted', 'State paid', 'State accepted'], lambda get, t: ratio(get('State defaulted', t), get('State paid', t)) if get('State accepted', t) != 0 else 0)
+    registry.register('total defaulted to paid ratio', ['Total defaulted', 'Total paid'], lambda get, t: ratio(get('Total defaulted', t), get('Total paid', t)))
+
+    # moving sums over the window, zero during the first weeks
+    def moving(state_name):
+        return lambda get, t: sum(get(state_name, i) for i in range(t - window, t + 1)) if t > window else 0
+
+    for name in moving_variables:
+        registry.register(name.replace('State', 'Moving'), [name], moving(name))
+
+    # moving ratios
+    registry.register('Moving repeat applications share', ['Moving repeat applications', 'Moving applications'], lambda get, t: ratio(get('Moving repeat applications', t), get('Moving applications', t)))
+    registry.register('Moving repeat loans share', ['Moving repeat accepted', 'Moving accepted'], lambda get, t: ratio(get('Moving repeat accepted', t), get('Moving accepted', t)))
+    registry.register('Moving acceptance rate', ['Moving accepted', 'Moving applications'], lambda get, t: ratio(get('Moving accepted', t), get('Moving applications', t)))
+    registry.register('Moving acceptance rate squared', ['Moving acceptance rate'], lambda get, t: get('Moving acceptance rate', t) ** 2)
+    registry.register('Moving default rate', ['Moving defaulted', 'Moving accepted'], lambda get, t: ratio(get('Moving defaulted', t), get('Moving accepted', t)))
+    registry.register('Moving paid rate', ['Moving paid', 'Moving accepted'], lambda get, t: ratio(get('Moving paid', t), get('Moving accepted', t)))
+    registry.register('Moving defaulted paid rate', ['Moving defaulted paid', 'Moving accepted'], lambda get, t: ratio(get('Moving defaulted paid', t), get('Moving accepted', t)))
+    registry.register('Moving profit per loan', ['Moving profit', 'Moving accepted'], lambda get, t: ratio(get('Moving profit', t), get('Moving accepted', t)))
+    registry.register('Moving defaulted to paid ratio', ['Moving defaulted', 'Moving paid'], lambda get, t: ratio(get('Moving defaulted', t), get('Moving paid', t)))
+
+    return registry
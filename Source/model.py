@@ -1,23 +1,50 @@
 '''
 FeatureTransformer class provides functionality to transform a state object into
-a set of features using the Gausian Radial Basis Functions transformation.
+a set of features using the Gausian Radial Basis Functions transformation. The
+features of recent observations are kept in a bounded LRU cache, and those of a
+grid of observations can be precomputed into a lookup table.
 Model class incorporates the value function model providing functionality to
-predict action values and update model parameters.
+predict action values and update model parameters. The values of all the actions
+are a linear function of the features, stored as one features x actions weight
+matrix and updated in place with the SGD step and learning rate schedules of
+sklearn's SGDRegressor.
+TileCoder class is an alternative featurizer that covers the observation space
+with offset tilings and hashes the tiles into a fixed memory, so that a state
+activates one feature in each tiling whatever the number of state features.
+TileModel class is the value function model on tile coded features, its
+predictions and updates touch only the weights of the active features.
 EnvironmentModel class provides the functionality for the environment model,
 able to predict following states based on actions.
 '''
 
 # import external packages
 import os
+import itertools
 import numpy as np
-from sklearn.pipeline import FeatureUnion
-from sklearn.preprocessing import StandardScaler
-from sklearn.kernel_approximation import RBFSampler
-from sklearn.linear_model import SGDRegressor
-import joblib
+from collections import OrderedDict
+from scipy.linalg import solve_triangular
+from scipy.sparse import csr_matrix
+
+# version of the saved featurizer parameters, featurizers saved with another version are fitted again
+FEATURIZER_VERSION = 1
+
+# versions of the model weights are drawn from one counter, so that a model loaded or unpickled in place never gets back a version
+# its predictions were cached for
+weight_versions = itertools.count(1)
 
 class FeatureTransformer:
-    def __init__(self, env):
+    # fit the transformation, featurized observations are kept in an LRU cache of cache_size entries,
+    # with resolution set the observations are rounded to its multiples before they are featurized,
+    # with path set the parameters saved there are loaded instead of fitted, or saved there after fitting
+    def __init__(self, env, cache_size = 1024, resolution = None, path = None):
+        self.init_cache(cache_size, resolution)
+        if path is not None and self.load_parameters(path, env):
+            return
+        
+        # sklearn is imported only to fit a featurizer, loading a saved one does not need it
+        from sklearn.pipeline import FeatureUnion
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.kernel_approximation import RBFSampler
         observation_examples = np.array([env.observation_space.sample() for x in range(10000)])
         scaler = StandardScaler()
         scaler.fit(observation_examples)
@@ -33,88 +60,429 @@ class FeatureTransformer:
         self.dimensions = example_features.shape[1]
         self.scaler = scaler
         self.featurizer = featurizer
-        
+        self.extract_parameters()
+        if path is not None:
+            self.save_parameters(path, env)
+    
+    # take the fitted parameters of the scaler and the RBF samplers, so that a transformation is one matrix product
+    def extract_parameters(self):
+        samplers = [sampler for name, sampler in self.featurizer.transformer_list]
+        self.mean = self.scaler.mean_
+        self.scale = self.scaler.scale_
+        self.projection = np.hstack([sampler.random_weights_ for sampler in samplers])
+        self.offset = np.hstack([sampler.random_offset_ for sampler in samplers])
+        self.factor = np.hstack([np.full(sampler.n_components, np.sqrt(2.0) / np.sqrt(sampler.n_components)) for sampler in samplers])
+    
+    # parameters of the transformation as arrays for storage
+    def to_arrays(self):
+        return {'mean': self.mean, 'scale': self.scale, 'projection': self.projection, 'offset': self.offset, 'factor': self.factor}
+    
+    # restore a transformation stored with to_arrays without fitting it
+    @classmethod
+    def from_arrays(cls, arrays, cache_size = 1024, resolution = None):
+        ft = cls.__new__(cls)
+        ft.init_cache(cache_size, resolution)
+        for name in ['mean', 'scale', 'projection', 'offset', 'factor']:
+            setattr(ft, name, arrays[name])
+        ft.dimensions = ft.projection.shape[1]
+        return ft
+    
+    # save the parameters of the transformation with the observation space they were fitted on
+    def save_parameters(self, path, env):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # write to a temporary file first so that concurrent readers never see a partially written file
+        with open(path + '.tmp', 'wb') as parameters_file:
+            np.savez(parameters_file, version = FEATURIZER_VERSION, low = env.observation_space.low, high = env.observation_space.high,
+                     mean = self.mean, scale = self.scale, projection = self.projection, offset = self.offset, factor = self.factor)
+        os.replace(path + '.tmp', path)
+    
+    # load saved parameters of the transformation, False if they are missing or do not match the version or the observation space
+    def load_parameters(self, path, env):
+        if not os.path.isfile(path):
+            return False
+        with np.load(path, allow_pickle = False) as parameters:
+            if int(parameters['version']) != FEATURIZER_VERSION:
+                return False
+            if not (np.array_equal(parameters['low'], env.observation_space.low) and np.array_equal(parameters['high'], env.observation_space.high)):
+                return False
+            for name in ['mean', 'scale', 'projection', 'offset', 'factor']:
+                setattr(self, name, parameters[name])
+        self.dimensions = self.projection.shape[1]
+        return True
+    
+    # empty the featurization cache and the lookup table
+    def init_cache(self, cache_size = 1024, resolution = None):
+        self.cache_size = cache_size                # maximum number of cached observations, 0 disables the cache
+        self.resolution = resolution
+        self.cache = OrderedDict()                  # features of each observation, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.table = None                           # features of each observation on the lookup table grid
+        self.table_low = None
+        self.table_step = None
+        self.table_hits = 0
+    
+    # save the transformation without the cached features
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ['cache', 'table']:
+            state.pop(name, None)
+        return state
+    
+    # restore a pickled instance, instances saved before the parameters were extracted get them on load
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'projection' not in state:
+            self.extract_parameters()
+        self.init_cache(state.get('cache_size', 1024), state.get('resolution'))
+    
+    # precompute the features of a grid of single-value observations, observations on the grid are then looked up
+    def precompute(self, step = 0.001, low = 0, high = 1):
+        if len(self.mean) != 1:
+            raise ValueError('a lookup table requires single-value observations, got ' + str(len(self.mean)))
+        points = low + step * np.arange(int(round((high - low) / step)) + 1)
+        self.table = self.compute(points.reshape(-1, 1))
+        self.table_low = low
+        self.table_step = step
+    
+    # features of observations without the cache, a row for each observation
+    def compute(self, observations):
+        return np.cos(((observations - self.mean) / self.scale) @ self.projection + self.offset) * self.factor
+    
+    # row of the lookup table of an observation on the table grid, None otherwise
+    def table_row(self, observation):
+        if self.table is None or len(observation) != 1:
+            return None
+        position = (observation[0] - self.table_low) / self.table_step
+        row = int(round(position)) if np.isfinite(position) else -1
+        if row < 0 or row >= len(self.table) or abs(position - row) > 1e-9:
+            return None
+        return row
+    
+    # features of an observation from the lookup table or the cache, computed and cached on a miss
+    def lookup(self, observation):
+        row = self.table_row(observation)
+        if row is not None:
+            self.table_hits += 1
+            return self.table[row]
+        key = observation.tobytes()
+        features = self.cache.get(key)
+        if features is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return features
+        self.misses += 1
+        features = self.compute(observation.reshape(1, -1))[0]
+        if self.cache_size > 0:
+            self.cache[key] = features
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last = False)
+        return features
+    
+    # observations as a float array with a row for each observation, rounded to the resolution
+    def quantize(self, observations, rows):
+        observations = np.array(observations, dtype = float).reshape(rows, -1)
+        if self.resolution is not None:
+            observations = np.round(observations / self.resolution) * self.resolution
+        return observations
+    
     def transform(self, observations):
-        scaled = self.scaler.transform(np.array(observations).reshape(1, -1))
-        return self.featurizer.transform(scaled)
+        observation = self.quantize(observations, 1)[0]
+        return self.lookup(observation).reshape(1, -1).copy()
+    
+    # transform a batch of observations, a row for each observation, each distinct observation is featurized once
+    def transform_batch(self, observations):
+        observations = self.quantize(observations, len(observations))
+        if len(observations) == 0:
+            return np.zeros((0, self.dimensions))
+        distinct, inverse = np.unique(observations, axis = 0, return_inverse = True)
+        features = np.array([self.lookup(observation) for observation in distinct])
+        return features[inverse.reshape(-1)]
+    
+    # cache statistics
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'table hits': self.table_hits, 'size': len(self.cache), 'max size': self.cache_size}
 
 class Model:
-    # initialize value function model as a set of SGD regressors for each action
-    def __init__(self, env, feature_transformer, learning_rate):
+    # initialize value function model as a linear model of the features for each action
+    def __init__(self, env, feature_transformer, learning_rate, power_t = 0.25):
         self.env = env
-        self.models = []
         self.feature_transformer = feature_transformer
         self.learning_rate = learning_rate
-        for i in range(env.action_space.n):
-          #model = SGDRegressor(learning_rate='constant', eta0 = self.learning_rate)
-          model = SGDRegressor(alpha = 0, l1_ratio = 0, max_iter = 1, shuffle = False, epsilon = 0, learning_rate = 'invscaling', eta0 = self.learning_rate, power_t = 0.25)
-          model.partial_fit(feature_transformer.transform( env.observation_space.sample() ), [0])
-          self.models.append(model)
+        self.schedule = 'invscaling'                                            # eta = learning_rate / t ** power_t, or 'constant'
+        self.power_t = power_t
+        actions = env.action_space.n
+        self.weights = np.zeros((feature_transformer.dimensions, actions))     # a column of feature weights for each action
+        self.intercepts = np.zeros(actions)
+        # number of updates of each action plus one, counted from 2 as the regressors were initialized with a fit to a zero target
+        self.t = np.full(actions, 2.0)
+        self.new_version()                                                     # cached predictions are valid for one version of the weights
+    
+    # restore a pickled instance with a new version of its weights
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # models pickled before the weight matrix was introduced hold an SGD regressor for each action
+        if 'models' in self.__dict__:
+            regressors = self.__dict__.pop('models')
+            self.weights = np.array([regressor.coef_ for regressor in regressors], dtype = float).T
+            self.intercepts = np.array([regressor.intercept_[0] for regressor in regressors], dtype = float)
+            self.t = np.array([regressor.t_ for regressor in regressors], dtype = float)
+            self.schedule = regressors[0].learning_rate
+            self.power_t = regressors[0].power_t
+        self.new_version()
+    
+    # mark the weights as changed, predictions cached for the earlier versions are not valid anymore
+    def new_version(self):
+        self.version = next(weight_versions)
     
     # reset the learning rate of the value function model
     def set_learning_rate(self, learning_rate):
         self.learning_rate = learning_rate
-        for model in self.models:
-            model.eta0 = self.learning_rate
-            model.t_ = 2.0
-            model.learning_rate = 'constant'
+        self.t[:] = 2.0
+        self.schedule = 'constant'
+    
+    # learning rate of the next update of an action
+    def step_size(self, a):
+        if self.schedule == 'constant':
+            return self.learning_rate
+        return self.learning_rate / self.t[a]**self.power_t
+    
+    # learning rates of the next updates of an action
+    def step_sizes(self, a, updates):
+        if self.schedule == 'constant':
+            return np.full(updates, float(self.learning_rate))
+        return self.learning_rate / (self.t[a] + np.arange(updates))**self.power_t
     
     # predict action values for a state
     def predict(self, s):
         X = self.feature_transformer.transform([s])
         assert(len(X.shape) == 2)
-        return np.array([m.predict(np.array(X, dtype=np.float32))[0] for m in self.models])
+        return (X @ self.weights + self.intercepts)[0]
     
-    # perform SGD update
+    # perform SGD update of the squared error of the action value
     def update(self, s, a, G):
         X = self.feature_transformer.transform([s])
         assert(len(X.shape) == 2)
-        self.models[a].partial_fit(np.array(X, dtype=np.float32), np.array([G], dtype=np.float32))
+        x = X[0]
+        error = np.clip(x @ self.weights[:, a] + self.intercepts[a] - G, -1e12, 1e12)
+        step = -self.step_size(a) * error
+        self.weights[:, a] += step * x
+        self.intercepts[a] += step
+        self.t[a] += 1
+        self.new_version()
+    
+    # predict action values for a batch of states, a row for each state
+    def predict_batch(self, states):
+        return self.feature_transformer.transform_batch(states) @ self.weights + self.intercepts
+    
+    # perform SGD updates for a batch of (state, action, target) transitions at once, with the same result as updating them one by one
+    def update_batch(self, states, actions, targets):
+        actions = np.asarray(actions, dtype = int)
+        targets = np.asarray(targets, dtype = float)
+        if len(actions) == 0:
+            return
+        X = self.feature_transformer.transform_batch(states)
         
-    # save model instance to a file
+        for a in np.unique(actions):
+            group = np.flatnonzero(actions == a)
+            X_group = X[group]
+            step_sizes = self.step_sizes(a, len(group))
+            # the error of each transition depends on the steps of the earlier ones through the products of their features:
+            # error_k = initial_error_k - sum_j<k step_size_j * error_j * (x_k . x_j + 1), a lower triangular system
+            initial_errors = X_group @ self.weights[:, a] + self.intercepts[a] - targets[group]
+            influence = np.tril(X_group @ X_group.T + 1, -1) * step_sizes[None, :] + np.eye(len(group))
+            errors = solve_triangular(influence, initial_errors, lower = True, unit_diagonal = True, check_finite = False)
+            steps = -step_sizes * errors
+            self.weights[:, a] += X_group.T @ steps
+            self.intercepts[a] += steps.sum()
+            self.t[a] += len(group)
+        self.new_version()
+    
+    # value function parameters as arrays for storage
+    def to_arrays(self):
+        return {'weights': self.weights, 'intercepts': self.intercepts, 't': self.t}
+    
+    # restore a model stored with to_arrays on a feature transformer, the arrays may be memory-mapped
+    @classmethod
+    def from_arrays(cls, arrays, feature_transformer, learning_rate, schedule = 'invscaling', power_t = 0.25, env = None):
+        model = cls.__new__(cls)
+        model.env = env
+        model.feature_transformer = feature_transformer
+        model.learning_rate = learning_rate
+        model.schedule = schedule
+        model.power_t = power_t
+        model.weights = arrays['weights']
+        model.intercepts = arrays['intercepts']
+        model.t = arrays['t']
+        model.new_version()
+        return model
+    
+    # save the featurizer parameters and the value weights of the model to a weights file with the .crm extension
     def save(self, path = '/model_dump'):
+        # imported here as the weights module imports the model classes
+        from weights import save_weights
         wd = os.getcwd().replace('\\', '/')
         path = path if wd in path else wd + path
-        if not os.path.exists(path.replace('.pkl', '')):
-            os.makedirs(path)
-        path = path if '.pkl' in path else path + '.pkl'
-        '''    
-        for model_index in range(len(self.models)):
-            file_name = path + '/model_' + str(model_index) + '.pkl'
-            joblib.dump(self.models[model_index], file_name)
-        file_name = path + '/feature_transformer.pkl'
-        joblib.dump(self.feature_transformer, file_name)
-        '''
-        joblib.dump(self, path)
-    
-    # load model instance from a file
+        path = path[:-len('.pkl')] if path.endswith('.pkl') else path
+        save_weights(self, path if path.endswith('.crm') else path + '.crm')
+    
+    # load model from a weights file, or from a model pickled by earlier versions
     def load(self, path = '/model_dump'):
+        from weights import load_model
         wd = os.getcwd().replace('\\', '/')
         path = path if wd in path else wd + path
-        path = path if '.pkl' in path else path + '.pkl'
-        if not os.path.exists(path):
+        base = path[:-len('.crm')] if path.endswith('.crm') else path[:-len('.pkl')] if path.endswith('.pkl') else path
+        if not os.path.exists(base + '.crm') and not os.path.exists(base + '.pkl'):
             print('the path doesn\'t exist')
-        '''    
-        for model_index in range(len(self.models)):
-            file_name = path + '/model_' + str(model_index) + '.pkl'
-            self.models[model_index] = joblib.load(file_name)
-        file_name = path + '/feature_transformer.pkl'
-        self.feature_transformer = joblib.load(file_name)
-        '''
-        model = joblib.load(path)
+        model = load_model(base + '.crm', env = self.env)
         self.__dict__.update(model.__dict__)
+        self.new_version()
+        
+class TileCoder:
+    # define tilings over the observation space, the tiles of all the tilings are hashed into memory features
+    def __init__(self, env, tilings = 8, tiles = 10, memory = 4096, seed = 0):
+        self.low = np.array(env.observation_space.low, dtype = float)
+        self.high = np.array(env.observation_space.high, dtype = float)
+        self.tilings = tilings
+        self.tiles = tiles                          # tiles per dimension of the observation space in each tiling
+        self.dimensions = memory
+        self.value = 1 / np.sqrt(tilings)           # value of an active feature, so that a state has a unit feature vector
+        # tilings are displaced by asymmetric offsets, a fraction of a tile in each dimension
+        width = len(self.low)
+        self.offsets = (np.arange(tilings)[:, None] * (2 * np.arange(width)[None, :] + 1) / tilings) % 1
+        self.multipliers = np.random.RandomState(seed).randint(1, 2**62, size = width + 1, dtype = np.int64).view(np.uint64) | np.uint64(1)
+    
+    # hashed indices of the active features of observations, a row of an index for each tiling for each observation
+    def active(self, observations):
+        observations = np.array(observations, dtype = float).reshape(len(observations), -1)
+        scaled = (observations - self.low) / (self.high - self.low) * self.tiles
+        coordinates = np.floor(scaled[:, None, :] + self.offsets[None, :, :]).astype(np.int64).view(np.uint64)
+        keys = (np.arange(self.tilings, dtype = np.uint64) + np.uint64(1)) * self.multipliers[0]
+        keys = keys[None, :] ^ (coordinates * self.multipliers[1:]).sum(axis = 2)
+        # mix the bits of the keys before reducing them to the memory size
+        keys ^= keys >> np.uint64(31)
+        keys *= np.uint64(0xBF58476D1CE4E5B9)
+        keys ^= keys >> np.uint64(27)
+        return (keys % np.uint64(self.dimensions)).astype(np.intp)
+    
+    # parameters of the tilings as arrays for storage
+    def to_arrays(self):
+        return {'low': self.low, 'high': self.high, 'offsets': self.offsets, 'multipliers': self.multipliers}
+    
+    # restore tilings stored with to_arrays
+    @classmethod
+    def from_arrays(cls, arrays, tiles = 10, memory = 4096):
+        tile_coder = cls.__new__(cls)
+        for name in ['low', 'high', 'offsets', 'multipliers']:
+            setattr(tile_coder, name, arrays[name])
+        tile_coder.tilings = tile_coder.offsets.shape[0]
+        tile_coder.tiles = tiles
+        tile_coder.dimensions = memory
+        tile_coder.value = 1 / np.sqrt(tile_coder.tilings)
+        return tile_coder
+    
+    def transform(self, observations):
+        return self.transform_batch(np.array(observations, dtype = float).reshape(1, -1))
+    
+    # dense features of a batch of observations, a row for each observation
+    def transform_batch(self, observations):
+        active = self.active(observations)
+        features = np.zeros((len(active), self.dimensions))
+        np.add.at(features, (np.repeat(np.arange(len(active)), self.tilings), active.ravel()), self.value)
+        return features
+
+class TileModel(Model):
+    # np.add.at does not check that its output is writeable, weights mapped read-only from a file must not be updated
+    def check_writeable(self):
+        if not self.weights.flags.writeable:
+            raise ValueError('the weights are read-only, load them with mmap_mode \'c\' to update them')
+    
+    # predict action values for a state
+    def predict(self, s):
+        active = self.feature_transformer.active(np.array(s, dtype = float).reshape(1, -1))[0]
+        return self.weights[active].sum(axis = 0) * self.feature_transformer.value + self.intercepts
+    
+    # perform SGD update of the squared error of the action value
+    def update(self, s, a, G):
+        active = self.feature_transformer.active(np.array(s, dtype = float).reshape(1, -1))[0]
+        value = self.feature_transformer.value
+        error = np.clip(self.weights[active, a].sum() * value + self.intercepts[a] - G, -1e12, 1e12)
+        step = -self.step_size(a) * error
+        self.check_writeable()
+        np.add.at(self.weights[:, a], active, step * value)
+        self.intercepts[a] += step
+        self.t[a] += 1
+        self.new_version()
+    
+    # predict action values for a batch of states, a row for each state
+    def predict_batch(self, states):
+        active = self.feature_transformer.active(states)
+        return self.weights[active].sum(axis = 1) * self.feature_transformer.value + self.intercepts
+    
+    # perform SGD updates for a batch of (state, action, target) transitions at once, with the same result as updating them one by one
+    def update_batch(self, states, actions, targets):
+        actions = np.asarray(actions, dtype = int)
+        targets = np.asarray(targets, dtype = float)
+        if len(actions) == 0:
+            return
+        self.check_writeable()
+        active = self.feature_transformer.active(states)
+        value = self.feature_transformer.value
+        tilings = active.shape[1]
         
+        for a in np.unique(actions):
+            group = np.flatnonzero(actions == a)
+            active_group = active[group]
+            step_sizes = self.step_sizes(a, len(group))
+            # products of the sparse feature vectors of the transitions, see Model.update_batch for the triangular system
+            X_group = csr_matrix((np.full(active_group.size, value), active_group.ravel(), np.arange(0, active_group.size + 1, tilings)), shape = (len(group), self.feature_transformer.dimensions))
+            initial_errors = self.weights[active_group, a].sum(axis = 1) * value + self.intercepts[a] - targets[group]
+            influence = np.tril((X_group @ X_group.T).toarray() + 1, -1) * step_sizes[None, :] + np.eye(len(group))
+            errors = solve_triangular(influence, initial_errors, lower = True, unit_diagonal = True, check_finite = False)
+            steps = -step_sizes * errors
+            np.add.at(self.weights[:, a], active_group.ravel(), np.repeat(steps, tilings) * value)
+            self.intercepts[a] += steps.sum()
+            self.t[a] += len(group)
+        self.new_version()
+
 class EnvironmentModel:
-    # initialize environment model as an SGD regressor
-    def __init__(self, env, learning_rate):
+    # initialize environment model as a linear model of the next state and of the reward on the previous state for each action,
+    # the weight of a transition decays by the learning rate with every week of its age, so that the model adapts to changes
+    def __init__(self, env, learning_rate, ridge = 1e-6):
         self.env = env
-        self.model = SGDRegressor(learning_rate='constant', eta0 = learning_rate)
-        self.model.partial_fit(np.array(env.action_space.sample()).reshape(1, -1), [0])
+        self.learning_rate = learning_rate
+        self.ridge = ridge
+        actions = env.action_space.n
+        width = env.observation_space.shape[0]
+        self.state_coefficients = np.zeros((actions, width + 1, width))    # intercept and slopes of the next state for each action
+        self.reward_coefficients = np.zeros((actions, width + 1))          # intercept and slopes of the reward for each action
+        self.fitted = np.zeros(actions, dtype = bool)                       # actions with observed transitions
     
-    # predict next state based on the action
-    def predict(self, a):
-        return self.model.predict(np.array(a, dtype=np.float32).reshape(1, -1))[0]
+    # fit the model by weighted least squares to (previous state, action, state, reward) transitions observed the given weeks ago
+    def fit(self, prev_states, actions, states, rewards, ages = None):
+        prev_states = np.asarray(prev_states, dtype = float).reshape(len(actions), -1)
+        states = np.asarray(states, dtype = float).reshape(len(actions), -1)
+        rewards = np.asarray(rewards, dtype = float)
+        actions = np.asarray(actions, dtype = int)
+        weights = np.ones(len(actions)) if ages is None else (1 - self.learning_rate)**np.asarray(ages, dtype = float)
+        X = np.hstack([np.ones((len(actions), 1)), prev_states])
+        regularization = self.ridge * np.eye(X.shape[1])
+        
+        self.fitted[:] = False
+        for a in np.unique(actions):
+            rows = actions == a
+            X_weighted = X[rows] * weights[rows, None]
+            coefficients = np.linalg.solve(X_weighted.T @ X[rows] + regularization, X_weighted.T @ np.hstack([states[rows], rewards[rows, None]]))
+            self.state_coefficients[a] = coefficients[:, :-1]
+            self.reward_coefficients[a] = coefficients[:, -1]
+            self.fitted[a] = True
     
-    # perform SGD update
-    def update(self, a, s):
-        self.model.partial_fit(np.array(a, dtype=np.float32).reshape(1, -1), [s])
\ No newline at end of file
+    # predict the next states and the rewards of taking actions in previous states, a row for each (previous state, action) pair
+    def predict_batch(self, prev_states, actions):
+        actions = np.asarray(actions, dtype = int)
+        X = np.hstack([np.ones((len(actions), 1)), np.asarray(prev_states, dtype = float).reshape(len(actions), -1)])
+        states = np.einsum('nd,ndk->nk', X, self.state_coefficients[actions])
+        rewards = np.einsum('nd,nd->n', X, self.reward_coefficients[actions])
+        return states, rewards
\ No newline at end of file
@@ -0,0 +1,123 @@
+'''
+MonteCarloRunner class runs a study of many independent episodes over a pool of
+worker processes. Each episode has its own seed, so the results do not depend
+on the number of processes or the order the episodes finish in. The workers
+write the total reward of every action over the evaluation window of their
+episodes into an array in shared memory, and the runner reports the
+distribution of the optimal action with bootstrap confidence intervals while
+the results arrive.
+'''
+
+# import external packages
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+# import internal classes
+from cache import spawn_seeds
+
+# environment and shared result array of a worker process, set up once per process
+worker = {}
+
+# create the environment of a worker process and attach it to the shared result array
+def init_worker(environment_class, config, memory_name, shape):
+    worker['env'] = environment_class(**config)
+    worker['memory'] = shared_memory.SharedMemory(name = memory_name)
+    worker['totals'] = np.ndarray(shape, dtype = float, buffer = worker['memory'].buf)
+
+# run an episode and write the total reward of each action over the reward window to its row of the shared array
+def run_episode(episode, seed):
+    env = worker['env']
+    np.random.seed(seed)
+    env.run_iterations(output = False)
+    worker['totals'][episode] = env.true_rewards.loc[env.episode.reward_start:env.episode.reward_end, :].sum().values
+    return episode
+
+class MonteCarloRunner:
+    # define a study of a number of episodes of an environment built from its class and configuration
+    def __init__(self, environment_class, config, episodes, seed = 0, processes = None, report_every = 10):
+        self.environment_class = environment_class
+        # the agent's reward predictions are not needed for true rewards
+        self.config = dict(config, cheating = True)
+        self.episodes = episodes
+        self.seeds = spawn_seeds(seed, episodes)    # independent seed of each episode
+        self.processes = processes
+        self.report_every = report_every
+        self.totals = None                          # total reward of each action in each episode
+        self.finished = np.zeros(episodes, dtype = bool)
+
+    # run all the episodes, report(runner) is called every report_every finished episodes
+    def run(self, report = None):
+        report = self.print_report if report is None else report
+        actions = len(self.environment_class(**self.config).action_set)
+        shape = (self.episodes, actions)
+
+        if self.processes == 1:
+            worker['env'] = self.environment_class(**self.config)
+            worker['totals'] = self.totals = np.zeros(shape)
+            try:
+                for episode, seed in enumerate(self.seeds):
+                    self.finish(run_episode(episode, seed), report)
+            finally:
+                # the environment of the serial run is released with it, as the pool releases those of its workers
+                worker.clear()
+            return self
+
+        memory = shared_memory.SharedMemory(create = True, size = max(int(np.prod(shape)) * 8, 1))
+        try:
+            self.totals = np.ndarray(shape, dtype = float, buffer = memory.buf)
+            self.totals[:] = 0
+            with ProcessPoolExecutor(max_workers = self.processes, initializer = init_worker, initargs = (self.environment_class, self.config, memory.name, shape)) as executor:
+                futures = [executor.submit(run_episode, episode, seed) for episode, seed in enumerate(self.seeds)]
+                for future in as_completed(futures):
+                    self.finish(future.result(), report)
+            self.totals = self.totals.copy()
+        except BaseException:
+            self.totals = None
+            raise
+        finally:
+            # the shared array must not be referenced when the memory is released
+            memory.close()
+            memory.unlink()
+        return self
+
+    # mark an episode finished and report the intermediate results
+    def finish(self, episode, report):
+        self.finished[episode] = True
+        if self.finished.sum() % self.report_every == 0 or self.finished.all():
+            report(self)
+
+    # optimal action and its total reward for each finished episode
+    def optimal_distribution(self):
+        episodes = np.flatnonzero(self.finished)
+        totals = self.totals[episodes]
+        return pd.DataFrame(data = {'Optimal threshold': totals.argmax(axis = 1).astype(float), 'Optimal profit': totals.max(axis = 1)}, index = episodes)
+
+    # share of finished episodes each action is optimal in, with bootstrap confidence intervals
+    def bootstrap(self, samples = 1000, confidence = 0.95, seed = 0):
+        optimal = self.totals[self.finished].argmax(axis = 1)
+        actions = self.totals.shape[1]
+        if len(optimal) == 0:
+            return pd.DataFrame(data = np.nan, index = range(actions), columns = ['Share', 'Lower', 'Upper'])
+        # count optimal actions in each resample of episodes at once
+        resamples = optimal[np.random.default_rng(seed).integers(len(optimal), size = (samples, len(optimal)))]
+        counts = np.bincount((resamples + np.arange(samples)[:, None] * actions).ravel(), minlength = samples * actions).reshape(samples, actions)
+        shares = counts / len(optimal)
+        tail = (1 - confidence) / 2 * 100
+        return pd.DataFrame(data = {'Share': np.bincount(optimal, minlength = actions) / len(optimal),
+                                    'Lower': np.percentile(shares, tail, axis = 0), 'Upper': np.percentile(shares, 100 - tail, axis = 0)})
+
+    # bootstrap confidence interval of the mean optimal action
+    def mean_interval(self, samples = 1000, confidence = 0.95, seed = 0):
+        optimal = self.totals[self.finished].argmax(axis = 1)
+        if len(optimal) == 0:
+            return np.nan, np.nan, np.nan
+        means = optimal[np.random.default_rng(seed).integers(len(optimal), size = (samples, len(optimal)))].mean(axis = 1)
+        tail = (1 - confidence) / 2 * 100
+        return optimal.mean(), np.percentile(means, tail), np.percentile(means, 100 - tail)
+
+    # print the number of finished episodes and the mean optimal action with its confidence interval
+    def print_report(self, runner):
+        mean, lower, upper = self.mean_interval()
+        print('episodes: {}/{}, mean optimal action {:.2f} [{:.2f}, {:.2f}]'.format(self.finished.sum(), self.episodes, mean, lower, upper), end = "\r")
@@ -1,78 +1,110 @@
 '''
 Policy class provides a choice of action sample policies for the RL agent,
 including greedy, epsilon-greedy, random, default, boltzmann-Q and derivatives.
+PolicyEngine class samples the actions of a batch of states at once from their
+precomputed Q-values, a row for each state and a column for each action. Ties
+of the greedy actions are broken at random for the whole batch and boltzmann-Q
+actions are sampled with the Gumbel-max trick, taking the action with the
+highest Q-value logit perturbed by Gumbel noise. The samplers of the Policy
+class predict the Q-values of their state once and pass them to the engine.
 '''
 
 # import external packages
 import numpy as np
-import matplotlib.pyplot as plt
 
-# import internal classes
-from utils import argmax
+class PolicyEngine():
+    # Q-values of a batch of states predicted once by each model, the values of a target model are averaged in
+    def q_matrix(self, model, states, target_model = None):
+        states = np.asarray(states, dtype = float)
+        # a single state takes the cached path of the models
+        if states.ndim < 2 or len(states) == 1:
+            state = states.reshape(-1)
+            q_values = model.predict(state) if target_model is None else (model.predict(state) + target_model.predict(state)) / 2
+            return q_values.reshape(1, -1)
+        q_values = model.predict_batch(states)
+        return q_values if target_model is None else (q_values + target_model.predict_batch(states)) / 2
+    
+    # action with the maximum value of each state, ties broken at random
+    def greedy_actions(self, q_values):
+        q_values = np.atleast_2d(q_values)
+        ties = q_values == q_values.max(axis = 1, keepdims = True)
+        return np.where(ties, np.random.random(q_values.shape), -1).argmax(axis = 1)
+    
+    # with probability eps a random action, otherwise the greedy one
+    def eps_greedy_actions(self, q_values, eps):
+        q_values = np.atleast_2d(q_values)
+        greedy = self.greedy_actions(q_values)
+        explore = np.random.random(len(greedy)) <= eps
+        return np.where(explore, np.random.randint(0, q_values.shape[1], size = len(greedy)), greedy)
+    
+    # with probability eps the action right below the greedy one, otherwise the greedy one
+    def one_lower_eps_greedy_actions(self, q_values, eps):
+        greedy = self.greedy_actions(q_values)
+        explore = np.random.random(len(greedy)) <= eps
+        return np.where(explore, np.maximum(greedy - 1, 0), greedy)
+    
+    # with probability eps a random action up to the greedy one, otherwise the greedy one, or with sub the one right below it
+    def lower_eps_greedy_actions(self, q_values, eps, sub = False):
+        greedy = self.greedy_actions(q_values)
+        explore = np.random.random(len(greedy)) <= eps
+        lower = np.minimum((np.random.random(len(greedy)) * (greedy + 1)).astype(int), greedy)
+        return np.where(explore, lower, np.maximum(greedy - 1, 0) if sub else greedy)
+    
+    # boltzmann-Q action of each state among the actions from low to high, with temperature tau: the Q-values of the window are
+    # standardized, divided by tau and clipped, and the action with the highest of these logits perturbed by Gumbel noise is taken
+    def boltzmann_actions(self, q_values, tau, low = None, high = None, clip = (-500, 500)):
+        q_values = np.atleast_2d(np.asarray(q_values, dtype = float))
+        states, actions = q_values.shape
+        low = np.zeros(states, dtype = int) if low is None else np.broadcast_to(low, (states,))
+        high = np.full(states, actions - 1) if high is None else np.broadcast_to(high, (states,))
+        window = (np.arange(actions) >= low[:, None]) & (np.arange(actions) <= high[:, None])
+        size = window.sum(axis = 1, keepdims = True)
+        mean = np.where(window, q_values, 0).sum(axis = 1, keepdims = True) / size
+        std = np.sqrt(np.where(window, (q_values - mean)**2, 0).sum(axis = 1, keepdims = True) / size)
+        # states with equal values in the window get a uniform choice
+        q_values_normed = (q_values - mean) / np.where(std != 0, std, 1)
+        logits = np.clip(q_values_normed / tau, clip[0], clip[1])
+        return np.where(window, logits + np.random.gumbel(size = q_values.shape), -np.inf).argmax(axis = 1)
+    
+    # boltzmann-Q action of each state among the actions lower or equal to the greedy one
+    def lower_boltzmann_actions(self, q_values, tau, clip = (-500, 500)):
+        return self.boltzmann_actions(q_values, tau, low = 0, high = self.greedy_actions(q_values), clip = clip)
+    
+    # boltzmann-Q action of each state among the greedy action and the three actions below it
+    def lower_boltzmann_greedy_actions(self, q_values, tau, clip = (-500, 500)):
+        greedy = self.greedy_actions(q_values)
+        return self.boltzmann_actions(q_values, tau, low = np.maximum(greedy - 3, 0), high = greedy, clip = clip)
 
-class Policy():
+class Policy(PolicyEngine):
     # relate policy to environment
     def __init__(self, env):
         self.env = env
     
     # greedy policy - take action with maximum value
     def greedy_sample_action(self, model, s, eps, target_model = None):
-        optimal_a = argmax(model.predict(s)) if target_model is None else argmax(model.predict(s) + target_model.predict(s))
-        return optimal_a
+        return int(self.greedy_actions(self.q_matrix(model, s, target_model))[0])
     
     # with a certain probability take action right below the one with the maximum value
     # otherwise, follow greedy policy
     def one_lower_epsGreedy_sample_action(self, model, s, eps, target_model = None):
-        optimal_a = argmax(model.predict(s)) if target_model is None else argmax(model.predict(s) + target_model.predict(s))
-        if np.random.random() <= eps:
-            suboptimal_a = optimal_a - 1 if optimal_a != 0 else optimal_a
-            return suboptimal_a
-        return optimal_a
+        return int(self.one_lower_eps_greedy_actions(self.q_matrix(model, s, target_model), eps)[0])
     
     # boltzmann-Q policy with a low tau
     def boltzmann_q_greedy_sample_action(self, model, s, eps, target_model = None, clip = (-500, 500)):
         tau = eps # 0.1
-        print(self.env.env.iteration)
         if self.env.env.iteration == 1:
-            print('here')
             return 12
-        
-        q_values = model.predict(s) if target_model is None else ((model.predict(s) + target_model.predict(s)) / 2)
-        nb_actions = q_values.shape[0]
-        
-        q_values_normed = (q_values - q_values.mean()) / q_values.std() #q_values / q_values.max()
-        exp_values = np.exp(np.clip(q_values_normed / tau, clip[0], clip[1]))
-        probs = exp_values / np.sum(exp_values)
-        action = np.random.choice(range(nb_actions), p=probs)
-        return action
+        return int(self.boltzmann_actions(self.q_matrix(model, s, target_model), tau, clip = clip)[0])
     
     # boltzmann-Q policy with a low tau defined only for actions lower or equal to the action with maximum value
     def lower_boltzmann_q_greedy_sample_action(self, model, s, eps, target_model = None, clip = (-500, 500)):
-        
         tau = eps # 0.5
-        
-        optimal_a = self.greedy_sample_action(model, s, eps, target_model)
-        
-        q_values = model.predict(s) if target_model is None else ((model.predict(s) + target_model.predict(s)) / 2)
-        suboptimal_a_limtis = [optimal_a - 3, optimal_a + 1]
-        lower_q_values = q_values[suboptimal_a_limtis[0] : suboptimal_a_limtis[1]]
-        nb_actions = lower_q_values.shape[0] if lower_q_values.size != 0 else 1
-        
-        lower_q_values_normed = (lower_q_values - lower_q_values.mean()) / lower_q_values.std() #lower_q_values / lower_q_values.max()
-        exp_values = np.exp(np.clip(lower_q_values_normed / tau, clip[0], clip[1]))
-        probs = exp_values / np.sum(exp_values)
-        action = np.random.choice(range(nb_actions), p=probs) + suboptimal_a_limtis[0]
-        return action
+        return int(self.lower_boltzmann_greedy_actions(self.q_matrix(model, s, target_model), tau, clip = clip)[0])
     
     # with a certain probability randomly take one of actions below the one with the maximum value
     # otherwise, follow greedy policy
     def lower_epsGreedy_sample_action(self, model, s, eps, target_model = None):
-        optimal_a = self.greedy_sample_action(model, s, eps, target_model)
-        if np.random.random() <= eps:
-            random_a = np.random.randint(0, optimal_a + 1)
-            return random_a
-        else:
-          return optimal_a
+        return int(self.lower_eps_greedy_actions(self.q_matrix(model, s, target_model), eps)[0])
     
     # take a random action
     def random_sample_action(self, model, s, eps, target_model = None):
@@ -95,40 +127,14 @@ class Policy():
     # with a certain probability randomly take one of actions below the one with the maximum value
     # otherwise, take action right below the one with maximum value
     def lower_epsSubGreedy_sample_action(self, model, s, eps, target_model = None):
-        optimal_a = self.greedy_sample_action(model, s, eps, target_model)
-        suboptimal_a = optimal_a - 1 if optimal_a != 0 else optimal_a
-        if np.random.random() <= eps:
-            random_a = np.random.randint(0, optimal_a + 1)
-            return random_a
-        else:
-          return suboptimal_a
+        return int(self.lower_eps_greedy_actions(self.q_matrix(model, s, target_model), eps, sub = True)[0])
     
     # boltzmann-Q policy
     def boltzmann_q_sample_action(self, model, s, eps, target_model = None, clip = (-500, 500)):
         tau = eps # 1
-        q_values = model.predict(s) if target_model is None else ((model.predict(s) + target_model.predict(s)) / 2)
-        nb_actions = q_values.shape[0]
-        
-        q_values_normed = (q_values - q_values.mean()) / q_values.std() if q_values.std() != 0 else q_values - q_values.mean()#q_values / q_values.max()#
-        exp_values = np.exp(np.clip(q_values_normed / tau, clip[0], clip[1]))
-        probs = exp_values / np.sum(exp_values)
-        #plt.plot([round(x, 5) for x in probs])
-        action = np.random.choice(range(nb_actions), p=probs)
-        return action
+        return int(self.boltzmann_actions(self.q_matrix(model, s, target_model), tau, clip = clip)[0])
     
     # boltzmann-Q policy defined only for actions lower or equal to the action with maximum value
     def lower_boltzmann_q_sample_action(self, model, s, eps, target_model = None, clip = (-500, 500)):
         tau = eps # 1
-        
-        optimal_a = self.greedy_sample_action(model, s, eps, target_model)
-        
-        q_values = model.predict(s) if target_model is None else ((model.predict(s) + target_model.predict(s)) / 2)
-        lower_q_values = q_values[0 : optimal_a + 1]
-        nb_actions = lower_q_values.shape[0]
-        
-        lower_q_values_normed = (lower_q_values - lower_q_values.mean()) / lower_q_values.std() if lower_q_values.std() != 0 else lower_q_values - lower_q_values.mean()#lower_q_values / lower_q_values.max()
-        exp_values = np.exp(np.clip(lower_q_values_normed / tau, clip[0], clip[1]))
-        probs = exp_values / np.sum(exp_values)
-        #plt.plot([round(x, 5) for x in probs])
-        action = np.random.choice(range(nb_actions), p=probs)
-        return action
+        return int(self.lower_boltzmann_actions(self.q_matrix(model, s, target_model), tau, clip = clip)[0])
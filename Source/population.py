@@ -0,0 +1,155 @@
+'''
+PopulationRunner class searches the hyperparameters of the agent with
+population-based training. A population of agents starts from one warm-up
+snapshot of the value weights and trains in parallel worker processes, each
+member running a generation of episodes of the Manager training loop with its
+own learning rate, discounting rate and exploration rate, which the
+boltzmann-Q policies use as their temperature. After every
+generation the worst members continue from the weights of the best ones
+(exploit) with their hyperparameters perturbed (explore). Weights are passed
+between the processes as weights-only files, which the workers map
+copy-on-write, so the warm-up snapshot is shared read-only by all of them.
+'''
+
+# import external packages
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# import internal classes
+from cache import spawn_seeds
+from weights import save_weights, load_weights
+from replay import PrioritizedReplayBuffer
+
+# hyperparameters searched by the runner and the bounds they are kept in, the exploration rate eps is also the temperature tau of
+# the boltzmann-Q policies
+HYPERPARAMETERS = {'lr': (1e-6, 1), 'gamma': (0, 0.999), 'eps': (1e-3, 10)}
+
+# manager of a worker process, set up once per process
+worker = {}
+
+# create the manager of a worker process
+def init_worker(featurizer, featurizer_path):
+    # imported here so that the worker processes load the manager when they start
+    from manager import Manager
+    worker['manager'] = Manager(None, featurizer, featurizer_path)
+
+# train a member for a generation from the weights at source with the given hyperparameters, the test reward difference to the
+# true optimal reward and the path of the trained weights are returned
+def train_member(member, generation, source, hyperparameters, episodes, test_episodes, seed, directory):
+    manager = worker['manager']
+    agent = manager.agent
+    np.random.seed(seed)
+    agent.model = load_weights(source, env = agent.env, mmap_mode = 'c')
+    agent.model.set_learning_rate(hyperparameters['lr'])
+    agent.gamma1 = agent.gamma2 = hyperparameters['gamma']
+    agent.eps = hyperparameters['eps']
+    agent.init_replay(agent.replay.capacity, agent.batch_size, agent.replay_ratio, isinstance(agent.replay, PrioritizedReplayBuffer))
+    agent.q_cache = {}
+
+    # the members are tested after the last episode of the generation and the bookkeeping of the manager is skipped
+    manager.initExperiment(train_episodes = episodes, test_episodes = test_episodes, test_frequency = episodes, bookkeeping_directory = directory,
+                           bookkeeping_frequency = episodes + 1)
+    weekly_progress, progress = manager.train(visualize = False)
+    fitness = progress.loc[progress['test'] == 1, 'optimal_reward_dif'].mean()
+
+    path = os.path.join(directory, 'member_' + str(member) + '_generation_' + str(generation) + '.crm')
+    save_weights(agent.model, path)
+    return member, float(fitness), path
+
+class PopulationRunner:
+    # define a search of a population of agents over a number of generations of episodes each, starting from the weights of the agent
+    # and its hyperparameters, the worst exploit_share of the members copy the best ones after every generation
+    def __init__(self, agent, population = 4, generations = 5, episodes = 2, test_episodes = 1, directory = 'population', featurizer = 'rbf', featurizer_path = None,
+                 exploit_share = 0.25, perturbations = (0.8, 1.25), seed = 0, processes = None):
+        self.agent = agent
+        self.population = population
+        self.generations = generations
+        self.episodes = episodes
+        self.test_episodes = test_episodes
+        self.directory = os.path.abspath(directory)
+        self.featurizer = featurizer
+        self.featurizer_path = featurizer_path
+        self.exploit_share = exploit_share
+        self.perturbations = perturbations                  # factors the copied hyperparameters are multiplied by
+        self.seeds = spawn_seeds(seed, population * generations)
+        self.random = np.random.default_rng(seed)
+        self.processes = processes
+        self.history = pd.DataFrame(data = [])               # hyperparameters and fitness of every member in every generation
+        self.best = None                                    # hyperparameters, fitness and weights of the best member of the last generation
+
+    # hyperparameters of the agent
+    def agent_hyperparameters(self):
+        return {'lr': self.agent.model.learning_rate, 'gamma': self.agent.gamma1, 'eps': self.agent.eps}
+
+    # multiply each hyperparameter by a random perturbation factor, keeping it within its bounds
+    def explore(self, hyperparameters):
+        explored = {}
+        for name, value in hyperparameters.items():
+            low, high = HYPERPARAMETERS[name]
+            explored[name] = float(np.clip(value * self.random.choice(self.perturbations), low, high))
+        return explored
+
+    # run all the generations, report(runner) is called after every generation
+    def run(self, report = None):
+        report = self.print_report if report is None else report
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        warmup = os.path.join(self.directory, 'warmup.crm')
+        save_weights(self.agent.model, warmup)
+        sources = [warmup] * self.population
+        # the first member keeps the hyperparameters of the agent, the others explore around them
+        hyperparameters = [self.agent_hyperparameters()] + [self.explore(self.agent_hyperparameters()) for member in range(1, self.population)]
+        rows = []
+
+        if self.processes == 1:
+            init_worker(self.featurizer, self.featurizer_path)
+        executor = None if self.processes == 1 else ProcessPoolExecutor(max_workers = self.processes, initializer = init_worker,
+                                                                        initargs = (self.featurizer, self.featurizer_path))
+        try:
+            for generation in range(self.generations):
+                arguments = [(member, generation, sources[member], hyperparameters[member], self.episodes, self.test_episodes,
+                              self.seeds[generation * self.population + member], self.directory) for member in range(self.population)]
+                if executor is None:
+                    results = [train_member(*member_arguments) for member_arguments in arguments]
+                else:
+                    results = [future.result() for future in as_completed([executor.submit(train_member, *member_arguments) for member_arguments in arguments])]
+                fitness = np.full(self.population, -np.inf)
+                for member, member_fitness, path in results:
+                    fitness[member] = member_fitness if not np.isnan(member_fitness) else -np.inf
+                    sources[member] = path
+                    rows.append(dict(generation = generation, member = member, fitness = member_fitness, **hyperparameters[member]))
+                self.history = pd.DataFrame(data = rows).sort_values(['generation', 'member']).reset_index(drop = True)
+
+                ranking = np.argsort(-fitness, kind = 'stable')
+                best = ranking[0]
+                self.best = dict(hyperparameters[best], fitness = float(fitness[best]), path = sources[best])
+                report(self)
+
+                # the worst members continue from the weights of the best ones with perturbed hyperparameters
+                if generation < self.generations - 1:
+                    copies = max(1, int(self.population * self.exploit_share)) if self.population > 1 else 0
+                    for worst, donor in zip(ranking[::-1][:copies], ranking[:copies]):
+                        sources[worst] = sources[donor]
+                        hyperparameters[worst] = self.explore(hyperparameters[donor])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return self
+
+    # agent with the weights and the hyperparameters of the best member of the last generation
+    def best_agent(self):
+        self.agent.model = load_weights(self.best['path'], env = self.agent.env)
+        self.agent.model.set_learning_rate(self.best['lr'])
+        self.agent.gamma1 = self.agent.gamma2 = self.best['gamma']
+        self.agent.eps = self.best['eps']
+        self.agent.q_cache = {}
+        return self.agent
+
+    # print the generation and the best member with its hyperparameters
+    def print_report(self, runner):
+        generation = int(self.history['generation'].max())
+        print('generation {}/{}: best fitness {:.0f}, lr {:.2e}, gamma {:.3f}, eps {:.3f}, population fitness {}'.format(
+            generation + 1, self.generations, self.best['fitness'], self.best['lr'], self.best['gamma'], self.best['eps'],
+            ', '.join('{:.0f}'.format(fitness) for fitness in self.history.loc[self.history['generation'] == generation, 'fitness'])))
@@ -0,0 +1,92 @@
+'''
+ProgressRecorder class records the weekly progress of an episode into typed
+arrays preallocated for the episode horizon, so recording a week sets one
+element of each column, and returns the recorded weeks as a DataFrame built on
+the arrays without copying them at the end of the episode.
+ProgressStore class collects the progress frames of many episodes as chunks
+and concatenates them only when the combined frame is requested, instead of
+copying the whole history after every episode.
+'''
+
+# import external packages
+import numpy as np
+import pandas as pd
+
+# columns of the weekly progress of an episode and their types
+PROGRESS_COLUMNS = [('Week', np.int64),
+                    ('Optimized action', np.float64),
+                    ('Optimized state', np.float64),
+                    ('Optimized value', np.float64),
+                    ('Actual action', np.float64),
+                    ('Actual reward', np.float64),
+                    ('True optimal action', np.float64),
+                    ('True optimal reward', np.float64),
+                    ('Optimized action difference', np.float64),
+                    ('Action difference', np.float64),
+                    ('Reward difference', np.float64),
+                    ('Max action', np.float64),
+                    ('Max reward', np.float64),
+                    ('Step time', 'timedelta64[us]'),
+                    ('Episode time', 'timedelta64[us]')]
+
+class ProgressRecorder:
+    # empty recorder with room for horizon rows of the given (name, type) columns
+    def __init__(self, horizon, columns = PROGRESS_COLUMNS):
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in columns}
+        self.arrays = {name: self.empty(dtype, max(1, horizon)) for name, dtype in self.dtypes.items()}
+        self.rows = 0                                   # number of recorded rows
+
+    # array of missing values of a column type
+    @staticmethod
+    def empty(dtype, size):
+        if dtype.kind == 'f':
+            return np.full(size, np.nan, dtype = dtype)
+        if dtype.kind == 'm':
+            return np.full(size, np.timedelta64('NaT'), dtype = dtype)
+        return np.zeros(size, dtype = dtype)
+
+    def __len__(self):
+        return self.rows
+
+    # record the values of the next row, columns not given stay missing
+    def record(self, **values):
+        if self.rows == len(self.arrays[next(iter(self.arrays))]):
+            self.grow()
+        for name, value in values.items():
+            self.arrays[name][self.rows] = value
+        self.rows += 1
+
+    # double the room of the recorder when an episode outlasts the horizon
+    def grow(self):
+        for name, array in self.arrays.items():
+            self.arrays[name] = np.concatenate([array, self.empty(array.dtype, len(array))])
+
+    # values of the given columns of a recorded row
+    def row(self, index, names = None):
+        names = list(self.arrays) if names is None else names
+        return pd.Series({name: self.arrays[name][index] for name in names}, name = index)
+
+    # DataFrame of the recorded rows, its columns are views of the recorder arrays
+    def to_frame(self):
+        return pd.DataFrame({name: array[:self.rows] for name, array in self.arrays.items()}, copy = False)
+
+class ProgressStore:
+    # store holding an initial frame of progress, if given
+    def __init__(self, frame = None):
+        self.chunks = [] if frame is None or len(frame.columns) == 0 else [frame]
+        self.frame = None                               # combined frame of the chunks, until the next chunk is appended
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    # append the progress frame of an episode as a chunk
+    def append(self, frame):
+        self.chunks.append(frame)
+        self.frame = None
+
+    # combined frame of all the chunks, after which they are kept as one chunk
+    def to_frame(self):
+        if self.frame is None:
+            self.frame = pd.concat(self.chunks, axis = 0) if self.chunks else pd.DataFrame(data = [])
+            self.chunks = [self.frame] if self.chunks else []
+        return self.frame
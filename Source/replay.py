@@ -0,0 +1,165 @@
+'''
+ReplayBuffer class keeps (previous state, action, state, reward) transitions in
+preallocated arrays used as a ring, overwriting the oldest transitions when it
+is full. Every transition gets an increasing id, so that a delayed reward can
+be updated in place, or the transition removed, for as long as it has not been
+overwritten. The learner samples minibatches of the stored transitions.
+PrioritizedReplayBuffer class keys the transitions by the absolute TD error of
+their last learning pass in a priority queue and returns the transitions with
+the highest errors first. New and changed transitions get the highest priority
+seen so far, so that each of them is learned from at least once.
+'''
+
+# import external packages
+import heapq
+import numpy as np
+
+# import internal classes
+from utils import PriorityQueue
+
+class ReplayBuffer:
+    # empty buffer of a number of transitions between states of the given width
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.prev_states = np.zeros((capacity, width))
+        self.actions = np.zeros(capacity, dtype = int)
+        self.states = np.zeros((capacity, width))
+        self.rewards = np.zeros(capacity)
+        self.times = np.zeros(capacity)                         # time the transition was stored at, such as the step of the agent
+        self.ids = np.full(capacity, -1, dtype = np.int64)      # id of the transition in each slot
+        self.valid = np.zeros(capacity, dtype = bool)           # slots holding a transition that was not removed
+        self.pushed = 0                                         # number of transitions stored so far
+
+    # number of transitions in the buffer
+    def __len__(self):
+        return int(self.valid.sum())
+
+    # store transitions, the ids of the stored transitions are returned
+    def push(self, prev_states, actions, states, rewards, time = 0):
+        actions = np.asarray(actions, dtype = int)
+        ids = np.arange(self.pushed, self.pushed + len(actions), dtype = np.int64)
+        self.pushed += len(actions)
+        if len(actions) == 0:
+            return ids
+        # only the last capacity transitions fit into the buffer
+        kept = slice(max(0, len(actions) - self.capacity), len(actions))
+        slots = ids[kept] % self.capacity
+        self.overwrite(self.ids[slots][self.valid[slots]])
+        self.prev_states[slots] = np.asarray(prev_states, dtype = float).reshape(len(actions), -1)[kept]
+        self.actions[slots] = actions[kept]
+        self.states[slots] = np.asarray(states, dtype = float).reshape(len(actions), -1)[kept]
+        self.rewards[slots] = np.asarray(rewards, dtype = float)[kept]
+        self.times[slots] = time
+        self.ids[slots] = ids[kept]
+        self.valid[slots] = True
+        return ids
+
+    # transitions about to be overwritten
+    def overwrite(self, ids):
+        pass
+
+    # transitions of the ids still in the buffer
+    def contains(self, ids):
+        ids = np.asarray(ids, dtype = np.int64)
+        slots = ids % self.capacity
+        return (ids >= 0) & (self.ids[slots] == ids) & self.valid[slots]
+
+    # update the rewards of transitions still in the buffer
+    def update_rewards(self, ids, rewards):
+        ids = np.asarray(ids, dtype = np.int64)
+        found = self.contains(ids)
+        self.rewards[ids[found] % self.capacity] = np.asarray(rewards, dtype = float)[found]
+        return found
+
+    # remove transitions still in the buffer
+    def remove(self, ids):
+        ids = np.asarray(ids, dtype = np.int64)
+        found = self.contains(ids)
+        self.valid[ids[found] % self.capacity] = False
+        return found
+
+    # ids of a uniform sample of the transitions
+    def sample_uniform(self, batch_size):
+        slots = np.flatnonzero(self.valid)
+        return self.ids[slots[np.random.randint(len(slots), size = batch_size)]]
+
+    # ids of the transitions of the next minibatch
+    def sample_ids(self, batch_size):
+        return self.sample_uniform(batch_size)
+
+    # learning priorities of transitions after a learning pass, the uniform buffer does not use them
+    def set_priorities(self, ids, priorities):
+        pass
+
+    # previous states, actions, states and rewards of transitions still in the buffer
+    def get(self, ids):
+        slots = np.asarray(ids, dtype = np.int64) % self.capacity
+        return self.prev_states[slots], self.actions[slots], self.states[slots], self.rewards[slots]
+
+    # previous states, actions, states and rewards of a uniform sample of the transitions
+    def sample(self, batch_size):
+        return self.get(self.sample_uniform(batch_size))
+
+    # previous states, actions, states, rewards and times of all the transitions
+    def contents(self):
+        slots = np.flatnonzero(self.valid)
+        return self.prev_states[slots], self.actions[slots], self.states[slots], self.rewards[slots], self.times[slots]
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    # empty buffer of a number of transitions between states of the given width
+    def __init__(self, capacity, width):
+        ReplayBuffer.__init__(self, capacity, width)
+        self.queue = PriorityQueue()            # transition ids by the negative priority, the queue pops the lowest first
+        self.max_priority = 1.0                 # highest priority seen, given to new and changed transitions
+
+    # queue transitions with a priority each, replacing their previous entries
+    def queue_items(self, ids, priorities):
+        for transition_id, priority in zip(ids, priorities):
+            self.queue.addItem(int(transition_id), -float(priority))
+        # replaced entries stay in the heap until popped, rebuild it when they outnumber the queued transitions
+        if len(self.queue.pq) > 2 * len(self.queue.entry_finder) + self.capacity:
+            self.queue.pq = [entry for entry in self.queue.pq if entry[-1] is not self.queue.REMOVED]
+            heapq.heapify(self.queue.pq)
+
+    # drop transitions from the queue
+    def dequeue(self, ids):
+        for transition_id in ids:
+            if int(transition_id) in self.queue.entry_finder:
+                self.queue.removeItem(int(transition_id))
+
+    def push(self, prev_states, actions, states, rewards, time = 0):
+        ids = ReplayBuffer.push(self, prev_states, actions, states, rewards, time)
+        stored = ids[max(0, len(ids) - self.capacity):]
+        self.queue_items(stored, np.full(len(stored), self.max_priority))
+        return ids
+
+    def overwrite(self, ids):
+        self.dequeue(ids)
+
+    def update_rewards(self, ids, rewards):
+        found = ReplayBuffer.update_rewards(self, ids, rewards)
+        changed = np.asarray(ids, dtype = np.int64)[found]
+        self.queue_items(changed, np.full(len(changed), self.max_priority))
+        return found
+
+    def remove(self, ids):
+        found = ReplayBuffer.remove(self, ids)
+        self.dequeue(np.asarray(ids, dtype = np.int64)[found])
+        return found
+
+    # ids of the transitions with the highest priorities, they leave the queue until their priorities are set again
+    def sample_ids(self, batch_size):
+        ids = []
+        while len(ids) < batch_size and not self.queue.empty():
+            transition_id, priority = self.queue.popTask()
+            ids.append(transition_id)
+        return np.array(ids, dtype = np.int64)
+
+    # queue transitions again with the absolute TD errors of their learning pass as priorities
+    def set_priorities(self, ids, priorities):
+        priorities = np.asarray(priorities, dtype = float)
+        if len(priorities) > 0:
+            self.max_priority = max(self.max_priority, float(priorities.max()))
+        ids = np.asarray(ids, dtype = np.int64)
+        found = self.contains(ids)
+        self.queue_items(ids[found], priorities[found])
@@ -0,0 +1,190 @@
+'''
+ScenarioGridRunner class stress-tests a frozen agent over a design of
+distortion scenarios, each scenario setting the distortion parameters of the
+simulation. The design is either a full grid of values of the parameters or a
+Latin hypercube sample of their ranges. Episodes of every scenario are run over
+a pool of worker processes with the same seeds in every scenario, so the
+scenarios are compared on common random numbers. For each episode the reward
+and the mean threshold of the agent, the optimal threshold and its reward are
+written into a result cube of (scenario, episode, metric) memory-mapped on
+disk, together with a mask of the finished episodes, so an interrupted study
+resumes with the episodes that are still missing. The study is keyed by a hash
+of the agent weights, so a study of other weights saved to the same path is
+started again instead of resumed.
+'''
+
+# import external packages
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# import internal classes
+from cache import spawn_seeds
+from simulation import SimulationEnv
+from agent import Agent
+from model import EnvironmentModel
+from policy import Policy
+from weights import load_weights
+
+# distortion parameters of the simulation and their undistorted values
+DISTORTIONS = {'e': 1,
+               'news_positives_score_bias': 0,
+               'repeats_positives_score_bias': 0,
+               'news_negatives_score_bias': 0,
+               'repeats_negatives_score_bias': 0,
+               'news_default_rate_bias': 0,
+               'repeats_default_rate_bias': 0,
+               'late_payment_rate_bias': 0,
+               'ar_effect': 0}
+
+# metrics of an episode stored in the result cube
+RESULT_METRICS = ['Agent reward', 'Agent action', 'True optimal reward', 'Optimal reward', 'Optimal action']
+
+# check that the design only sets distortion parameters
+def check_parameters(names):
+    unknown = [name for name in names if name not in DISTORTIONS]
+    if unknown:
+        raise ValueError('unknown distortion parameters ' + str(unknown) + ', expected some of ' + str(list(DISTORTIONS)))
+
+# full grid of the values given for each parameter, a row for each scenario and a column for each parameter
+def grid_design(values):
+    check_parameters(values)
+    axes = np.meshgrid(*[np.asarray(parameter_values, dtype = float) for parameter_values in values.values()], indexing = 'ij')
+    return pd.DataFrame(data = np.column_stack([axis.ravel() for axis in axes]), columns = list(values))
+
+# Latin hypercube sample of a number of scenarios from the (low, high) range of each parameter: every range is split into as many
+# strata as scenarios and each stratum is sampled once
+def latin_hypercube_design(ranges, scenarios, seed = 0):
+    check_parameters(ranges)
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name, (low, high) in ranges.items():
+        strata = (rng.permutation(scenarios) + rng.random(scenarios)) / scenarios
+        columns[name] = low + strata * (high - low)
+    return pd.DataFrame(data = columns)
+
+# frozen agent of a worker process, set up once per process
+worker = {}
+
+# create the agent of a worker process with the featurizer and the frozen value weights of the weights file, mapped read-only,
+# the exploration rate defaults to the one of the Manager agents
+def init_worker(weights_path, eps, sample_action):
+    env = SimulationEnv()
+    model = load_weights(weights_path, env = env, mmap_mode = 'r')
+    agent = Agent(env, model, EnvironmentModel(env, model.learning_rate), Policy(env), 1 if eps is None else eps, 0.95, 0.95)
+    worker['agent'] = agent
+    worker['sample_action'] = getattr(agent.policy, sample_action)
+
+# hash of the content of a weights file
+def weights_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as weights_file:
+        for block in iter(lambda: weights_file.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:20]
+
+# run an episode of the frozen agent in a scenario and return its metrics
+def run_scenario(scenario, episode, distortions, seed):
+    agent = worker['agent']
+    agent.env = agent.policy.env = SimulationEnv(distortions = dict(DISTORTIONS, **distortions))
+    np.random.seed(seed)
+    progress = agent.play_one(sample_action = worker['sample_action'], train = False)
+    evaluation_rewards = agent.env.env.get_evaluation_rewards()
+    metrics = [progress['Actual reward'].sum(), progress['Actual action'].mean(), progress['True optimal reward'].sum(),
+               evaluation_rewards.max(), agent.env.env.convert_to_real_action(np.argmax(evaluation_rewards))]
+    return scenario, episode, np.array(metrics, dtype = float)
+
+class ScenarioGridRunner:
+    # define a study of a number of episodes in each scenario of the design for the agent weights saved at weights_path, the
+    # results are kept in directory
+    def __init__(self, weights_path, design, episodes = 1, directory = 'scenarios', eps = None, sample_action = 'boltzmann_q_greedy_sample_action',
+                 seed = 0, processes = None, report_every = 10):
+        check_parameters(design.columns)
+        self.weights_path = os.path.abspath(weights_path)
+        self.design = design.reset_index(drop = True)
+        self.episodes = episodes
+        self.directory = directory
+        self.eps = eps
+        self.sample_action = sample_action
+        self.seeds = spawn_seeds(seed, episodes)     # seed of each episode, the same in every scenario
+        self.processes = processes
+        self.report_every = report_every
+        self.results = None                          # result cube of (scenario, episode, metric)
+        self.finished = None                         # finished episodes of each scenario
+
+    # open the result cube and the mask of finished episodes, continuing a study of the same design if there is one
+    def open(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        paths = {name: os.path.join(self.directory, name) for name in ['design.json', 'results.npy', 'finished.npy']}
+        study = {'parameters': list(self.design.columns), 'design': self.design.values.tolist(), 'episodes': self.episodes, 'seeds': self.seeds,
+                 'weights': self.weights_path, 'weights digest': weights_digest(self.weights_path), 'sample_action': self.sample_action,
+                 'metrics': RESULT_METRICS}
+        shape = (len(self.design), self.episodes, len(RESULT_METRICS))
+        resume = os.path.exists(paths['design.json']) and os.path.exists(paths['results.npy']) and os.path.exists(paths['finished.npy'])
+        if resume:
+            with open(paths['design.json']) as design_file:
+                resume = json.load(design_file) == study
+        if resume:
+            self.results = np.load(paths['results.npy'], mmap_mode = 'r+')
+            self.finished = np.load(paths['finished.npy'], mmap_mode = 'r+')
+        else:
+            with open(paths['design.json'], 'w') as design_file:
+                json.dump(study, design_file)
+            self.results = np.lib.format.open_memmap(paths['results.npy'], mode = 'w+', dtype = np.float32, shape = shape)
+            self.results[:] = np.nan
+            self.finished = np.lib.format.open_memmap(paths['finished.npy'], mode = 'w+', dtype = bool, shape = shape[:2])
+            self.finished[:] = False
+
+    # run the episodes that are not finished yet, report(runner) is called every report_every finished episodes
+    def run(self, report = None):
+        report = self.print_report if report is None else report
+        self.open()
+        tasks = [(scenario, episode, {name: float(value) for name, value in self.design.iloc[scenario].items()}, self.seeds[episode])
+                 for scenario, episode in zip(*np.nonzero(~np.asarray(self.finished)))]
+
+        if self.processes == 1 and tasks:
+            init_worker(self.weights_path, self.eps, self.sample_action)
+            try:
+                for task in tasks:
+                    self.finish(*run_scenario(*task), report)
+            finally:
+                # the agent of the serial run is released with it, as the pool releases those of its workers
+                worker.clear()
+        elif tasks:
+            with ProcessPoolExecutor(max_workers = self.processes, initializer = init_worker, initargs = (self.weights_path, self.eps, self.sample_action)) as executor:
+                futures = [executor.submit(run_scenario, *task) for task in tasks]
+                for future in as_completed(futures):
+                    self.finish(*future.result(), report)
+        report(self)
+        return self
+
+    # write the metrics of a finished episode to the cube and mark it finished, the results are written before the mark so that an
+    # interruption never leaves a finished episode without results
+    def finish(self, scenario, episode, metrics, report):
+        self.results[scenario, episode] = metrics
+        self.results.flush()
+        self.finished[scenario, episode] = True
+        self.finished.flush()
+        if int(np.sum(self.finished)) % self.report_every == 0:
+            report(self)
+
+    # design with the mean of every metric over the finished episodes of each scenario
+    def summary(self):
+        finished = np.asarray(self.finished)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            means = np.where(finished[:, :, None], self.results, 0).sum(axis = 1) / finished.sum(axis = 1)[:, None]
+        summary = pd.concat([self.design, pd.DataFrame(data = means, columns = RESULT_METRICS)], axis = 1)
+        summary['Reward difference'] = summary['Agent reward'] - summary['Optimal reward']
+        summary['Action difference'] = summary['Agent action'] - summary['Optimal action']
+        return summary
+
+    # print the number of finished episodes and the mean reward difference of the agent to the optimal threshold
+    def print_report(self, runner):
+        finished = np.asarray(self.finished)
+        differences = (self.results[:, :, 0] - self.results[:, :, 3])[finished]
+        print('episodes: {}/{}, mean reward difference to the optimal threshold {:.0f}'.format(finished.sum(), finished.size,
+              differences.mean() if len(differences) else np.nan), end = "\r")
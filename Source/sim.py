@@ -7,11 +7,15 @@ for confidentiality reasons.
 # import external packages
 import numpy as np
 import pandas as pd
-import gc
 
 class Sim:
     # initialize simulation parameters
-    def __init__(self, distortions = {'e': 1, 'news_positives_score_bias': 0, 'repeats_positives_score_bias': 0, 'news_negatives_score_bias': 0, 'repeats_negatives_score_bias': 0, 'news_default_rate_bias': 0, 'repeats_default_rate_bias': 0, 'late_payment_rate_bias': 0, 'ar_effect': 0}):
+    def __init__(self, distortions = {'e': 1, 'news_positives_score_bias': 0, 'repeats_positives_score_bias': 0, 'news_negatives_score_bias': 0, 'repeats_negatives_score_bias': 0, 'news_default_rate_bias': 0, 'repeats_default_rate_bias': 0, 'late_payment_rate_bias': 0, 'ar_effect': 0}, trend_horizon = None, retention = 'full'):
+        
+        # week after which the application volume trend is held constant
+        self.trend_horizon = trend_horizon
+        # 'full' keeps all the accepted applications, 'compact' keeps only the ones with pending events
+        self.retention = retention
         
         # distortion parameters
         self.distortions = distortions
@@ -135,38 +139,57 @@ class Sim:
         self.debt_probabilities = [0.1, 0.1, 0.1, 0.1, 0.05, 0.05, 0.05, 0.05, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02]
         
         # accepted applications and accepted rate
-        self.all_accepted = pd.DataFrame(data=[])
+        self.accepted_frame = pd.DataFrame(data=[]) # accepted applications merged so far
+        self.accepted_batches = [] # weekly accepted applications not merged yet
+        self.schedule = {} # accepted applications with an event (maturation, overdue, late payment) in each week
+        self.any_accepted = False # if any application was accepted
+        self.due_loans = pd.DataFrame(data=[]) # accepted applications with an event in the current week
         self.ar = 0
     
+    # accepted applications, weekly batches are merged on access. With 'compact' retention only the ones with pending events
+    @property
+    def all_accepted(self):
+        if self.retention == 'compact':
+            frames = [loans for week in sorted(self.schedule) for loans in self.schedule[week]]
+            open_loans = pd.concat(frames) if frames else pd.DataFrame(data=[])
+            return open_loans[~open_loans.index.duplicated()]
+        if self.accepted_batches:
+            self.accepted_frame = pd.concat([self.accepted_frame] + self.accepted_batches)
+            self.accepted_batches = []
+        return self.accepted_frame
+    
     # generate dataframe of weekly loan applications
     def generateInput(self, iteration = 1):
         
         # received applications simulation parameters
         trend_change = 50 ### week of trend change
         
+        # hold the trend constant after the trend horizon, keeping long episodes stationary
+        t = iteration if self.trend_horizon is None else min(iteration, self.trend_horizon)
+        
         # simulate number of weekly applications
-        if (iteration <= trend_change):
+        if (t <= trend_change):
             # data generating process before the trend change
             
             # generating the total number of weekly new applications
-            no_of_weekly_new_applications = (10*(iteration)) - (0.1*((iteration)**2))
+            no_of_weekly_new_applications = (10*(t)) - (0.1*((t)**2))
             no_of_weekly_new_applications = no_of_weekly_new_applications + np.random.normal(0,10) * self.e
             no_of_weekly_new_applications = no_of_weekly_new_applications if no_of_weekly_new_applications > 0 else 10
             # generating the total number of weekly repeat applications
-            no_of_weekly_repeat_applications = (5*(iteration)) - (0.05*((iteration)**2)) - (0.001*((iteration)**3)) + (0.5*no_of_weekly_new_applications)
+            no_of_weekly_repeat_applications = (5*(t)) - (0.05*((t)**2)) - (0.001*((t)**3)) + (0.5*no_of_weekly_new_applications)
             no_of_weekly_repeat_applications = no_of_weekly_repeat_applications + np.random.normal(0,10) * self.e
             no_of_weekly_repeat_applications = no_of_weekly_repeat_applications if no_of_weekly_repeat_applications > 0 else 0
         else:                                                                                          
             # data generating process after the trend change
             
             # generating the total number of weekly new applications
-            no_of_weekly_new_applications = 100 + (2*(iteration)) - (0.05*((iteration)**2))
-            no_of_weekly_new_applications += (self.ar - self.ar_historical) * self.c_ar_new * (iteration - trend_change) * self.ar_effect
+            no_of_weekly_new_applications = 100 + (2*(t)) - (0.05*((t)**2))
+            no_of_weekly_new_applications += (self.ar - self.ar_historical) * self.c_ar_new * (t - trend_change) * self.ar_effect
             no_of_weekly_new_applications += np.random.normal(0,10) * self.e
             no_of_weekly_new_applications = no_of_weekly_new_applications if no_of_weekly_new_applications > 0 else 10
             # generating the total number of weekly repeat applications
-            no_of_weekly_repeat_applications = 50 + (1*(iteration)) - (0.02*((iteration)**2)) + (0.0005*((iteration)**3)) + (0.5*no_of_weekly_new_applications)
-            no_of_weekly_repeat_applications += (self.ar - self.ar_historical) * self.c_ar_repeat * (iteration - trend_change) * self.ar_effect
+            no_of_weekly_repeat_applications = 50 + (1*(t)) - (0.02*((t)**2)) + (0.0005*((t)**3)) + (0.5*no_of_weekly_new_applications)
+            no_of_weekly_repeat_applications += (self.ar - self.ar_historical) * self.c_ar_repeat * (t - trend_change) * self.ar_effect
             no_of_weekly_repeat_applications += np.random.normal(0,10) * self.e
         
         # scale volumes
@@ -174,8 +197,9 @@ class Sim:
         no_of_weekly_repeat_applications *= 1
         
         
-        # generate application characteristics
-        weekly_applications = pd.DataFrame(data=[])
+        # generate application characteristics, rows are collected first and converted to a dataframe once
+        columns = ['iteration', 'maturation_at', 'repeat', 'sum', 'duration', 'debt', 'score', 'dca', 'dca_at', 'late_payment', 'late_payment_at', 'profit', 'segment']
+        ids, rows = [], []
         
         # generate new client loan application characteristics
         for i in range(1, (int(no_of_weekly_new_applications)+1)):
@@ -197,18 +221,12 @@ class Sim:
             #score -= debt/17 # adjust for debt
             
             # store characteristics
-            weekly_applications.loc[id, 'iteration'] = iteration
-            weekly_applications.loc[id, 'maturation_at'] = iteration + duration
-            weekly_applications.loc[id, 'repeat'] = False
-            weekly_applications.loc[id, 'sum'] = int(sum)
-            weekly_applications.loc[id, 'duration'] = int(round(self.new_loans[loantype][6], 0))
-            weekly_applications.loc[id, 'debt'] = debt
-            weekly_applications.loc[id, 'score'] = score
-            weekly_applications.loc[id, 'dca'] = bool(dca)
-            weekly_applications.loc[id, 'dca_at'] = iteration + duration + 10 if dca == 1 else 'NA'
-            weekly_applications.loc[id, 'late_payment'] = late_payment
-            weekly_applications.loc[id, 'late_payment_at'] = iteration + duration + int(np.random.uniform(1, 30)) if late_payment == 1 else 'NA'
-            weekly_applications.loc[id, 'profit'] =  loan_value
+            ids.append(id)
+            rows.append([iteration, iteration + duration, False, int(sum), int(round(self.new_loans[loantype][6], 0)), debt, score, bool(dca),
+                         iteration + duration + 10 if dca == 1 else 'NA',
+                         late_payment,
+                         iteration + duration + int(np.random.uniform(1, 30)) if late_payment == 1 else 'NA',
+                         loan_value, loantype])
         
         # generate repeat client loan application characteristics                           
         for i in range(1, (int(no_of_weekly_repeat_applications)+1)):
@@ -230,18 +248,18 @@ class Sim:
             #score -= debt/17 # adjust for debt
             
             # store characteristics
-            weekly_applications.loc[id, 'iteration'] = iteration
-            weekly_applications.loc[id, 'maturation_at'] = iteration + duration
-            weekly_applications.loc[id, 'repeat'] = True
-            weekly_applications.loc[id, 'sum'] = int(sum)
-            weekly_applications.loc[id, 'duration'] = int(round(self.repeat_loans[loantype][6], 0))
-            weekly_applications.loc[id, 'debt'] = debt
-            weekly_applications.loc[id, 'score'] = score
-            weekly_applications.loc[id, 'dca'] = bool(dca)
-            weekly_applications.loc[id, 'dca_at'] = iteration + duration + 10 if dca == 1 else 'NA'
-            weekly_applications.loc[id, 'late_payment'] = late_payment
-            weekly_applications.loc[id, 'late_payment_at'] = iteration + duration + int(np.random.uniform(1, 30)) if late_payment == 1 else 'NA'
-            weekly_applications.loc[id, 'profit'] =  loan_value                       
+            ids.append(id)
+            rows.append([iteration, iteration + duration, True, int(sum), int(round(self.repeat_loans[loantype][6], 0)), debt, score, bool(dca),
+                         iteration + duration + 10 if dca == 1 else 'NA',
+                         late_payment,
+                         iteration + duration + int(np.random.uniform(1, 30)) if late_payment == 1 else 'NA',
+                         loan_value, loantype])
+        
+        if not rows:
+            return pd.DataFrame(data=[])
+        
+        weekly_applications = pd.DataFrame(data = rows, index = ids, columns = columns)
+        weekly_applications = weekly_applications.astype({'iteration': float, 'maturation_at': float, 'repeat': object, 'sum': float, 'duration': float, 'debt': float, 'score': float, 'dca': object, 'dca_at': object, 'late_payment': float, 'late_payment_at': object, 'profit': float, 'segment': int})
     
         return weekly_applications
     
@@ -254,37 +272,63 @@ class Sim:
             app['accept'] = True
             return app
     
+    # add accepted applications to the schedule of the weeks their events happen in
+    def schedule_events(self, accepted):
+        for column in ['maturation_at', 'dca_at', 'late_payment_at']:
+            weeks = pd.to_numeric(accepted[column], errors = 'coerce')
+            for week, loans in accepted.groupby(weeks):
+                self.schedule.setdefault(int(week), []).append(loans)
+    
+    # customer segments of new and repeat clients
+    @property
+    def segments(self):
+        return list(self.new_loans.keys()) + list(self.repeat_loans.keys())
+    
+    # acceptance threshold of each application: a threshold for each segment if given, otherwise for each client type
+    def application_thresholds(self, weekly_applications, threshold = 50, threshold_new = None, segment_thresholds = None):
+        if segment_thresholds is not None:
+            segment_thresholds = np.asarray(segment_thresholds, dtype = float)
+            if segment_thresholds.shape != (len(self.segments),):
+                raise ValueError('expected a threshold for each of the ' + str(len(self.segments)) + ' segments')
+            return segment_thresholds[weekly_applications['segment'].values - 1]
+        if threshold_new is None:
+            return threshold
+        return np.where(weekly_applications['repeat'].values == True, threshold, threshold_new)
+    
     # generates dataframe of loan applications and ids of paid, overdue and paid after overdue loans for current week
-    def simulate(self, i, weekly_applications, threshold = 50):
+    # threshold applies to repeat clients, and to new clients too unless threshold_new is given, segment_thresholds override both
+    def simulate(self, i, weekly_applications, threshold = 50, threshold_new = None, segment_thresholds = None):
         
-        weekly_applications = weekly_applications.apply(self.accept, axis = 1, args = [threshold])
+        if not weekly_applications.empty:
+            thresholds = self.application_thresholds(weekly_applications, threshold, threshold_new, segment_thresholds)
+            weekly_applications['accept'] = ~(weekly_applications['score'].values < thresholds)
         
         if 'accept' in weekly_applications.columns:
             accepted = weekly_applications.loc[weekly_applications['accept'] == True]
             self.ar = weekly_applications['accept'].mean()
-            self.all_accepted = pd.concat([self.all_accepted, accepted])
-            
-            del accepted
+            if not accepted.empty:
+                self.any_accepted = True
+                if self.retention == 'full':
+                    self.accepted_batches.append(accepted)
+                self.schedule_events(accepted)
+        
+        # only the loans scheduled for the current week are looked at, not the whole history
+        due = self.schedule.pop(i, [])
+        self.due_loans = pd.concat(due) if due else pd.DataFrame(data=[])
+        self.due_loans = self.due_loans[~self.due_loans.index.duplicated()]
                 
-        if not self.all_accepted.empty:    
-            matured = self.all_accepted.loc[self.all_accepted['maturation_at'] == i]
-            matured = matured.index
-            dca = self.all_accepted.loc[self.all_accepted['dca_at'] == i]
-            dca = dca.index
-            paid_dca = self.all_accepted.loc[self.all_accepted['late_payment_at'] == i]
-            paid_dca = paid_dca.index
-            paid = self.all_accepted.loc[(self.all_accepted['maturation_at'] == i) & (self.all_accepted['dca'] == False)]
-            paid = paid.index
-            
-            del matured
+        if self.any_accepted:
+            if not self.due_loans.empty:
+                dca = self.due_loans.index[self.due_loans['dca_at'] == i]
+                paid_dca = self.due_loans.index[self.due_loans['late_payment_at'] == i]
+                paid = self.due_loans.index[(self.due_loans['maturation_at'] == i) & (self.due_loans['dca'] == False)]
+            else:
+                dca, paid_dca, paid = pd.Index([]), pd.Index([]), pd.Index([])
             
         else:
             self.ar = 0
-            matured, dca, paid_dca, paid = [], [], [], []
+            dca, paid_dca, paid = [], [], []
             
         output = weekly_applications#[['iteration', 'sum', 'duration', 'score', 'repeat', 'accept', 'dca', 'profit']]
         
-        gc.collect()
-        del weekly_applications
-        
         return output, paid, dca, paid_dca
\ No newline at end of file
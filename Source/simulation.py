@@ -12,27 +12,30 @@ import numpy as np
 
 # import internal classes
 from environment import Environment 
+from episode import EpisodeConfig
 
 class SimulationEnv(gym.Env):
     # initialize environment instance and define state and action spaces
-    def __init__(self, action_type = 'discrete_action', reward_type = 'real', window = 4, cheating = False, reward_scaler = 1, distortions = {'e': 1, 'news_positives_score_bias': 0, 'repeats_positives_score_bias': 0, 'news_negatives_score_bias': 0, 'repeats_negatives_score_bias': 0, 'news_default_rate_bias': 0, 'repeats_default_rate_bias': 0, 'late_payment_rate_bias': 0, 'ar_effect': 0}):
+    def __init__(self, action_type = 'discrete_action', reward_type = 'real', window = 4, cheating = False, reward_scaler = 1, distortions = {'e': 1, 'news_positives_score_bias': 0, 'repeats_positives_score_bias': 0, 'news_negatives_score_bias': 0, 'repeats_negatives_score_bias': 0, 'news_default_rate_bias': 0, 'repeats_default_rate_bias': 0, 'late_payment_rate_bias': 0, 'ar_effect': 0}, episode = None, retention = 'compact', action_grid = None):
         self.action_type = action_type
         self.reward_type = reward_type
         self.window = window
         self.cheating = cheating
         self.reward_scaler = reward_scaler
         self.distortions = distortions
-        self.env = Environment(action_type = self.action_type, reward_type = self.reward_type, window = self.window, cheating = self.cheating, reward_scaler = self.reward_scaler, distortions = self.distortions)
+        self.episode = EpisodeConfig() if episode is None else episode
+        self.retention = retention
+        self.action_grid = action_grid
+        self.env = Environment(action_type = self.action_type, reward_type = self.reward_type, window = self.window, cheating = self.cheating, reward_scaler = self.reward_scaler, distortions = self.distortions, episode = self.episode, retention = self.retention, action_grid = self.action_grid)
         #['Moving acceptance rate', 'Moving default to paid ratio']
         high = np.array([1])
         low = np.array([0])
     
         self.observation_space = spaces.Box(low, high)
         
-        if(self.action_type == 'discrete_change'):
-            self.action_space = spaces.Discrete(5)
-        elif(self.action_type == 'discrete_action'):
-            self.action_space = spaces.Discrete(20)
+        # discrete action spaces are as large as the threshold grid of the environment
+        if(self.action_type.startswith('discrete')):
+            self.action_space = spaces.Discrete(len(self.env.action_set))
         elif(self.action_type == 'continuous_change'):
             self.min_action = -10
             self.max_action = 10
@@ -41,10 +44,6 @@ class SimulationEnv(gym.Env):
             self.min_action = 5
             self.max_action = 100
             self.action_space = spaces.Box(self.min_action, self.max_action, shape = (1,))
-        elif(self.action_type == 'discrete_action_separate'):
-            self.action_space = spaces.Discrete(100)
-        elif(self.action_type == 'discrete_change_separate'):
-            self.action_space = spaces.Discrete(25)
 
         self._seed()
         self.viewer = None
@@ -60,23 +59,20 @@ class SimulationEnv(gym.Env):
     # step through the episode
     def step(self, action):
 
-        if(self.action_type == 'discrete_change'):
-            assert self.action_space.contains(action), "%r (%s) invalid"%(action, type(action))
-            action = self.env.convert_to_real_action(action)
-        elif(self.action_type == 'discrete_action'):
+        if(self.action_type.startswith('discrete')):
             assert self.action_space.contains(action), "%r (%s) invalid"%(action, type(action))
             action = self.env.convert_to_real_action(action)
             
         self.env.take_action(action)
         self.state = self.env.state
         reward = self.env.reward
-        done = 1 if self.env.iteration == 135 else 0                # finish the episode when all the delayed rewards are learned
+        done = 1 if self.env.iteration == self.episode.done_week else 0                # finish the episode when all the delayed rewards are learned
 
         return np.array(self.state), reward, bool(done), False, {}
 
     # reset the environment
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
-        self.env.run_iterations(iterations = 53, output = False)    # skip the warming-up phase of the simulation
+        self.env.run_iterations(iterations = self.episode.warmup_weeks, output = False)    # skip the warming-up phase of the simulation
         self.state = self.env.state
         return np.array(self.state), {}
@@ -0,0 +1,112 @@
+'''
+Functions save_weights and load_weights store a value function model in a
+compact weights-only file: a JSON header with the format version, the classes
+and settings of the model and its featurizer and the layout of their arrays,
+followed by the raw arrays. Nothing else of the model is stored, so the file
+does not depend on the pickled classes or on sklearn. The arrays are aligned
+in the file and can be memory-mapped, so that many evaluation workers share
+one model file read-only. Function load_model loads a weights file, or a model
+pickled with joblib by earlier versions.
+'''
+
+# import external packages
+import os
+import json
+import numpy as np
+import joblib
+
+# import internal classes
+from model import FeatureTransformer, Model, TileCoder, TileModel
+
+# weights format version, the file starts with the magic bytes and the length of the header
+WEIGHTS_VERSION = 1
+MAGIC = b'CRMODEL\x00'
+ALIGNMENT = 64
+
+# model and featurizer classes that can be stored, with the settings kept in the header
+MODEL_CLASSES = {'Model': Model, 'TileModel': TileModel}
+FEATURIZER_CLASSES = {'FeatureTransformer': FeatureTransformer, 'TileCoder': TileCoder}
+FEATURIZER_SETTINGS = {'FeatureTransformer': {'cache_size': 'cache_size', 'resolution': 'resolution'},
+                       'TileCoder': {'tiles': 'tiles', 'memory': 'dimensions'}}
+
+# offset of the next aligned position
+def aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# save the featurizer parameters and the value weights of a model to a file
+def save_weights(model, path):
+    featurizer = model.feature_transformer
+    featurizer_class = type(featurizer).__name__
+    model_class = type(model).__name__
+    if featurizer_class not in FEATURIZER_CLASSES or model_class not in MODEL_CLASSES:
+        raise ValueError('cannot store a ' + model_class + ' on a ' + featurizer_class)
+    arrays = {'featurizer/' + name: np.ascontiguousarray(array) for name, array in featurizer.to_arrays().items()}
+    arrays.update({'model/' + name: np.ascontiguousarray(array) for name, array in model.to_arrays().items()})
+
+    # array offsets are relative to the start of the data, which follows the header at an aligned position
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = aligned(offset + array.nbytes)
+    header = {'version': WEIGHTS_VERSION,
+              'model': {'class': model_class, 'learning_rate': model.learning_rate, 'schedule': model.schedule, 'power_t': model.power_t},
+              'featurizer': {'class': featurizer_class, 'settings': {setting: getattr(featurizer, attribute) for setting, attribute in FEATURIZER_SETTINGS[featurizer_class].items()}},
+              'arrays': layout}
+    encoded = json.dumps(header).encode('utf-8')
+    data_start = aligned(len(MAGIC) + 8 + len(encoded))
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    # write to a temporary file first so that workers never map a partially written model
+    with open(path + '.tmp', 'wb') as weights_file:
+        weights_file.write(MAGIC)
+        weights_file.write(np.uint64(len(encoded)).tobytes())
+        weights_file.write(encoded)
+        for name, array in arrays.items():
+            weights_file.seek(data_start + layout[name]['offset'])
+            weights_file.write(array.tobytes())
+        weights_file.truncate(data_start + offset)
+    os.replace(path + '.tmp', path)
+
+# read the header of a weights file and the position its data starts at
+def read_header(path):
+    with open(path, 'rb') as weights_file:
+        if weights_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + ' is not a model weights file')
+        length = int(np.frombuffer(weights_file.read(8), dtype = np.uint64)[0])
+        header = json.loads(weights_file.read(length).decode('utf-8'))
+    if header['version'] != WEIGHTS_VERSION:
+        raise ValueError('unsupported model weights version ' + str(header['version']))
+    return header, aligned(len(MAGIC) + 8 + length)
+
+# load a model saved with save_weights, with mmap_mode 'r' the arrays are read-only views of the file shared by all the processes
+# mapping it, with 'c' they are copy-on-write, without mmap_mode they are read into memory
+def load_weights(path, env = None, mmap_mode = None):
+    header, data_start = read_header(path)
+    arrays = {}
+    with open(path, 'rb') as weights_file:
+        for name, layout in header['arrays'].items():
+            dtype = np.dtype(layout['dtype'])
+            shape = tuple(layout['shape'])
+            if mmap_mode is not None and int(np.prod(shape)) > 0:
+                arrays[name] = np.memmap(path, dtype = dtype, mode = mmap_mode, offset = data_start + layout['offset'], shape = shape)
+            else:
+                weights_file.seek(data_start + layout['offset'])
+                arrays[name] = np.fromfile(weights_file, dtype = dtype, count = int(np.prod(shape))).reshape(shape)
+
+    featurizer_class = FEATURIZER_CLASSES[header['featurizer']['class']]
+    featurizer = featurizer_class.from_arrays({name[len('featurizer/'):]: array for name, array in arrays.items() if name.startswith('featurizer/')}, **header['featurizer']['settings'])
+    settings = header['model']
+    model_class = MODEL_CLASSES[settings['class']]
+    return model_class.from_arrays({name[len('model/'):]: array for name, array in arrays.items() if name.startswith('model/')}, featurizer,
+                                   settings['learning_rate'], settings['schedule'], settings['power_t'], env = env)
+
+# load the model saved at path, a weights file with the .crm extension or, for models saved before the weights format, the pickle
+# with the .pkl extension next to it
+def load_model(path, env = None, mmap_mode = None):
+    base = path[:-len('.crm')] if path.endswith('.crm') else path[:-len('.pkl')] if path.endswith('.pkl') else path
+    if not os.path.exists(base + '.crm') and os.path.exists(base + '.pkl'):
+        return joblib.load(base + '.pkl')
+    return load_weights(base + '.crm', env = env, mmap_mode = mmap_mode)
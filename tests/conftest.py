@@ -0,0 +1,12 @@
+'''
+Tests of the modules of the Source folder, which import each other by their
+module names, so the folder is put on the import path.
+'''
+
+# import external packages
+import os
+import sys
+
+SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Source')
+if SOURCE not in sys.path:
+    sys.path.insert(0, SOURCE)
@@ -0,0 +1,70 @@
+'''
+Tests of the running statistics merged from parallel workers against the
+statistics numpy and pandas compute on all the samples at once.
+'''
+
+# import external packages
+import numpy as np
+import pandas as pd
+
+# import internal classes
+from cache import RunningStats, update_moments, merge_moments, cache_key, spawn_seeds
+
+# samples of two columns split into uneven chunks, as the workers compute them
+def sample_chunks(seed = 0):
+    rng = np.random.default_rng(seed)
+    samples = np.column_stack([rng.normal(5, 2, 1000), rng.exponential(3, 1000)])
+    return samples, np.split(samples, [1, 120, 121, 600])
+
+# statistics merged chunk by chunk equal the moments of all the samples
+def test_merged_running_stats_match_numpy():
+    samples, chunks = sample_chunks()
+    stats = RunningStats(['a', 'b'])
+    for chunk in chunks:
+        chunk_stats = RunningStats(['a', 'b'])
+        chunk_stats.update(chunk)
+        stats.merge(chunk_stats)
+    np.testing.assert_array_equal(stats.count, [len(samples)] * 2)
+    np.testing.assert_allclose(stats.mean, np.mean(samples, axis = 0), rtol = 1e-12)
+    np.testing.assert_allclose(stats.m2 / stats.count, np.var(samples, axis = 0), rtol = 1e-10)
+    np.testing.assert_allclose(stats.std, np.std(samples, axis = 0, ddof = 1), rtol = 1e-10)
+    np.testing.assert_array_equal(stats.min, samples.min(axis = 0))
+    np.testing.assert_array_equal(stats.max, samples.max(axis = 0))
+
+# descriptive statistics match pandas describe, quantiles are exact while the sketch is not compressed
+def test_describe_matches_pandas():
+    samples, chunks = sample_chunks(1)
+    stats = RunningStats(['a', 'b'])
+    for chunk in chunks:
+        stats.update(chunk)
+    expected = pd.DataFrame(data = samples, columns = ['a', 'b']).describe()
+    pd.testing.assert_frame_equal(stats.describe(), expected, rtol = 1e-9)
+
+# the compressed sketch keeps quantiles close and the stored statistics restore the same description
+def test_compressed_sketch_and_storage():
+    samples, chunks = sample_chunks(2)
+    stats = RunningStats(['a', 'b'], max_centroids = 50)
+    for chunk in chunks:
+        stats.update(chunk)
+    assert all(len(centroids) <= 100 for centroids in stats.centroids)
+    np.testing.assert_allclose([stats.quantile(0, 0.5), stats.quantile(1, 0.5)], np.median(samples, axis = 0), atol = 0.2)
+    restored = RunningStats.from_arrays(stats.to_arrays(), max_centroids = 50)
+    pd.testing.assert_frame_equal(restored.describe(), stats.describe())
+
+# missing values are skipped by the statistics and by the elementwise moments
+def test_missing_values_are_skipped():
+    stats = RunningStats(['a'])
+    stats.update([[1.0], [np.nan], [3.0]])
+    assert stats.count[0] == 2 and stats.mean[0] == 2
+    first = update_moments(update_moments(None, [1.0, np.nan]), [3.0, 4.0])
+    second = update_moments(None, [5.0, 6.0])
+    merged = merge_moments(first, second)
+    np.testing.assert_array_equal(merged['count'], [3, 2])
+    np.testing.assert_allclose(merged['mean'], [3, 5])
+    np.testing.assert_allclose(merged['m2'] / merged['count'], [np.var([1, 3, 5]), np.var([4, 6])])
+
+# keys depend on the content of the configuration only and seeds do not depend on the number of tasks asked before
+def test_cache_keys_and_seeds():
+    assert cache_key({'a': 1, 'b': [1, 2]}) == cache_key({'b': [1, 2], 'a': 1})
+    assert cache_key({'a': 1}) != cache_key({'a': 2})
+    assert spawn_seeds(0, 3) == spawn_seeds(0, 5)[:3]
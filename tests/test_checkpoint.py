@@ -0,0 +1,90 @@
+'''
+Tests of the checkpoint service: weekly checkpoints and episode snapshots
+restore the weights the agent had when they were requested, weekly checkpoints
+are deltas against the last base until most of the weights changed, and only
+the retained checkpoints and the bases they refer to stay on disk.
+'''
+
+# import external packages
+import os
+import numpy as np
+import pytest
+
+# import internal classes
+from simulation import SimulationEnv
+from model import FeatureTransformer, Model, TileCoder, TileModel, EnvironmentModel
+from policy import Policy
+from agent import Agent
+from checkpoint import CheckpointService, load_checkpoint
+
+STATES = np.linspace(0, 1, 11).reshape(-1, 1)
+
+@pytest.fixture(scope = 'module')
+def env():
+    return SimulationEnv()
+
+# an agent with a dense or a sparse value model
+def make_agent(env, featurizer = 'rbf'):
+    np.random.seed(0)
+    model = Model(env, FeatureTransformer(env), 0.01) if featurizer == 'rbf' else TileModel(env, TileCoder(env), 0.01)
+    return Agent(env, model, EnvironmentModel(env, 0.01), Policy(env), 0.3, 0.9, 0.8, batch_size = 16)
+
+# update the value model on random transitions of some actions
+def train(agent, rng, actions = 20, count = 5):
+    agent.model.update_batch(rng.random((count, 1)), rng.integers(0, actions, count), rng.normal(100, 50, count))
+
+# checkpoints restore the weights at the time they were requested, onto an agent or into an agent built with the saved settings
+def test_restore_weights_at_request_time(tmp_path, env):
+    agent = make_agent(env)
+    service = CheckpointService(str(tmp_path))
+    rng = np.random.default_rng(0)
+    service.snapshot(agent, 'start')
+    start = agent.model.predict_batch(STATES)
+    predictions = []
+    for week in range(4):
+        train(agent, rng)
+        service.save(agent, week)
+        predictions.append(agent.model.predict_batch(STATES))
+        service.flush()
+    train(agent, rng)
+    service.close()
+    restored = load_checkpoint(str(tmp_path))
+    np.testing.assert_array_equal(restored.model.predict_batch(STATES), predictions[-1])
+    assert (restored.eps, restored.gamma1, restored.gamma2, restored.batch_size) == (0.3, 0.9, 0.8, 16)
+    np.testing.assert_array_equal(load_checkpoint(str(tmp_path), 1, agent = agent).model.predict_batch(STATES), predictions[1])
+    np.testing.assert_array_equal(load_checkpoint(str(tmp_path), 'start').model.predict_batch(STATES), start)
+    with pytest.raises(ValueError):
+        load_checkpoint(str(tmp_path), 'missing')
+
+# sparse changes are stored as deltas against the last base, a new base is written when most of the weights changed
+def test_deltas_against_the_last_base(tmp_path, env):
+    agent = make_agent(env, 'tile')
+    service = CheckpointService(str(tmp_path), retention = 10, rebase = 3)
+    rng = np.random.default_rng(1)
+    service.snapshot(agent, 'start')
+    for week in range(5):
+        train(agent, rng, actions = 2, count = 2)
+        service.save(agent, week)
+        service.flush()
+    # the fourth checkpoint is written as a new base after rebase checkpoints against the snapshot
+    assert service.written_deltas == [('0', 'start'), ('1', 'start'), ('2', 'start'), ('3', '3'), ('4', '3')]
+    assert os.path.getsize(str(tmp_path / 'delta_4.npz')) < os.path.getsize(str(tmp_path / 'snapshot_3.model.crm')) / 20
+    agent.model.weights += 1.0
+    service.save(agent, 5)
+    service.close()
+    assert service.written_deltas[-1] == ('5', '5')
+
+# only the retained weekly checkpoints, the last episode snapshots and the bases they refer to are kept
+def test_retention(tmp_path, env):
+    agent = make_agent(env)
+    service = CheckpointService(str(tmp_path), retention = 2, snapshots = 1, rebase = 2)
+    rng = np.random.default_rng(2)
+    service.snapshot(agent, 'start')
+    for week in range(6):
+        train(agent, rng, actions = 2, count = 1)
+        service.save(agent, week)
+        service.flush()
+    service.snapshot(agent, 'end')
+    service.close()
+    assert service.written_deltas == [('4', '4'), ('5', '4')]
+    assert sorted(os.listdir(str(tmp_path))) == ['delta_4.npz', 'delta_5.npz', 'snapshot_4.json', 'snapshot_4.model.crm', 'snapshot_end.json', 'snapshot_end.model.crm']
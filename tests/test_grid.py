@@ -0,0 +1,52 @@
+'''
+Tests of the threshold grids against the per-threshold loop the rewards were
+calculated with before the grids: for each action the values of the
+applications with score at or above its threshold are summed.
+'''
+
+# import external packages
+import numpy as np
+import pandas as pd
+
+# import internal classes
+from grid import ThresholdGrid
+
+# random applications with scores on and between the grid thresholds
+def applications(size = 500, seed = 0):
+    rng = np.random.default_rng(seed)
+    scores = np.concatenate([rng.integers(0, 101, size // 2), rng.uniform(0, 100, size - size // 2)])
+    return pd.DataFrame({'score': scores, 'value': rng.normal(0, 100, size), 'repeat': rng.random(size) < 0.4})
+
+# sum of values for each action threshold, one threshold at a time
+def baseline_rewards(grid, cohort):
+    scores, values, repeat = cohort['score'].values, cohort['value'].values, cohort['repeat'].values
+    rewards = []
+    for action, threshold in grid.action_dict().items():
+        if grid.separate:
+            threshold_repeat, threshold_new = threshold
+            rewards.append(values[~repeat & (scores >= threshold_new)].sum() + values[repeat & (scores >= threshold_repeat)].sum())
+        else:
+            rewards.append(values[scores >= threshold].sum())
+    return np.array(rewards)
+
+# the single threshold grid of the environment and a fine 1-point grid
+def test_evaluate_matches_per_threshold_loop():
+    cohort = applications()
+    for grid in [ThresholdGrid(low = 5, high = 100, step = 5), ThresholdGrid(low = 0, high = 100, step = 1)]:
+        rewards = grid.evaluate(cohort['score'].values, cohort['value'].values, cohort['repeat'].values)
+        np.testing.assert_allclose(rewards, baseline_rewards(grid, cohort), rtol = 1e-9, atol = 1e-6)
+
+# separate grids for new and repeat clients, including a 1-point 100 x 100 grid with its own repeat axis
+def test_separate_evaluate_matches_per_threshold_loop():
+    cohort = applications(seed = 1)
+    grids = [ThresholdGrid(low = 5, high = 95, step = 10, separate = True),
+             ThresholdGrid(low = 1, high = 100, step = 1, separate = True),
+             ThresholdGrid(low = 10, high = 90, step = 20, separate = True, repeat_low = 0, repeat_high = 100, repeat_step = 25)]
+    for grid in grids:
+        rewards = grid.evaluate(cohort['score'].values, cohort['value'].values, cohort['repeat'].values)
+        np.testing.assert_allclose(rewards, baseline_rewards(grid, cohort), rtol = 1e-9, atol = 1e-6)
+
+# no applications give zero rewards for every action
+def test_evaluate_without_applications():
+    grid = ThresholdGrid(low = 5, high = 95, step = 10, separate = True)
+    np.testing.assert_array_equal(grid.evaluate(np.zeros(0), np.zeros(0), np.zeros(0, dtype = bool)), np.zeros(len(grid)))
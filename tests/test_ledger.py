@@ -0,0 +1,72 @@
+'''
+Tests of the ledger retention policies: compact retention folds settled loans
+into cohort aggregates and evicts them without changing the rewards, the states
+and the statistics of the settled loans of a seeded episode.
+'''
+
+# import external packages
+import numpy as np
+import pandas as pd
+import pytest
+
+# import internal classes
+from environment import Environment
+from ledger import Ledger
+
+# run a seeded episode with a retention policy
+def run_episode(retention, weeks = 30, seed = 3):
+    np.random.seed(seed)
+    env = Environment(reward_type = 'moving', retention = retention)
+    env.run_iterations(weeks, output = False)
+    return env
+
+# rewards, true rewards and states of a seeded episode do not depend on the retention policy
+def test_full_and_compact_retention_give_identical_rewards():
+    full = run_episode('full')
+    compact = run_episode('compact')
+    pd.testing.assert_frame_equal(full.rewards, compact.rewards)
+    pd.testing.assert_frame_equal(full.true_rewards, compact.true_rewards)
+    pd.testing.assert_frame_equal(full.states, compact.states)
+    assert full.reward == compact.reward
+
+# full retention keeps every loan, compact retention only the open ones and counts the evicted ones
+def test_compact_retention_keeps_only_open_loans():
+    full = run_episode('full')
+    compact = run_episode('compact')
+    assert full.result.shape[0] > compact.result.shape[0]
+    assert compact.ledger.settled > 0
+    assert compact.ledger.settled + compact.ledger.open_loans == full.result.shape[0]
+    assert set(compact.result.index) <= set(full.result.index)
+    # loans still open have an event after the last settled week
+    last_events = compact.result[['maturation_at', 'dca_at', 'late_payment_at']].apply(pd.to_numeric, errors = 'coerce').max(axis = 1)
+    assert (last_events > compact.iteration - 1).all()
+
+# the cohort aggregates do not depend on the retention policy and match the settled loans kept row by row
+def test_cohort_aggregates_match_settled_rows():
+    full = run_episode('full')
+    compact = run_episode('compact')
+    pd.testing.assert_frame_equal(full.cohorts, compact.cohorts)
+    loans = full.result
+    settled = loans[full.ledger.settlement_weeks(loans) <= full.iteration - 1]
+    assert compact.ledger.settled == settled.shape[0]
+    frame = compact.cohorts
+    np.testing.assert_array_equal(frame.groupby(level = 'cohort')['applications'].sum(), settled.groupby('iteration').size())
+    np.testing.assert_array_equal(frame.groupby(level = 'cohort')['accepted'].sum(), settled.groupby('iteration')['accept'].sum())
+    # settled value for each threshold, one threshold at a time
+    thresholds = np.arange(0, 101, 10)
+    lost = (settled['dca'] == True) & (settled['late_payment'] == 0)
+    value = settled['profit'].where(~lost, -settled['sum'])
+    accepted = settled['accept'] == True
+    expected = [[value[(settled['iteration'] == cohort) & (settled['score'] >= threshold)].sum() for threshold in thresholds]
+                for cohort in sorted(settled['iteration'].unique())]
+    expected_accepted = [[value[(settled['iteration'] == cohort) & (settled['score'] >= threshold) & accepted].sum() for threshold in thresholds]
+                         for cohort in sorted(settled['iteration'].unique())]
+    np.testing.assert_allclose(compact.ledger.cohort_rewards(thresholds).values, expected, rtol = 1e-9, atol = 1e-6)
+    np.testing.assert_allclose(compact.ledger.cohort_rewards(thresholds, accepted_only = True).values, expected_accepted, rtol = 1e-9, atol = 1e-6)
+
+# the environment keeps memory bounded by the open loans by default
+def test_default_retention_is_compact():
+    assert Environment().retention == 'compact'
+    assert Ledger().retention == 'compact'
+    with pytest.raises(ValueError):
+        Ledger('partial')
@@ -0,0 +1,75 @@
+'''
+Tests of the state metrics registry against the state columns the Environment
+calculated eagerly before the registry. data/baseline_states.csv holds the
+states of a 20 week episode of Environment(reward_type = 'moving') seeded with
+np.random.seed(1), generated with the Environment of the baseline version.
+'''
+
+# import external packages
+import os
+import numpy as np
+import pandas as pd
+
+# import internal classes
+from environment import Environment
+from metrics import state_metrics
+
+BASELINE_STATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'baseline_states.csv')
+
+# weekly base values of the environment, random but consistent with each other
+def base_rows(weeks = 12, seed = 0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for week in range(weeks):
+        new_applications, repeat_applications = rng.integers(0, 50, size = 2)
+        new_accepted, repeat_accepted = rng.integers(0, new_applications + 1), rng.integers(0, repeat_applications + 1)
+        rows.append({'State profit': float(rng.normal(0, 1000)),
+                     'State applications': new_applications + repeat_applications,
+                     'State new applications': new_applications,
+                     'State repeat applications': repeat_applications,
+                     'State accepted': new_accepted + repeat_accepted,
+                     'State new accepted': new_accepted,
+                     'State repeat accepted': repeat_accepted,
+                     'State defaulted': rng.integers(0, 10),
+                     'State paid': rng.integers(0, 10),
+                     'State defaulted paid': rng.integers(0, 5)})
+    return rows
+
+# the states of a seeded episode match the baseline columns, the baseline left the squared moving acceptance rate undefined
+# during the first window where the registry gives 0 like all the other moving metrics
+def test_state_metrics_match_baseline_columns():
+    baseline = pd.read_csv(BASELINE_STATES, index_col = 0)
+    np.random.seed(1)
+    env = Environment(reward_type = 'moving')
+    env.run_iterations(len(baseline), output = False)
+    states = env.states
+    assert set(states.columns) == set(baseline.columns)
+    np.testing.assert_allclose(states[baseline.columns].values, baseline.fillna(0).values, rtol = 1e-9, atol = 1e-9)
+
+# metrics calculated lazily on access equal the ones required and calculated every week
+def test_lazy_metrics_match_required_metrics():
+    lazy = state_metrics(4)
+    lazy.require(['State acceptance rate'])
+    eager = state_metrics(4)
+    eager.require(list(eager.metrics))
+    for row in base_rows():
+        lazy.record(row)
+        eager.record(row)
+    assert lazy.plan == ['State acceptance rate']
+    pd.testing.assert_frame_equal(lazy.frame(), eager.frame())
+
+# totals are cumulative sums and moving values are sums over the window and the current week, 0 during the first window
+def test_total_and_moving_metrics():
+    window = 4
+    registry = state_metrics(window)
+    rows = base_rows()
+    for row in rows:
+        registry.record(row)
+    frame = registry.frame()
+    base = pd.DataFrame(data = rows, index = range(1, len(rows) + 1), dtype = float)
+    for name in base.columns:
+        np.testing.assert_allclose(frame[name.replace('State', 'Total')], base[name].cumsum())
+        moving = base[name].rolling(window + 1).sum().fillna(0)
+        np.testing.assert_allclose(frame[name.replace('State', 'Moving')], moving)
+    accepted = base['State accepted']
+    np.testing.assert_allclose(frame['State acceptance rate'], np.where(accepted != 0, accepted / base['State applications'].where(accepted != 0, 1), 0))
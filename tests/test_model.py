@@ -0,0 +1,112 @@
+'''
+Tests of the native value function model against the per-action sklearn
+SGDRegressors it replaced. Features are passed to sklearn as float64 so that
+both sides compute the same SGD steps.
+'''
+
+# import external packages
+import numpy as np
+import pytest
+from sklearn.linear_model import SGDRegressor
+
+# import internal classes
+from simulation import SimulationEnv
+from model import FeatureTransformer, Model
+
+@pytest.fixture(scope = 'module')
+def env():
+    return SimulationEnv()
+
+@pytest.fixture(scope = 'module')
+def feature_transformer(env):
+    np.random.seed(0)
+    return FeatureTransformer(env, cache_size = 0)
+
+# regressors set up as the baseline model did, fitted once to a zero target
+def baseline_regressors(env, feature_transformer, learning_rate):
+    regressors = []
+    for action in range(env.action_space.n):
+        regressor = SGDRegressor(alpha = 0, l1_ratio = 0, max_iter = 1, shuffle = False, epsilon = 0, learning_rate = 'invscaling', eta0 = learning_rate, power_t = 0.25)
+        regressor.partial_fit(feature_transformer.transform(env.observation_space.sample()), [0])
+        regressors.append(regressor)
+    return regressors
+
+# random (state, action, target) transitions, with repeated actions
+def transitions(count = 60, seed = 0):
+    rng = np.random.default_rng(seed)
+    states = rng.random((count, 1))
+    actions = rng.integers(0, 4, count)
+    targets = rng.normal(100, 50, count)
+    return states, actions, targets
+
+# the weights, intercepts and update counts of each action equal the coefficients of its regressor
+def assert_matches_regressors(model, regressors):
+    for action, regressor in enumerate(regressors):
+        np.testing.assert_allclose(model.weights[:, action], regressor.coef_, rtol = 1e-9, atol = 1e-12)
+        np.testing.assert_allclose(model.intercepts[action], regressor.intercept_[0], rtol = 1e-9, atol = 1e-12)
+        assert model.t[action] == regressor.t_
+
+# update matches partial_fit with the invscaling schedule from the same update count
+def test_update_matches_sgd_regressor_partial_fit(env, feature_transformer):
+    model = Model(env, feature_transformer, 0.01)
+    regressors = baseline_regressors(env, feature_transformer, 0.01)
+    assert_matches_regressors(model, regressors)
+    states, actions, targets = transitions()
+    for s, a, G in zip(states, actions, targets):
+        model.update(s, a, G)
+        regressors[a].partial_fit(feature_transformer.transform([s]), [G])
+    assert_matches_regressors(model, regressors)
+    state = np.array([0.35])
+    X = feature_transformer.transform([state])
+    np.testing.assert_allclose(model.predict(state), [regressor.predict(X)[0] for regressor in regressors], rtol = 1e-9)
+
+# a reset learning rate switches both to a constant schedule
+def test_set_learning_rate_matches_constant_schedule(env, feature_transformer):
+    model = Model(env, feature_transformer, 0.01)
+    regressors = baseline_regressors(env, feature_transformer, 0.01)
+    model.set_learning_rate(0.001)
+    for regressor in regressors:
+        regressor.eta0 = 0.001
+        regressor.t_ = 2.0
+        regressor.learning_rate = 'constant'
+    states, actions, targets = transitions(seed = 1)
+    for s, a, G in zip(states, actions, targets):
+        model.update(s, a, G)
+        regressors[a].partial_fit(feature_transformer.transform([s]), [G])
+    assert_matches_regressors(model, regressors)
+
+# every update gives the model a new version
+def test_update_changes_version(env, feature_transformer):
+    model = Model(env, feature_transformer, 0.01)
+    version = model.version
+    model.update(np.array([0.5]), 0, 1.0)
+    assert model.version != version
+
+# a batch update with the triangular solve equals updating the transitions one by one in their order
+def test_update_batch_matches_sequential_updates(env, feature_transformer):
+    sequential = Model(env, feature_transformer, 0.05)
+    batched = Model(env, feature_transformer, 0.05)
+    for seed in range(3):
+        states, actions, targets = transitions(count = 40, seed = seed)
+        for s, a, G in zip(states, actions, targets):
+            sequential.update(s, a, G)
+        batched.update_batch(states, actions, targets)
+        np.testing.assert_allclose(batched.weights, sequential.weights, rtol = 1e-8, atol = 1e-10)
+        np.testing.assert_allclose(batched.intercepts, sequential.intercepts, rtol = 1e-8, atol = 1e-10)
+        np.testing.assert_array_equal(batched.t, sequential.t)
+    np.testing.assert_allclose(batched.predict_batch(states), [sequential.predict(s) for s in states], rtol = 1e-8)
+
+# with a constant learning rate and an empty batch
+def test_update_batch_constant_schedule_and_empty_batch(env, feature_transformer):
+    sequential = Model(env, feature_transformer, 0.01)
+    batched = Model(env, feature_transformer, 0.01)
+    sequential.set_learning_rate(0.002)
+    batched.set_learning_rate(0.002)
+    states, actions, targets = transitions(count = 30, seed = 5)
+    for s, a, G in zip(states, actions, targets):
+        sequential.update(s, a, G)
+    batched.update_batch(states, actions, targets)
+    np.testing.assert_allclose(batched.weights, sequential.weights, rtol = 1e-8, atol = 1e-10)
+    version = batched.version
+    batched.update_batch(np.zeros((0, 1)), [], [])
+    assert batched.version == version
@@ -0,0 +1,59 @@
+'''
+Tests of the serial runs of the Monte Carlo and scenario grid runners: the
+environment or agent set up for the run does not outlive it, also when the run
+fails.
+'''
+
+# import external packages
+import numpy as np
+import pandas as pd
+import pytest
+
+# import internal classes
+import montecarlo
+import scenarios
+from episode import EpisodeConfig
+from montecarlo import MonteCarloRunner
+from scenarios import ScenarioGridRunner, grid_design
+
+# environment whose true rewards are random numbers of the seeded episode, failing on the episode with the seed given
+class RandomRewardsEnvironment:
+    def __init__(self, cheating = False, fail_seed = None):
+        self.action_set = {action: action for action in range(4)}
+        self.episode = EpisodeConfig()
+        self.fail_seed = fail_seed
+
+    def run_iterations(self, output = True):
+        rewards = np.random.random((self.episode.reward_end + 1, len(self.action_set)))
+        if self.fail_seed is not None:
+            raise RuntimeError('episode failed')
+        self.true_rewards = pd.DataFrame(data = rewards)
+
+# a serial run writes the results of every episode and clears the worker state
+def test_serial_monte_carlo_run_clears_worker():
+    runner = MonteCarloRunner(RandomRewardsEnvironment, {}, 5, processes = 1, report_every = 100).run(report = lambda runner: None)
+    assert runner.finished.all()
+    assert np.all(runner.totals > 0)
+    assert montecarlo.worker == {}
+    with pytest.raises(RuntimeError):
+        MonteCarloRunner(RandomRewardsEnvironment, {'fail_seed': 0}, 2, processes = 1).run(report = lambda runner: None)
+    assert montecarlo.worker == {}
+
+# the agent of a serial scenario run is released after the run, also when an episode fails
+def test_serial_scenario_run_clears_worker(tmp_path, monkeypatch):
+    weights_path = str(tmp_path / 'agent.crm')
+    with open(weights_path, 'wb') as weights_file:
+        weights_file.write(b'weights')
+    monkeypatch.setattr(scenarios, 'init_worker', lambda weights_path, eps, sample_action: scenarios.worker.update(agent = object()))
+    monkeypatch.setattr(scenarios, 'run_scenario', lambda scenario, episode, distortions, seed: (scenario, episode, np.zeros(5)))
+    runner = ScenarioGridRunner(weights_path, grid_design({'e': [1, 2]}), episodes = 2, directory = str(tmp_path / 'study'), processes = 1)
+    runner.run(report = lambda runner: None)
+    assert np.asarray(runner.finished).all()
+    assert scenarios.worker == {}
+
+    def fail(scenario, episode, distortions, seed):
+        raise RuntimeError('episode failed')
+    monkeypatch.setattr(scenarios, 'run_scenario', fail)
+    with pytest.raises(RuntimeError):
+        ScenarioGridRunner(weights_path, grid_design({'e': [3]}), directory = str(tmp_path / 'failed'), processes = 1).run(report = lambda runner: None)
+    assert scenarios.worker == {}
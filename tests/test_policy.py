@@ -0,0 +1,116 @@
+'''
+Tests of the batched policy engine against the per-state samplers it replaced:
+the action frequencies of each sampler on a fixed Q-value matrix match the
+probabilities of the former formulas, ties of the greedy actions are broken
+uniformly, the windows of the lower samplers are clamped at the first action
+and equal Q-values in a window give a uniform choice.
+'''
+
+# import external packages
+import numpy as np
+import pytest
+
+# import internal classes
+from policy import PolicyEngine, Policy
+
+Q_VALUES = np.array([1.0, 3.0, 2.5, 4.0, 3.5, 0.5])
+GREEDY = 3
+SAMPLES = 40000
+
+@pytest.fixture
+def engine():
+    np.random.seed(0)
+    return PolicyEngine()
+
+# the fixed Q-values repeated for a batch of states
+def batch(q_values = Q_VALUES, samples = SAMPLES):
+    return np.tile(q_values, (samples, 1))
+
+# boltzmann-Q probabilities of the former samplers over the actions from low to high
+def boltzmann_probabilities(q_values, tau, low = 0, high = None, clip = (-500, 500)):
+    high = len(q_values) - 1 if high is None else high
+    window = q_values[low:high + 1]
+    normed = (window - window.mean()) / window.std() if window.std() != 0 else window - window.mean()
+    exp_values = np.exp(np.clip(normed / tau, clip[0], clip[1]))
+    probabilities = np.zeros(len(q_values))
+    probabilities[low:high + 1] = exp_values / np.sum(exp_values)
+    return probabilities
+
+# action frequencies are within sampling error of the probabilities
+def assert_frequencies(actions, probabilities):
+    frequencies = np.bincount(actions, minlength = len(probabilities)) / len(actions)
+    tolerance = 5 * np.sqrt(probabilities * (1 - probabilities) / len(actions)) + 1e-12
+    assert np.all(np.abs(frequencies - probabilities) <= tolerance), (frequencies, probabilities)
+
+# the boltzmann samplers match the softmax of the standardized and clipped Q-values of their windows
+@pytest.mark.parametrize('tau', [0.3, 1.0])
+def test_boltzmann_frequencies_match_former_probabilities(engine, tau):
+    assert_frequencies(engine.boltzmann_actions(batch(), tau), boltzmann_probabilities(Q_VALUES, tau))
+    assert_frequencies(engine.lower_boltzmann_actions(batch(), tau), boltzmann_probabilities(Q_VALUES, tau, high = GREEDY))
+    assert_frequencies(engine.lower_boltzmann_greedy_actions(batch(), tau), boltzmann_probabilities(Q_VALUES, tau, low = GREEDY - 3, high = GREEDY))
+    # a tight clip flattens the logits as in the former samplers
+    assert_frequencies(engine.boltzmann_actions(batch(), tau, clip = (-0.5, 0.5)), boltzmann_probabilities(Q_VALUES, tau, clip = (-0.5, 0.5)))
+
+# the epsilon samplers match the mixtures of the greedy action and their exploration actions
+def test_eps_greedy_frequencies_match_former_probabilities(engine):
+    eps = 0.3
+    actions = len(Q_VALUES)
+    greedy = np.eye(actions)[GREEDY]
+    below = np.eye(actions)[GREEDY - 1]
+    up_to_greedy = np.where(np.arange(actions) <= GREEDY, 1 / (GREEDY + 1), 0)
+    np.testing.assert_array_equal(engine.greedy_actions(batch(samples = 100)), np.full(100, GREEDY))
+    assert_frequencies(engine.eps_greedy_actions(batch(), eps), (1 - eps) * greedy + eps / actions)
+    assert_frequencies(engine.one_lower_eps_greedy_actions(batch(), eps), (1 - eps) * greedy + eps * below)
+    assert_frequencies(engine.lower_eps_greedy_actions(batch(), eps), (1 - eps) * greedy + eps * up_to_greedy)
+    assert_frequencies(engine.lower_eps_greedy_actions(batch(), eps, sub = True), (1 - eps) * below + eps * up_to_greedy)
+
+# ties of the greedy actions are broken uniformly and independently for each state of the batch
+def test_greedy_ties_are_broken_at_random(engine):
+    q_values = np.array([1.0, 2.0, 4.0, 0.0, 4.0, 4.0])
+    actions = engine.greedy_actions(batch(q_values))
+    assert_frequencies(actions, np.array([0, 0, 1, 0, 1, 1]) / 3)
+    mixed = np.vstack([batch(q_values, 1000), batch(Q_VALUES, 1000)])
+    actions = engine.greedy_actions(mixed)
+    assert set(actions[:1000]) == {2, 4, 5}
+    assert set(actions[1000:]) == {GREEDY}
+
+# the window of the lower boltzmann greedy sampler starts at the first action when the greedy action is one of the first three
+def test_lower_window_is_clamped_at_the_first_action(engine):
+    q_values = np.array([2.0, 5.0, 1.0, 0.0, 3.0, -1.0])
+    actions = engine.lower_boltzmann_greedy_actions(batch(q_values), 0.5)
+    assert set(actions) == {0, 1}
+    assert_frequencies(actions, boltzmann_probabilities(q_values, 0.5, low = 0, high = 1))
+    np.testing.assert_array_equal(engine.one_lower_eps_greedy_actions(batch(np.arange(6.0)[::-1], 100), 1.0), np.zeros(100))
+
+# equal Q-values in the window give a uniform choice among its actions
+def test_equal_values_give_a_uniform_choice(engine):
+    flat = np.full(6, 7.0)
+    assert_frequencies(engine.boltzmann_actions(batch(flat), 0.1), np.full(6, 1 / 6))
+    assert_frequencies(engine.boltzmann_actions(batch(flat), 0.1, low = 2, high = 4), np.array([0, 0, 1, 1, 1, 0]) / 3)
+    q_values = np.array([1.0, 1.0, 1.0, 2.0, 0.0, 0.0])
+    assert_frequencies(engine.lower_boltzmann_actions(batch(q_values), 1.0), boltzmann_probabilities(q_values, 1.0, high = 3))
+
+# a model predicting the fixed Q-values, counting its predictions
+class FixedModel:
+    def __init__(self, q_values):
+        self.q_values = q_values
+        self.predictions = 0
+
+    def predict(self, s):
+        self.predictions += 1
+        return self.q_values.copy()
+
+    def predict_batch(self, states):
+        self.predictions += 1
+        return np.tile(self.q_values, (len(states), 1))
+
+# the samplers of a single state predict once with each model and sample from the average of the model and target model values
+def test_policy_samplers_predict_once(engine):
+    policy = Policy(None)
+    model = FixedModel(Q_VALUES)
+    target_model = FixedModel(np.array([2.0, 1.0, 3.5, 3.0, 4.5, 1.5]))
+    actions = [policy.lower_boltzmann_q_greedy_sample_action(model, np.array([0.5]), 0.5, target_model) for sample in range(2000)]
+    assert model.predictions == target_model.predictions == 2000
+    average = (Q_VALUES + target_model.q_values) / 2
+    assert_frequencies(np.array(actions), boltzmann_probabilities(average, 0.5, low = 1, high = 4))
+    np.testing.assert_array_equal(policy.q_matrix(model, np.full((4, 1), 0.5), target_model), np.tile(average, (4, 1)))
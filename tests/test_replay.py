@@ -0,0 +1,119 @@
+'''
+Tests of the replay buffer: transitions are stored in a ring under increasing
+ids, the oldest are overwritten when it is full, and delayed rewards are
+updated, or transitions removed, only while they are still in the buffer.
+The prioritized buffer returns the transitions with the highest priorities
+first and queues only the transitions still in the buffer.
+'''
+
+# import external packages
+import numpy as np
+
+# import internal classes
+from replay import ReplayBuffer, PrioritizedReplayBuffer
+
+# transitions between 1-dimensional states numbered from a first value, the reward is the number
+def transitions(first, count):
+    numbers = np.arange(first, first + count, dtype = float)
+    return numbers.reshape(-1, 1), numbers.astype(int) % 4, numbers.reshape(-1, 1) + 0.5, numbers
+
+# transitions are stored under increasing ids and read back by id
+def test_push_and_get():
+    buffer = ReplayBuffer(5, 1)
+    assert len(buffer) == 0
+    np.testing.assert_array_equal(buffer.push(*transitions(0, 3), time = 7), [0, 1, 2])
+    np.testing.assert_array_equal(buffer.push(*transitions(3, 0)), np.zeros(0))
+    assert len(buffer) == 3 and buffer.pushed == 3
+    prev_states, actions, states, rewards = buffer.get([2, 0])
+    np.testing.assert_array_equal(prev_states[:, 0], [2, 0])
+    np.testing.assert_array_equal(actions, [2, 0])
+    np.testing.assert_array_equal(states[:, 0], [2.5, 0.5])
+    np.testing.assert_array_equal(rewards, [2, 0])
+    np.testing.assert_array_equal(buffer.contents()[4], [7, 7, 7])
+    np.testing.assert_array_equal(buffer.contains([0, 2, 3, -1]), [True, True, False, False])
+
+# a full buffer overwrites its oldest transitions, a push larger than the buffer keeps its last transitions
+def test_oldest_transitions_are_evicted():
+    buffer = ReplayBuffer(5, 1)
+    buffer.push(*transitions(0, 3))
+    np.testing.assert_array_equal(buffer.push(*transitions(3, 4)), [3, 4, 5, 6])
+    assert len(buffer) == 5
+    np.testing.assert_array_equal(buffer.contains(np.arange(7)), [False, False, True, True, True, True, True])
+    np.testing.assert_array_equal(np.sort(buffer.contents()[3]), [2, 3, 4, 5, 6])
+    np.testing.assert_array_equal(buffer.push(*transitions(7, 12)), np.arange(7, 19))
+    assert len(buffer) == 5 and buffer.pushed == 19
+    np.testing.assert_array_equal(np.flatnonzero(buffer.contains(np.arange(19))), np.arange(14, 19))
+    np.testing.assert_array_equal(buffer.get(np.arange(14, 19))[3], np.arange(14, 19))
+
+# rewards are updated for transitions still in the buffer, an overwritten id does not change the transition in its slot
+def test_update_rewards():
+    buffer = ReplayBuffer(4, 1)
+    buffer.push(*transitions(0, 6))
+    found = buffer.update_rewards([5, 1, 3], [50.0, 10.0, 30.0])
+    np.testing.assert_array_equal(found, [True, False, True])
+    np.testing.assert_array_equal(buffer.get([2, 3, 4, 5])[3], [2, 30, 4, 50])
+
+# removed transitions leave the buffer and are never sampled, their slots are filled again in ring order
+def test_remove():
+    np.random.seed(0)
+    buffer = ReplayBuffer(4, 1)
+    buffer.push(*transitions(0, 4))
+    np.testing.assert_array_equal(buffer.remove([1, 2, 9]), [True, True, False])
+    np.testing.assert_array_equal(buffer.remove([1]), [False])
+    assert len(buffer) == 2
+    np.testing.assert_array_equal(buffer.update_rewards([1], [100.0]), [False])
+    assert set(buffer.sample_uniform(200)) == {0, 3}
+    np.testing.assert_array_equal(np.sort(buffer.contents()[3]), [0, 3])
+    buffer.push(*transitions(4, 2))
+    assert len(buffer) == 3
+    np.testing.assert_array_equal(buffer.contains(np.arange(6)), [False, False, False, True, True, True])
+
+# ids in the priority queue
+def queued(buffer):
+    return set(buffer.queue.entry_finder)
+
+# new transitions are sampled first in push order, then the transitions by their priorities, highest first, a new
+# transition keeps the highest priority seen when it was pushed
+def test_prioritized_sampling_order():
+    buffer = PrioritizedReplayBuffer(10, 1)
+    buffer.push(*transitions(0, 4))
+    np.testing.assert_array_equal(buffer.sample_ids(3), [0, 1, 2])
+    assert queued(buffer) == {3}
+    buffer.set_priorities([0, 1, 2], [0.5, 4.0, 2.0])
+    assert buffer.max_priority == 4.0
+    np.testing.assert_array_equal(buffer.sample_ids(10), [1, 2, 3, 0])
+    assert buffer.queue.empty()
+    np.testing.assert_array_equal(buffer.sample_ids(2), np.zeros(0))
+
+# new transitions and changed rewards get the highest priority seen so far
+def test_prioritized_new_and_changed_transitions_come_first():
+    buffer = PrioritizedReplayBuffer(10, 1)
+    buffer.push(*transitions(0, 3))
+    buffer.set_priorities(buffer.sample_ids(3), [3.0, 1.0, 2.0])
+    buffer.push(*transitions(3, 1))
+    np.testing.assert_array_equal(buffer.update_rewards([1, 20], [10.0, 20.0]), [True, False])
+    np.testing.assert_array_equal(buffer.sample_ids(4), [0, 3, 1, 2])
+
+# overwritten and removed transitions leave the queue and their priorities are not set again
+def test_prioritized_eviction_and_removal():
+    buffer = PrioritizedReplayBuffer(4, 1)
+    buffer.push(*transitions(0, 3))
+    ids = buffer.sample_ids(3)
+    buffer.push(*transitions(3, 3))
+    assert queued(buffer) == {3, 4, 5}
+    np.testing.assert_array_equal(buffer.remove([4, 0]), [True, False])
+    assert queued(buffer) == {3, 5}
+    buffer.set_priorities(np.append(ids, 4), [5.0, 5.0, 5.0, 5.0])
+    assert queued(buffer) == {2, 3, 5}
+    np.testing.assert_array_equal(buffer.sample_ids(4), [2, 3, 5])
+    buffer.push(*transitions(6, 9))
+    assert queued(buffer) == set(range(11, 15))
+
+# replaced entries do not grow the heap without bound
+def test_prioritized_queue_is_rebuilt():
+    buffer = PrioritizedReplayBuffer(4, 1)
+    buffer.push(*transitions(0, 4))
+    for step in range(100):
+        buffer.set_priorities(np.arange(4), np.full(4, float(step)))
+    assert len(buffer.queue.pq) <= 3 * 4 + 4
+    np.testing.assert_array_equal(np.sort(buffer.sample_ids(4)), np.arange(4))
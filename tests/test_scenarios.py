@@ -0,0 +1,46 @@
+'''
+Tests of the scenario grid runner: an interrupted study resumes its result cube
+only for the same design and agent weights.
+'''
+
+# import external packages
+import numpy as np
+import pytest
+
+# import internal classes
+from simulation import SimulationEnv
+from model import FeatureTransformer, Model
+from weights import save_weights
+from scenarios import ScenarioGridRunner, grid_design
+
+@pytest.fixture
+def model():
+    np.random.seed(0)
+    env = SimulationEnv()
+    return Model(env, FeatureTransformer(env), 0.01)
+
+# open a study of two scenarios of two episodes for the weights saved at the path
+def open_study(weights_path, directory):
+    runner = ScenarioGridRunner(weights_path, grid_design({'e': [1, 2]}), episodes = 2, directory = directory)
+    runner.open()
+    return runner
+
+# the same weights saved again resume the study, changed weights saved to the same path start it again
+def test_study_is_keyed_by_the_weights(tmp_path, model):
+    weights_path = str(tmp_path / 'agent.crm')
+    directory = str(tmp_path / 'scenarios')
+    save_weights(model, weights_path)
+    runner = open_study(weights_path, directory)
+    runner.finish(0, 0, np.arange(5, dtype = float), lambda runner: None)
+    del runner
+
+    save_weights(model, weights_path)
+    resumed = open_study(weights_path, directory)
+    np.testing.assert_array_equal(resumed.finished, [[True, False], [False, False]])
+    np.testing.assert_array_equal(resumed.results[0, 0], np.arange(5))
+    del resumed
+
+    model.update(np.array([0.5]), 0, 100.0)
+    save_weights(model, weights_path)
+    restarted = open_study(weights_path, directory)
+    assert not np.asarray(restarted.finished).any()
@@ -0,0 +1,118 @@
+'''
+Tests of the weights-only model format: saving and loading a model restores its
+predictions, read into memory or memory-mapped, and Model.save and Model.load
+go through the format with the pickle of earlier versions as a fallback.
+'''
+
+# import external packages
+import os
+import numpy as np
+import pytest
+import joblib
+from sklearn.linear_model import SGDRegressor
+
+# import internal classes
+from simulation import SimulationEnv
+from model import FeatureTransformer, Model, TileCoder, TileModel
+from weights import save_weights, load_weights, load_model, read_header
+
+@pytest.fixture(scope = 'module')
+def env():
+    return SimulationEnv()
+
+# a model of each class with trained weights
+@pytest.fixture(scope = 'module', params = ['rbf', 'tile'])
+def model(request, env):
+    np.random.seed(0)
+    if request.param == 'rbf':
+        model = Model(env, FeatureTransformer(env), 0.01)
+    else:
+        model = TileModel(env, TileCoder(env), 0.01)
+    rng = np.random.default_rng(0)
+    model.update_batch(rng.random((50, 1)), rng.integers(0, env.action_space.n, 50), rng.normal(100, 50, 50))
+    return model
+
+STATES = np.linspace(0, 1, 21).reshape(-1, 1)
+
+# the loaded model predicts the same values and keeps its settings, whatever the way its arrays are read
+@pytest.mark.parametrize('mmap_mode', [None, 'r', 'c'])
+def test_round_trip(tmp_path, env, model, mmap_mode):
+    path = str(tmp_path / 'model.crm')
+    save_weights(model, path)
+    loaded = load_weights(path, env = env, mmap_mode = mmap_mode)
+    assert type(loaded) is type(model)
+    assert type(loaded.feature_transformer) is type(model.feature_transformer)
+    np.testing.assert_array_equal(loaded.predict_batch(STATES), model.predict_batch(STATES))
+    np.testing.assert_array_equal(loaded.t, model.t)
+    assert (loaded.learning_rate, loaded.schedule, loaded.power_t) == (model.learning_rate, model.schedule, model.power_t)
+    assert loaded.env is env
+    assert isinstance(loaded.weights, np.memmap) == (mmap_mode is not None)
+
+# read-only mapped weights cannot be updated, copy-on-write mapped weights are updated in memory and the file is unchanged
+def test_mapped_weights_are_not_written_back(tmp_path, env, model):
+    path = str(tmp_path / 'model.crm')
+    save_weights(model, path)
+    read_only = load_weights(path, env = env, mmap_mode = 'r')
+    assert not read_only.weights.flags.writeable
+    with pytest.raises(ValueError):
+        read_only.update(np.array([0.5]), 0, 1000.0)
+    copy_on_write = load_weights(path, env = env, mmap_mode = 'c')
+    copy_on_write.update(np.array([0.5]), 0, 1000.0)
+    assert not np.array_equal(copy_on_write.predict_batch(STATES), model.predict_batch(STATES))
+    np.testing.assert_array_equal(load_weights(path, env = env).predict_batch(STATES), model.predict_batch(STATES))
+
+# arrays are aligned in the file and a file of another format is refused
+def test_layout_and_format_check(tmp_path, model):
+    path = str(tmp_path / 'model.crm')
+    save_weights(model, path)
+    header, data_start = read_header(path)
+    assert data_start % 64 == 0
+    assert all(layout['offset'] % 64 == 0 for layout in header['arrays'].values())
+    other = str(tmp_path / 'other.crm')
+    with open(other, 'wb') as other_file:
+        other_file.write(b'not a model')
+    with pytest.raises(ValueError):
+        read_header(other)
+
+# Model.save writes a weights file under the working directory that Model.load restores
+def test_model_save_and_load(tmp_path, monkeypatch, env, model):
+    if type(model) is not Model:
+        pytest.skip('Model.load restores into an instance of the same class')
+    monkeypatch.chdir(tmp_path)
+    model.save('/saved')
+    assert os.path.exists(str(tmp_path / 'saved.crm')) and not os.path.exists(str(tmp_path / 'saved.pkl'))
+    restored = Model(env, FeatureTransformer.from_arrays(model.feature_transformer.to_arrays()), 0.5)
+    version = restored.version
+    restored.load('/saved')
+    assert restored.version != version
+    np.testing.assert_array_equal(restored.predict_batch(STATES), model.predict_batch(STATES))
+
+# a model pickled before the weight matrix, with an SGD regressor for each action and an unextracted featurizer, is converted on
+# load, whatever the way it is unpickled
+def test_legacy_pickle_is_converted(tmp_path, monkeypatch, env):
+    np.random.seed(0)
+    feature_transformer = FeatureTransformer(env, cache_size = 0)
+    X = feature_transformer.transform_batch(STATES).astype(float)
+    regressors = []
+    for action in range(env.action_space.n):
+        regressor = SGDRegressor(learning_rate = 'invscaling', eta0 = 0.01, power_t = 0.25)
+        for G in [0.0, 50.0 * action, 10.0]:
+            regressor.partial_fit(X, np.full(len(X), G))
+        regressors.append(regressor)
+    expected = np.column_stack([regressor.predict(X) for regressor in regressors])
+    legacy_transformer = FeatureTransformer.__new__(FeatureTransformer)
+    legacy_transformer.__dict__.update({'dimensions': feature_transformer.dimensions, 'scaler': feature_transformer.scaler,
+                                        'featurizer': feature_transformer.featurizer})
+    legacy = Model.__new__(Model)
+    legacy.__dict__.update({'env': env, 'models': regressors, 'feature_transformer': legacy_transformer, 'learning_rate': 0.01})
+    joblib.dump(legacy, str(tmp_path / 'legacy.pkl'))
+
+    loaded = load_model(str(tmp_path / 'legacy.crm'))
+    assert 'models' not in loaded.__dict__
+    assert (loaded.schedule, loaded.power_t) == ('invscaling', 0.25)
+    np.testing.assert_array_equal(loaded.t, [regressor.t_ for regressor in regressors])
+    np.testing.assert_allclose(loaded.predict_batch(STATES), expected, rtol = 1e-9)
+    monkeypatch.chdir(tmp_path)
+    restored = Model(env, feature_transformer, 0.5)
+    restored.load('/legacy')
+    np.testing.assert_allclose(restored.predict_batch(STATES), expected, rtol = 1e-9)